@@ -1,4 +1,5 @@
 import logging
+import json
 import uuid
 import os
 import httpx
@@ -10,7 +11,7 @@ from fastapi import (
     WebSocketDisconnect, File, UploadFile, Form
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, Response
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -253,6 +254,41 @@ async def orchestrate_query(req: QueryRequest):
         except httpx.HTTPStatusError as e:
             raise HTTPException(status_code=e.response.status_code, detail=e.response.json())
 
+@app.post("/orchestrate/query/stream")
+async def orchestrate_query_stream(req: QueryRequest):
+    """
+    Proxies a streaming query to the QueryService and relays its Server-Sent Events
+    as they arrive (sources first, then answer tokens, then the full response).
+    """
+    # No read timeout: gaps between tokens are up to the LLM
+    client = httpx.AsyncClient(timeout=httpx.Timeout(60.0, read=None))
+    request = client.build_request("POST", f"{QUERY_SERVICE_URL}/query/stream", json=req.model_dump())
+    response = await client.send(request, stream=True)
+
+    if response.is_error:
+        body = await response.aread()
+        await response.aclose()
+        await client.aclose()
+        try:
+            detail = json.loads(body)
+        except ValueError:
+            detail = body.decode(errors="replace")
+        raise HTTPException(status_code=response.status_code, detail=detail)
+
+    async def relay():
+        try:
+            async for chunk in response.aiter_raw():
+                yield chunk
+        finally:
+            await response.aclose()
+            await client.aclose()
+
+    return StreamingResponse(
+        relay(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/orchestrate/update-schema")
 async def orchestrate_update_schema(req: UpdateSchemaRequest):
     """Proxies a schema update request to the SchemaService."""
@@ -3,10 +3,13 @@ from pathlib import Path
 import traceback
 import asyncio
 import re
+import sqlite3
 import ast
 import json
 from typing import List, Optional, Dict, Any, Type, Literal
 
+import numpy as np
+
 from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
 from sqlalchemy.orm.attributes import flag_modified
 from sqlalchemy.future import select
@@ -40,9 +43,19 @@ from shared.utils import run_agent_gracefully
 
 # Indexing columns for do_dynamic_extraction_work
 from lumina_agents.rag_agent import RAGSystem
+from lumina_agents.embedding_cache import EmbeddingCache
+from lumina_agents.metadata_filter import filterable_fields
+from lumina_agents.index_manifest import record_index
 from shared.database import settings
-from shared.utils import create_text_chunks_from_data, create_column_chunks_from_data
+from shared.utils import (
+    create_text_chunks_from_data, create_column_chunks_from_data,
+    summarizable_columns, build_column_summaries, load_column_summaries, save_column_summaries
+)
+from lumina_agents.query_agents import column_summary_agent
 INDEXES_DIR = Path("/data/indexes")
+COLUMN_INDEX_NAME = "columns" # Faceted per-session column index, shared with the query service
+EMBEDDING_CACHE_DIR = Path("/data/embedding_cache") # Shared with the query service
+EMBEDDING_CACHE: Optional[EmbeddingCache] = None # Opened on startup; None if the volume is unavailable
 
 # ============================================================================
 # Service Setup
@@ -62,6 +75,16 @@ app = FastAPI(
 
 job_manager = JobStatusManager()
 
+
+@app.on_event("startup")
+async def open_embedding_cache():
+    """Open the shared embedding cache; indexing works without it if the volume is missing."""
+    global EMBEDDING_CACHE
+    try:
+        EMBEDDING_CACHE = await asyncio.to_thread(EmbeddingCache, str(EMBEDDING_CACHE_DIR / "embeddings.sqlite"))
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Embedding cache unavailable at {EMBEDDING_CACHE_DIR}, embedding without it: {e}")
+
 # Log startup information
 logger.info(f"🚀 Extraction Service starting up")
 logger.info(f"📁 INDEXES_DIR: {INDEXES_DIR}")
@@ -792,7 +815,9 @@ async def do_dynamic_extraction_work(
         # We need the full, updated dataset to re-index
         query = select(models.ExtractedRecord).where(models.ExtractedRecord.session_id == session_id)
         result = await db.execute(query)
-        all_records_data = [r.data for r in result.scalars().all()] # This now contains the new field
+        all_record_rows = result.scalars().all()
+        all_records_data = [r.data for r in all_record_rows] # This now contains the new field
+        all_record_ids = [r.id for r in all_record_rows]
 
         if not all_records_data:
             logger.warning("No records found after update, skipping indexing.")
@@ -801,29 +826,73 @@ async def do_dynamic_extraction_work(
             await job_manager.update_status(job_id, "PROCESSING", f"Creating index for new column '{safe_field_name}'...")
             
             # Use the same chunking function as the main indexer
-            column_chunks_map = create_column_chunks_from_data(all_records_data, [safe_field_name])
-            new_col_chunk_text = column_chunks_map.get(safe_field_name)
+            column_chunks_map = create_column_chunks_from_data(
+                all_records_data, [safe_field_name], record_ids=all_record_ids
+            )
+            new_col_windows = column_chunks_map.get(safe_field_name)
 
-            if new_col_chunk_text:
+            if new_col_windows:
+                new_col_chunks = [window["text"] for window in new_col_windows]
+                new_col_meta = [{"column_name": safe_field_name, **window["metadata"]} for window in new_col_windows]
                 col_rag = RAGSystem(
                     embed_api_key=settings.NVIDIA_EMBED_API_KEY,
                     rerank_api_key=settings.NVIDIA_RERANK_API_KEY,
-                    gemini_api_key=settings.GOOGLE_GEMINI_API_KEY
+                    gemini_api_key=settings.GOOGLE_GEMINI_API_KEY,
+                    embedding_cache=EMBEDDING_CACHE,
+                    embedding_quantization=settings.EMBEDDING_QUANTIZATION
                 )
-                await asyncio.to_thread(col_rag.index_documents, 
-                                        [new_col_chunk_text],
-                                        base_metadata={
-                                            "session_id": session_id,
-                                            "index_type": f"column_wise",
-                                            "column_name": safe_field_name
-                                        },
-                                        per_chunk_metadata=[{"column_name": safe_field_name}]
-                                    )
-                
-                col_path = INDEXES_DIR / str(session_id) / f"column_{safe_field_name}"
-                col_path.parent.mkdir(parents=True, exist_ok=True)
-                await asyncio.to_thread(col_rag.save_index, str(col_path))
-                logger.info(f"Saved new column-wise index for '{safe_field_name}' to {col_path}")
+                column_index_path = INDEXES_DIR / str(session_id) / COLUMN_INDEX_NAME
+                if column_index_path.exists():
+                    # Faceted session index: swap this column's chunks in place and
+                    # append a delta instead of rewriting the other columns
+                    await asyncio.to_thread(col_rag.load_index, str(column_index_path))
+                    await asyncio.to_thread(
+                        col_rag.replace_facet,
+                        "column_name",
+                        safe_field_name,
+                        new_col_chunks,
+                        base_metadata={
+                            "session_id": session_id,
+                            "index_type": "column_wise",
+                        },
+                        per_chunk_metadata=new_col_meta
+                    )
+                    col_path = column_index_path
+                    await asyncio.to_thread(col_rag.save_index, str(col_path), incremental=True)
+                else:
+                    # Session indexed before the faceted layout: keep one index per column
+                    await asyncio.to_thread(col_rag.index_documents, 
+                                            new_col_chunks,
+                                            base_metadata={
+                                                "session_id": session_id,
+                                                "index_type": f"column_wise",
+                                                "column_name": safe_field_name
+                                            },
+                                            per_chunk_metadata=new_col_meta
+                                        )
+                    
+                    col_path = INDEXES_DIR / str(session_id) / f"column_{safe_field_name}"
+                    col_path.parent.mkdir(parents=True, exist_ok=True)
+                    await asyncio.to_thread(col_rag.save_index, str(col_path))
+                # The manifest's new generation tells the query service to reload this index
+                await asyncio.to_thread(record_index, str(col_path.parent), col_path.name, col_rag.embed_model, len(col_rag.chunk_ids))
+                logger.info(f"Saved column-wise index for '{safe_field_name}' to {col_path}")
+
+                # Refresh the stored summary of this column; the other columns did not change
+                session_dir = INDEXES_DIR / str(session_id)
+                try:
+                    summaries = await asyncio.to_thread(load_column_summaries, session_dir)
+                    if summarizable_columns(all_records_data, [safe_field_name]):
+                        summaries.update(await build_column_summaries(
+                            column_summary_agent,
+                            {safe_field_name: new_col_windows},
+                            existing=summaries
+                        ))
+                    else:
+                        summaries.pop(safe_field_name, None)
+                    await asyncio.to_thread(save_column_summaries, session_dir, summaries)
+                except Exception as e:
+                    logger.warning(f"Could not refresh the summary of column '{safe_field_name}': {e}")
                 
                 # Verify the index was saved and log directory contents
                 if col_path.exists():
@@ -843,33 +912,67 @@ async def do_dynamic_extraction_work(
             else:
                 logger.warning(f"No data found for new column '{safe_field_name}', skipping column index.")
 
-            # 8. Rebuild the Row-wise Index (it's now stale)
-            await job_manager.update_status(job_id, "PROCESSING", "Rebuilding row-wise index with new data...")
-            
-            row_chunks = create_text_chunks_from_data(all_records_data)
+            # 8. Update the Row-wise Index (only the rows that got the new field are stale)
+            row_chunks = create_text_chunks_from_data(all_records_data, record_ids=all_record_ids)
+            per_chunk_meta = [
+                {**filterable_fields(record), "row_index": i, "record_id": record_id}
+                for i, (record, record_id) in enumerate(zip(all_records_data, all_record_ids))
+            ]
+            row_base_metadata = {
+                "session_id": session_id,
+                "index_type": "row_wise",
+            }
             row_wise_rag = RAGSystem(
                 embed_api_key=settings.NVIDIA_EMBED_API_KEY,
                 rerank_api_key=settings.NVIDIA_RERANK_API_KEY,
-                gemini_api_key=settings.GOOGLE_GEMINI_API_KEY
+                gemini_api_key=settings.GOOGLE_GEMINI_API_KEY,
+                embedding_cache=EMBEDDING_CACHE,
+                embedding_quantization=settings.EMBEDDING_QUANTIZATION
             )
-            per_chunk_meta = [{"row_index": i} for i in range(len(row_chunks))]
-            
-            # This will create a *new* index from scratch with the updated data
-            await asyncio.to_thread(
-                row_wise_rag.index_documents, 
-                row_chunks,
-                base_metadata={
-                    "session_id": session_id,
-                    "index_type": "row_wise",
-                },
-                per_chunk_metadata=per_chunk_meta,
-            )
-            
             row_wise_path = INDEXES_DIR / str(session_id) / "row_wise"
             row_wise_path.parent.mkdir(parents=True, exist_ok=True)
-            # This will overwrite the old, stale row-wise index
-            await asyncio.to_thread(row_wise_rag.save_index, str(row_wise_path))
-            logger.info(f"Successfully rebuilt and saved row-wise index to {row_wise_path}")
+
+            can_update_in_place = False
+            if (row_wise_path / "faiss.index").exists():
+                await asyncio.to_thread(row_wise_rag.load_index, str(row_wise_path))
+                # Indexes built before stable record ids are keyed by position and must be rebuilt
+                first_meta = next(iter(row_wise_rag.chunks_metadata.values()), {})
+                can_update_in_place = "record_id" in first_meta
+
+            if can_update_in_place:
+                await job_manager.update_status(job_id, "PROCESSING", "Updating row-wise index with new data...")
+                updated_ids = {record.id for record in updated_records_list}
+                positions = [i for i, record_id in enumerate(all_record_ids) if record_id in updated_ids]
+                await asyncio.to_thread(
+                    row_wise_rag.update_documents,
+                    [row_chunks[i] for i in positions],
+                    ids=[all_record_ids[i] for i in positions],
+                    base_metadata=row_base_metadata,
+                    per_chunk_metadata=[per_chunk_meta[i] for i in positions],
+                )
+                # Drop rows whose records no longer exist
+                chunk_ids = row_wise_rag.chunk_ids
+                removed_ids = chunk_ids[~np.isin(chunk_ids, np.asarray(all_record_ids, dtype=np.int64))]
+                await asyncio.to_thread(row_wise_rag.remove_documents, removed_ids)
+
+                await asyncio.to_thread(row_wise_rag.save_index, str(row_wise_path), incremental=True)
+                logger.info(f"Updated {len(positions)} rows (removed {len(removed_ids)}) in row-wise index at {row_wise_path}")
+            else:
+                await job_manager.update_status(job_id, "PROCESSING", "Rebuilding row-wise index with new data...")
+                # This will create a *new* index from scratch with the updated data
+                await asyncio.to_thread(
+                    row_wise_rag.index_documents, 
+                    row_chunks,
+                    ids=all_record_ids,
+                    base_metadata=row_base_metadata,
+                    per_chunk_metadata=per_chunk_meta,
+                )
+                # This will overwrite the old, stale row-wise index
+                await asyncio.to_thread(row_wise_rag.save_index, str(row_wise_path))
+                logger.info(f"Successfully rebuilt and saved row-wise index to {row_wise_path}")
+            await asyncio.to_thread(record_index, str(row_wise_path.parent), "row_wise", row_wise_rag.embed_model, len(row_wise_rag.chunk_ids))
+            if EMBEDDING_CACHE is not None:
+                logger.info(f"Embedding cache stats after reindexing: {EMBEDDING_CACHE.stats()}")
         
         
         # 6. Finalize Job
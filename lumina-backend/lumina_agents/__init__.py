@@ -127,6 +127,7 @@ from .query_agents import (
     # Agents
     query_router_agent,
     synthesis_agent,
+    column_summary_agent,
     
     # Pydantic Models
     QueryIntent,
@@ -140,6 +141,39 @@ from .rag_agent import (
     RAGSystem,
 )
 
+from .embedding_engine import (
+    AsyncEmbeddingEngine,
+)
+
+from .embedding_cache import (
+    EmbeddingCache,
+    QueryEmbeddingCache,
+)
+
+from .reranker_client import (
+    AsyncRerankerClient,
+    RerankScoreCache,
+)
+
+from .chunk_store import (
+    ChunkStore,
+)
+
+from .ann_index import (
+    choose_index_type,
+    evaluate_index_types,
+)
+
+from .bm25_index import (
+    BM25Index,
+    reciprocal_rank_fusion,
+)
+
+from .metadata_filter import (
+    MetadataIndex,
+    parse_row_filters,
+)
+
 # ============================================================================
 # Package Metadata
 # ============================================================================
@@ -194,8 +228,21 @@ __all__ = [
     # Query Agents
     "query_router_agent",
     "synthesis_agent",
+    "column_summary_agent",
     "QueryIntent",
     
     # RAG System
     "RAGSystem",
+    "AsyncEmbeddingEngine",
+    "EmbeddingCache",
+    "QueryEmbeddingCache",
+    "AsyncRerankerClient",
+    "RerankScoreCache",
+    "ChunkStore",
+    "choose_index_type",
+    "evaluate_index_types",
+    "BM25Index",
+    "reciprocal_rank_fusion",
+    "MetadataIndex",
+    "parse_row_filters",
 ]
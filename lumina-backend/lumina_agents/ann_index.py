@@ -0,0 +1,514 @@
+"""
+FAISS index factory for the RAG system.
+
+Exact search (IndexFlatIP) is fine for small sessions, but its cost grows
+linearly with the number of vectors. This module picks an approximate index
+type from the corpus size, builds (and trains, where required) it over the
+normalized embeddings, and applies the search-time parameters. All indexes are
+wrapped in IndexIDMap2 so they are addressed by the same stable chunk ids.
+
+Index types:
+- "flat": exact inner-product search (small corpora)
+- "hnsw": graph-based search, no training, fast and high recall (medium corpora)
+- "ivfpq": inverted lists + product quantization, trained, compact (very large corpora)
+
+Flat and HNSW indexes can store their vectors scalar-quantized ("fp16" halves
+and "int8" quarters the memory); the stored embeddings.npy can be quantized the
+same way, with a per-vector scale for int8.
+
+Key Components:
+- choose_index_type: Picks an index type from the vector count
+- default_index_params: Build/search parameters sized for the corpus
+- build_index: Builds and trains an id-mapped index
+- configure_search: Applies search-time parameters (efSearch / nprobe)
+- search_index: Searches an index, re-scoring compressed (PQ) candidates exactly
+- read_index / copy_index: Zero-copy (memory-mapped) loading and materializing it for updates
+- StackedRows: Read-only rows of a memory-mapped array followed by a small in-memory tail
+- quantize_vectors / dequantize_rows: Compact embedding storage and reading it back as float32
+- evaluate_index_types: Recall@k and latency of each type against the flat baseline
+- evaluate_quantization: Recall@k, latency and bytes per vector of each quantization against float32
+"""
+
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+
+INDEX_TYPES = ("flat", "hnsw", "ivfpq")
+
+# Corpus sizes at which "auto" switches to an approximate index
+HNSW_MIN_VECTORS = 50_000
+IVFPQ_MIN_VECTORS = 1_000_000
+
+# Storage precisions for index vectors and stored embeddings
+QUANTIZATION_TYPES = ("none", "fp16", "int8")
+
+# faiss scalar quantizers per precision; QT_8bit learns a range per dimension
+_SQ_TYPES = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+# Per-dimension int8 ranges are learned only from at least this many vectors;
+# smaller first batches use the full [-1, 1] range of normalized vectors
+SQ_MIN_TRAIN_VECTORS = 1_000
+
+# Index types whose vectors can be removed in place
+REMOVABLE_INDEX_TYPES = ("flat", "ivfpq")
+
+# Index types whose vector storage can be memory-mapped instead of copied into RAM.
+# IVF-PQ codes are already compact and faiss cannot copy a mapped IVF back into memory.
+MMAP_INDEX_TYPES = ("flat", "hnsw")
+
+
+def choose_index_type(
+    n_vectors: int,
+    hnsw_min_vectors: int = HNSW_MIN_VECTORS,
+    ivfpq_min_vectors: int = IVFPQ_MIN_VECTORS
+) -> str:
+    """
+    Pick an index type for a corpus of n_vectors.
+
+    Args:
+        n_vectors: Number of vectors that will be indexed
+        hnsw_min_vectors: Smallest corpus that uses HNSW
+        ivfpq_min_vectors: Smallest corpus that uses IVF-PQ
+
+    Returns:
+        One of INDEX_TYPES
+    """
+    if n_vectors >= ivfpq_min_vectors:
+        return "ivfpq"
+    if n_vectors >= hnsw_min_vectors:
+        return "hnsw"
+    return "flat"
+
+
+def _pq_subquantizers(d: int, max_m: int = 64) -> int:
+    """Largest number of PQ sub-quantizers <= max_m that divides the dimension."""
+    for m in range(min(max_m, d), 0, -1):
+        if d % m == 0:
+            return m
+    return 1
+
+
+def default_index_params(index_type: str, n_vectors: int, d: int, quantization: str = "none") -> Dict[str, Any]:
+    """
+    Build and search parameters for an index type, sized for the corpus.
+
+    Args:
+        index_type: One of INDEX_TYPES
+        n_vectors: Number of vectors that will be indexed
+        d: Embedding dimension
+        quantization: One of QUANTIZATION_TYPES; applies to flat and HNSW vector
+            storage (IVF-PQ codes are already compressed)
+
+    Returns:
+        Dict of parameters understood by build_index / configure_search
+    """
+    if quantization not in QUANTIZATION_TYPES:
+        raise ValueError(f"Unknown quantization '{quantization}'. Expected one of {QUANTIZATION_TYPES}.")
+    sq: Dict[str, Any] = {"quantization": quantization} if quantization != "none" else {}
+    if quantization == "int8":
+        # int8 candidates are re-scored from the stored embeddings, like IVF-PQ
+        sq["refine_factor"] = 2
+    if index_type == "hnsw":
+        return {"M": 32, "efConstruction": 200, "efSearch": 128, **sq}
+    if index_type == "ivfpq":
+        nlist = int(np.clip(4 * np.sqrt(max(n_vectors, 1)), 16, 65536))
+        return {
+            "nlist": nlist,
+            "m": _pq_subquantizers(d),
+            "nbits": 8,
+            "nprobe": min(32, nlist),
+            # Candidates fetched per result and re-scored exactly from the stored embeddings
+            "refine_factor": 4,
+            # Training on a sample is much faster and loses little accuracy
+            "train_size": min(n_vectors, max(50 * nlist, 100_000)),
+        }
+    return sq
+
+
+def build_index(
+    index_type: str,
+    vectors: np.ndarray,
+    ids: np.ndarray,
+    params: Optional[Dict[str, Any]] = None
+) -> faiss.Index:
+    """
+    Build an id-mapped index of the given type over L2-normalized vectors.
+
+    Args:
+        index_type: One of INDEX_TYPES
+        vectors: Normalized float32 array of shape (n, d)
+        ids: int64 stable chunk ids aligned with vectors
+        params: Parameters from default_index_params (computed if omitted)
+
+    Returns:
+        An IndexIDMap2 containing all vectors, ready to search
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}'. Expected one of {INDEX_TYPES}.")
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    n, d = vectors.shape
+    params = params or default_index_params(index_type, n, d)
+
+    sq_type = _SQ_TYPES.get(params.get("quantization", "none"))
+    if index_type == "hnsw":
+        if sq_type is not None:
+            inner = faiss.IndexHNSWSQ(d, sq_type, params["M"], faiss.METRIC_INNER_PRODUCT)
+            _train_scalar_quantizer(inner, vectors)
+        else:
+            inner = faiss.IndexHNSWFlat(d, params["M"], faiss.METRIC_INNER_PRODUCT)
+        inner.hnsw.efConstruction = params["efConstruction"]
+    elif index_type == "ivfpq":
+        quantizer = faiss.IndexFlatIP(d)
+        inner = faiss.IndexIVFPQ(quantizer, d, params["nlist"], params["m"], params["nbits"], faiss.METRIC_INNER_PRODUCT)
+        train_size = min(params.get("train_size", n), n)
+        sample = vectors
+        if train_size < n:
+            rng = np.random.default_rng(0)
+            sample = vectors[np.sort(rng.choice(n, size=train_size, replace=False))]
+        inner.train(sample)
+    elif sq_type is not None:
+        inner = faiss.IndexScalarQuantizer(d, sq_type, faiss.METRIC_INNER_PRODUCT)
+        _train_scalar_quantizer(inner, vectors)
+    else:
+        inner = faiss.IndexFlatIP(d)
+
+    # faiss' python wrappers keep the inner index and quantizer alive with the id map
+    index = faiss.IndexIDMap2(inner)
+    if n:
+        index.add_with_ids(vectors, ids)
+    configure_search(index, index_type, params)
+    return index
+
+
+def _train_scalar_quantizer(index: faiss.Index, vectors: np.ndarray) -> None:
+    """Learn per-dimension ranges, falling back to [-1, 1] when there are too few vectors."""
+    if len(vectors) < SQ_MIN_TRAIN_VECTORS:
+        d = vectors.shape[1]
+        vectors = np.vstack([vectors, np.ones((1, d), dtype=np.float32), -np.ones((1, d), dtype=np.float32)])
+    index.train(vectors)
+
+
+def configure_search(index: faiss.Index, index_type: str, params: Dict[str, Any]) -> None:
+    """Apply search-time parameters (HNSW efSearch, IVF nprobe) to an index."""
+    if index_type == "hnsw" and "efSearch" in params:
+        inner = faiss.downcast_index(index.index if hasattr(index, "id_map") else index)
+        inner.hnsw.efSearch = params["efSearch"]
+    elif index_type == "ivfpq" and "nprobe" in params:
+        faiss.extract_index_ivf(index).nprobe = params["nprobe"]
+
+
+def search_parameters(
+    index: faiss.Index,
+    index_type: str,
+    params: Dict[str, Any],
+    selector: faiss.IDSelector
+) -> faiss.SearchParameters:
+    """Per-search parameters restricting a search to the ids accepted by selector."""
+    if index_type == "hnsw":
+        inner = faiss.downcast_index(index.index if hasattr(index, "id_map") else index)
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=params.get("efSearch", inner.hnsw.efSearch))
+    if index_type == "ivfpq":
+        return faiss.SearchParametersIVF(sel=selector, nprobe=params.get("nprobe", faiss.extract_index_ivf(index).nprobe))
+    return faiss.SearchParameters(sel=selector)
+
+
+def read_index(path: str, index_type: str = "flat", mmap: bool = False) -> faiss.Index:
+    """
+    Read an index file, memory-mapping its vector storage if requested.
+
+    A mapped index is read-only: faiss aborts the process if it is modified, so
+    use copy_index() before adding or removing vectors.
+
+    Args:
+        path: Path of the faiss index file
+        index_type: One of INDEX_TYPES (decides whether mapping is possible)
+        mmap: If True, map the vectors instead of reading them into memory
+
+    Returns:
+        The loaded index
+    """
+    # IO_FLAG_MMAP_IFC only exists in recent faiss releases
+    mmap_flag = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+    if mmap and mmap_flag is not None and index_type in MMAP_INDEX_TYPES:
+        return faiss.read_index(path, mmap_flag)
+    return faiss.read_index(path)
+
+
+def is_mapped(index_type: str, mmap: bool) -> bool:
+    """Whether read_index(..., index_type, mmap) returns a memory-mapped index."""
+    return mmap and hasattr(faiss, "IO_FLAG_MMAP_IFC") and index_type in MMAP_INDEX_TYPES
+
+
+def copy_index(index: faiss.Index) -> faiss.Index:
+    """Deep copy of an index into memory it owns (e.g. to modify a mapped index)."""
+    return faiss.deserialize_index(faiss.serialize_index(index))
+
+
+class StackedRows:
+    """
+    Read-only concatenation of a (memory-mapped) base array and an in-memory tail.
+
+    Lets delta rows be appended to a mapped embeddings.npy without copying it:
+    row lookups are served from whichever part holds the row, and only
+    np.asarray() on the whole thing materializes the concatenation.
+    """
+
+    def __init__(self, base: np.ndarray, tail: np.ndarray):
+        self.base = base
+        self.tail = np.asarray(tail, dtype=base.dtype)
+        self.shape = (len(base) + len(self.tail),) + tuple(base.shape[1:])
+        self.dtype = base.dtype
+        self.ndim = base.ndim
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, rows: Any) -> np.ndarray:
+        if isinstance(rows, (int, np.integer)):
+            row = int(rows) + len(self) if rows < 0 else int(rows)
+            return self.base[row] if row < len(self.base) else self.tail[row - len(self.base)]
+        if isinstance(rows, slice):
+            rows = np.arange(len(self))[rows]
+        rows = np.asarray(rows)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        rows = rows.astype(np.int64, copy=False)
+        out = np.empty((len(rows),) + self.shape[1:], dtype=self.dtype)
+        in_base = rows < len(self.base)
+        out[in_base] = self.base[rows[in_base]]
+        out[~in_base] = self.tail[rows[~in_base] - len(self.base)]
+        return out
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        stacked = np.concatenate([self.base, self.tail])
+        return stacked if dtype is None else stacked.astype(dtype, copy=False)
+
+
+def quantize_vectors(vectors: np.ndarray, quantization: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Compact storage for normalized embeddings.
+
+    Args:
+        vectors: float32 array of shape (n, d)
+        quantization: One of QUANTIZATION_TYPES
+
+    Returns:
+        (stored, scales): float32 / float16 / int8 rows, and for int8 the float32
+        per-row scale that maps codes back to values (None otherwise)
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if quantization == "fp16":
+        return vectors.astype(np.float16), None
+    if quantization == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0 if len(vectors) else np.empty(0, dtype=np.float32)
+        scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales
+    return vectors, None
+
+
+def dequantize_rows(stored: np.ndarray, scales: Optional[np.ndarray] = None, rows: Any = None) -> np.ndarray:
+    """float32 values of the given rows (all rows if None) of quantize_vectors() output."""
+    values = np.asarray(stored if rows is None else stored[rows], dtype=np.float32)
+    if scales is not None:
+        values = values * np.asarray(scales if rows is None else scales[rows], dtype=np.float32)[:, None]
+    return values
+
+
+def search_index(
+    index: faiss.Index,
+    index_type: str,
+    params: Dict[str, Any],
+    queries: np.ndarray,
+    k: int,
+    exact_vectors: Optional[np.ndarray] = None,
+    row_of_id: Optional[Dict[int, int]] = None,
+    id_filter: Optional[np.ndarray] = None,
+    exact_scales: Optional[np.ndarray] = None,
+    excluded_ids: Optional[np.ndarray] = None
+):
+    """
+    Search an index, re-scoring compressed candidates with the exact vectors if given.
+
+    PQ and int8 codes only approximate the vectors, so for indexes with a
+    refine_factor (IVF-PQ, int8) we fetch k * refine_factor candidates and
+    re-rank them by exact inner product against exact_vectors (rows looked up
+    through row_of_id).
+
+    Args:
+        index: Index built by build_index
+        index_type: One of INDEX_TYPES
+        params: The index parameters
+        queries: Normalized float32 queries of shape (q, d)
+        k: Number of results per query
+        exact_vectors: Optional (n, d) stored embeddings for re-scoring
+        row_of_id: Mapping from chunk id to row of exact_vectors (identity if omitted)
+        id_filter: If given, only these ids are considered (faiss ID selector, applied
+            during the search rather than to its results)
+        exact_scales: Per-row scales when exact_vectors holds int8 codes
+        excluded_ids: If given (and id_filter is not), these ids are skipped
+
+    Returns:
+        (scores, ids) arrays of shape (q, k), padded with -1 ids like faiss
+    """
+    search_params = None
+    if id_filter is not None:
+        # The selector must outlive the search, so keep a reference in this frame
+        selector = faiss.IDSelectorBatch(np.ascontiguousarray(id_filter, dtype=np.int64))
+        search_params = search_parameters(index, index_type, params, selector)
+    elif excluded_ids is not None and len(excluded_ids):
+        excluded = faiss.IDSelectorBatch(np.ascontiguousarray(excluded_ids, dtype=np.int64))
+        selector = faiss.IDSelectorNot(excluded)
+        search_params = search_parameters(index, index_type, params, selector)
+
+    refine_factor = params.get("refine_factor", 1)
+    if exact_vectors is None or refine_factor <= 1:
+        return index.search(queries, k, params=search_params)
+
+    _, candidate_ids = index.search(queries, k * refine_factor, params=search_params)
+    scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    ids = np.full((len(queries), k), -1, dtype=np.int64)
+    for qi, candidates in enumerate(candidate_ids):
+        candidates = candidates[candidates != -1]
+        if row_of_id is not None:
+            candidates = np.asarray([c for c in candidates.tolist() if c in row_of_id], dtype=np.int64)
+            rows = np.asarray([row_of_id[c] for c in candidates.tolist()], dtype=np.int64)
+        else:
+            rows = candidates
+        if len(candidates) == 0:
+            continue
+        exact = dequantize_rows(exact_vectors, exact_scales, rows) @ queries[qi]
+        order = np.argsort(-exact)[:k]
+        scores[qi, :len(order)] = exact[order]
+        ids[qi, :len(order)] = candidates[order]
+    return scores, ids
+
+
+def evaluate_index_types(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    index_types: Optional[List[str]] = None,
+    params_by_type: Optional[Dict[str, Dict[str, Any]]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Measure recall@k and query latency of index types against exact search.
+
+    Args:
+        vectors: Normalized corpus vectors of shape (n, d)
+        queries: Normalized query vectors of shape (q, d)
+        k: Number of neighbours compared
+        index_types: Types to evaluate (defaults to all)
+        params_by_type: Optional parameter overrides per type
+
+    Returns:
+        One dict per index type with build time, mean/p50/p95 latency (ms) and recall@k
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    ids = np.arange(len(vectors), dtype=np.int64)
+    params_by_type = params_by_type or {}
+
+    baseline = build_index("flat", vectors, ids)
+    _, truth = baseline.search(queries, k)
+
+    report = []
+    for index_type in index_types or list(INDEX_TYPES):
+        params = params_by_type.get(index_type) or default_index_params(index_type, len(vectors), vectors.shape[1])
+
+        start = time.perf_counter()
+        index = build_index(index_type, vectors, ids, params)
+        build_seconds = time.perf_counter() - start
+
+        latencies = []
+        found = np.empty_like(truth)
+        for i in range(len(queries)):
+            start = time.perf_counter()
+            _, hits = search_index(index, index_type, params, queries[i:i + 1], k, exact_vectors=vectors)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found[i] = hits[0]
+
+        overlap = [len(set(found[i]) & set(truth[i])) / k for i in range(len(queries))]
+        report.append({
+            "index_type": index_type,
+            "params": params,
+            "build_seconds": round(build_seconds, 3),
+            "latency_ms_mean": round(float(np.mean(latencies)), 3),
+            "latency_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+            "latency_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+            f"recall@{k}": round(float(np.mean(overlap)), 4),
+        })
+    return report
+
+
+def evaluate_quantization(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    index_type: str = "flat",
+    quantizations: Optional[List[str]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Measure what scalar quantization costs in recall and saves in memory.
+
+    Each quantization is compared with exact float32 search: recall@k of its
+    index, query latency, and the bytes per vector of the index and of the
+    stored embeddings (what a loaded session keeps in RAM or on disk).
+
+    Args:
+        vectors: Normalized corpus vectors of shape (n, d)
+        queries: Normalized query vectors of shape (q, d)
+        k: Number of neighbours compared
+        index_type: "flat" or "hnsw"
+        quantizations: Quantizations to evaluate (defaults to all)
+
+    Returns:
+        One dict per quantization with build time, mean/p50/p95 latency (ms),
+        recall@k and index/embedding bytes per vector
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    ids = np.arange(len(vectors), dtype=np.int64)
+
+    _, truth = build_index("flat", vectors, ids).search(queries, k)
+
+    report = []
+    for quantization in quantizations or list(QUANTIZATION_TYPES):
+        params = default_index_params(index_type, len(vectors), vectors.shape[1], quantization)
+
+        start = time.perf_counter()
+        index = build_index(index_type, vectors, ids, params)
+        build_seconds = time.perf_counter() - start
+
+        # Searched the way RAGSystem does, re-scoring from the stored embeddings where configured
+        stored, scales = quantize_vectors(vectors, quantization)
+        latencies = []
+        found = np.empty_like(truth)
+        for i in range(len(queries)):
+            start = time.perf_counter()
+            _, hits = search_index(index, index_type, params, queries[i:i + 1], k, exact_vectors=stored, exact_scales=scales)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found[i] = hits[0]
+
+        embedding_bytes = stored.nbytes + (scales.nbytes if scales is not None else 0)
+        overlap = [len(set(found[i]) & set(truth[i])) / k for i in range(len(queries))]
+        report.append({
+            "quantization": quantization,
+            "index_type": index_type,
+            "build_seconds": round(build_seconds, 3),
+            "latency_ms_mean": round(float(np.mean(latencies)), 3),
+            "latency_ms_p50": round(float(np.percentile(latencies, 50)), 3),
+            "latency_ms_p95": round(float(np.percentile(latencies, 95)), 3),
+            f"recall@{k}": round(float(np.mean(overlap)), 4),
+            "index_bytes_per_vector": round(len(faiss.serialize_index(index)) / max(len(vectors), 1), 1),
+            "embedding_bytes_per_vector": round(embedding_bytes / max(len(vectors), 1), 1),
+        })
+    return report
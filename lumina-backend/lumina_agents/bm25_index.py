@@ -0,0 +1,360 @@
+"""
+Lexical (BM25) index for hybrid retrieval in the RAG system.
+
+Dense retrieval is weak on exact-match queries such as author names, record
+IDs, DOIs and units, which the embedding model tends to blur. This module keeps
+an inverted index over the chunk texts, scored with Okapi BM25, and a
+reciprocal-rank fusion helper that merges its ranking with the faiss ranking.
+
+The index follows the same layout as the chunk store: a saved file (bm25.npz,
+next to faiss.index) is never modified. It holds the postings in CSR form and
+is loaded as a few flat arrays. Documents added or removed afterwards live in
+an in-memory overlay until the next full save writes a new file.
+
+Key Components:
+- BM25Index: Inverted index keyed by stable chunk id, with incremental add/remove
+- reciprocal_rank_fusion: Fuse several ranked id lists into one ranking
+- tokenize: The tokenizer shared by indexing and querying
+"""
+
+import math
+import re
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+BM25_FILE = "bm25.npz"
+
+_WORD_RE = re.compile(r"\w+")
+# Identifier-like runs joined by . - / (e.g. "10.1021/acs.jpcc", "mg/L", "C-12")
+_COMPOUND_RE = re.compile(r"\b\w+(?:[./-]\w+)+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase and split text into terms.
+
+    Compound identifiers are indexed whole as well as by their parts, so
+    "10.1021/acs.jpcc" matches both the exact DOI and a query for "jpcc".
+    """
+    text = text.lower()
+    terms = _WORD_RE.findall(text)
+    terms.extend(_COMPOUND_RE.findall(text))
+    return terms
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[int]],
+    k: int = 60,
+    top_k: Optional[int] = None
+) -> List[Tuple[int, float]]:
+    """
+    Fuse ranked lists of ids with reciprocal-rank fusion.
+
+    Each id scores sum(1 / (k + rank)) over the lists it appears in (rank
+    starting at 1), so items ranked well by several retrievers rise to the top
+    without having to calibrate their raw scores against each other.
+
+    Args:
+        rankings: Ranked id lists, best first
+        k: Damping constant (60 in the original paper)
+        top_k: If provided, truncate the fused ranking to this size
+
+    Returns:
+        List of (id, fused score), best first
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank)
+    ordered = sorted(fused.items(), key=lambda kv: kv[1], reverse=True)
+    return ordered[:top_k] if top_k is not None else ordered
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index over chunk texts, keyed by stable chunk id.
+
+    Example:
+        >>> bm25 = BM25Index()
+        >>> bm25.add([1, 2], ["Smith et al. 2021", "Jones 2019"])
+        >>> ids, scores = bm25.search("smith", top_k=10)
+        >>> bm25.write("/data/indexes/1/row_wise/bm25.npz")
+        >>> bm25 = BM25Index.load("/data/indexes/1/row_wise/bm25.npz")
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """
+        Create an empty index.
+
+        Args:
+            k1: Term-frequency saturation
+            b: Document-length normalization strength
+        """
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+
+        # Base (loaded from file): sorted vocabulary, CSR postings, rows sorted by chunk id
+        self._terms = np.empty(0, dtype=str)
+        self._term_offsets = np.zeros(1, dtype=np.int64)
+        self._posting_rows = np.empty(0, dtype=np.int32)
+        self._posting_tfs = np.empty(0, dtype=np.uint16)
+        self._base_ids = np.empty(0, dtype=np.int64)
+        self._base_lens = np.empty(0, dtype=np.int32)
+        self._alive = np.empty(0, dtype=bool)
+
+        # Overlay (added since load): chunk id -> term counts, and term -> {chunk id: tf}
+        self._overlay_docs: Dict[int, Counter] = {}
+        self._overlay_postings: Dict[str, Dict[int, int]] = {}
+
+        self._n_docs = 0
+        self._total_len = 0
+
+    def __len__(self) -> int:
+        return self._n_docs
+
+    # --------------------------------------------------------------------------
+    # Updates
+    # --------------------------------------------------------------------------
+
+    def _base_row(self, chunk_id: int) -> Optional[int]:
+        """Row of a live base document, or None. Caller holds _lock."""
+        row = int(np.searchsorted(self._base_ids, chunk_id))
+        if row < len(self._base_ids) and self._base_ids[row] == chunk_id and self._alive[row]:
+            return row
+        return None
+
+    def _remove(self, chunk_id: int) -> None:
+        """Caller holds _lock."""
+        counts = self._overlay_docs.pop(chunk_id, None)
+        if counts is not None:
+            for term in counts:
+                postings = self._overlay_postings[term]
+                del postings[chunk_id]
+                if not postings:
+                    del self._overlay_postings[term]
+            self._n_docs -= 1
+            self._total_len -= sum(counts.values())
+            return
+
+        row = self._base_row(chunk_id)
+        if row is not None:
+            self._alive[row] = False
+            self._n_docs -= 1
+            self._total_len -= int(self._base_lens[row])
+
+    def add(self, ids: Iterable[int], texts: Iterable[str]) -> None:
+        """
+        Index texts under their chunk ids, replacing any previous version.
+
+        Args:
+            ids: Stable chunk ids
+            texts: Chunk texts aligned with ids
+        """
+        with self._lock:
+            for chunk_id, text in zip(ids, texts):
+                chunk_id = int(chunk_id)
+                self._remove(chunk_id)
+                counts = Counter(tokenize(text))
+                self._overlay_docs[chunk_id] = counts
+                for term, tf in counts.items():
+                    self._overlay_postings.setdefault(term, {})[chunk_id] = tf
+                self._n_docs += 1
+                self._total_len += sum(counts.values())
+
+    def remove(self, ids: Iterable[int]) -> None:
+        """Drop chunks from the index (unknown ids are ignored)."""
+        with self._lock:
+            for chunk_id in ids:
+                self._remove(int(chunk_id))
+
+    # --------------------------------------------------------------------------
+    # Search
+    # --------------------------------------------------------------------------
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 10,
+        allowed_ids: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Rank chunks against a query with BM25.
+
+        Args:
+            query: Query text
+            top_k: Number of results to return
+            allowed_ids: If given, only these chunk ids can be returned
+
+        Returns:
+            (chunk ids, scores) of the best matches, best first; only chunks
+            sharing at least one term with the query are returned
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            if not terms or self._n_docs == 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+            k1, b = self.k1, self.b
+            avgdl = self._total_len / self._n_docs
+            ids_parts: List[np.ndarray] = []
+            score_parts: List[np.ndarray] = []
+
+            for term in terms:
+                # Base postings of the term (the vocabulary is sorted)
+                pos = int(np.searchsorted(self._terms, term))
+                if pos < len(self._terms) and self._terms[pos] == term:
+                    start, end = self._term_offsets[pos], self._term_offsets[pos + 1]
+                    live = self._alive[self._posting_rows[start:end]]
+                    rows = self._posting_rows[start:end][live]
+                    tfs = self._posting_tfs[start:end][live].astype(np.float32)
+                else:
+                    rows = self._posting_rows[:0]
+                overlay = self._overlay_postings.get(term, {})
+
+                df = len(rows) + len(overlay)
+                if df == 0:
+                    continue
+                idf = math.log(1.0 + (self._n_docs - df + 0.5) / (df + 0.5))
+
+                if len(rows):
+                    norm = k1 * (1.0 - b + b * self._base_lens[rows] / avgdl)
+                    ids_parts.append(self._base_ids[rows])
+                    score_parts.append(idf * tfs * (k1 + 1.0) / (tfs + norm))
+                if overlay:
+                    overlay_ids = np.fromiter(overlay.keys(), dtype=np.int64, count=len(overlay))
+                    tfs = np.fromiter(overlay.values(), dtype=np.float32, count=len(overlay))
+                    lens = np.array([sum(self._overlay_docs[i].values()) for i in overlay_ids.tolist()], dtype=np.float32)
+                    norm = k1 * (1.0 - b + b * lens / avgdl)
+                    ids_parts.append(overlay_ids)
+                    score_parts.append(idf * tfs * (k1 + 1.0) / (tfs + norm))
+
+        if not ids_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        # Sum per-term contributions per chunk
+        ids, inverse = np.unique(np.concatenate(ids_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts)).astype(np.float32)
+        if allowed_ids is not None:
+            keep = np.isin(ids, allowed_ids)
+            ids, scores = ids[keep], scores[keep]
+
+        if len(ids) > top_k:
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            top = np.arange(len(ids))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return ids[top], scores[top]
+
+    # --------------------------------------------------------------------------
+    # Persistence
+    # --------------------------------------------------------------------------
+
+    def write(self, path: str) -> None:
+        """
+        Write the merged base + overlay to a new file at path.
+
+        Args:
+            path: Destination path (write to a temp path and rename for atomicity)
+        """
+        with self._lock:
+            # 1. Vocabulary: the base terms plus the terms only the overlay uses. Postings
+            # refer to terms by integer index; strings are only handled once per term.
+            overlay_terms = sorted(self._overlay_postings)
+            base_vocab = set(self._terms.tolist()) if overlay_terms else set()
+            new_terms = [term for term in overlay_terms if term not in base_vocab]
+            vocab = np.sort(np.concatenate([self._terms, np.array(new_terms, dtype=str)])) \
+                if new_terms else self._terms
+            term_index_of = dict(zip(overlay_terms, np.searchsorted(vocab, overlay_terms).tolist())) \
+                if overlay_terms else {}
+
+            # 2. Live base postings as (term index, chunk id, tf)
+            base_remap = np.searchsorted(vocab, self._terms) if new_terms else np.arange(len(self._terms))
+            base_terms_of_posting = np.repeat(base_remap, np.diff(self._term_offsets))
+            live = self._alive[self._posting_rows]
+            base_term_index = base_terms_of_posting[live]
+            base_chunk_ids = self._base_ids[self._posting_rows[live]]
+            base_tfs = self._posting_tfs[live]
+
+            # 3. Overlay postings
+            overlay_term_index, overlay_ids, overlay_tfs = [], [], []
+            for term in overlay_terms:
+                postings = self._overlay_postings[term]
+                overlay_term_index.extend([term_index_of[term]] * len(postings))
+                overlay_ids.extend(postings.keys())
+                overlay_tfs.extend(postings.values())
+
+            # 4. Documents, sorted by chunk id
+            doc_ids = np.concatenate([
+                self._base_ids[self._alive],
+                np.fromiter(self._overlay_docs.keys(), dtype=np.int64, count=len(self._overlay_docs)),
+            ])
+            doc_lens = np.concatenate([
+                self._base_lens[self._alive],
+                np.array([sum(c.values()) for c in self._overlay_docs.values()], dtype=np.int32),
+            ])
+
+        order = np.argsort(doc_ids, kind="stable")
+        doc_ids, doc_lens = doc_ids[order], doc_lens[order]
+
+        term_index = np.concatenate([base_term_index, np.asarray(overlay_term_index, dtype=np.int64)])
+        all_ids = np.concatenate([base_chunk_ids, np.asarray(overlay_ids, dtype=np.int64)])
+        all_tfs = np.concatenate([base_tfs, np.minimum(np.asarray(overlay_tfs, dtype=np.int64), 65535).astype(np.uint16)])
+
+        # 5. Drop terms left without live postings, then sort postings by (term, row) into CSR
+        counts = np.bincount(term_index, minlength=len(vocab))
+        used = counts > 0
+        if not used.all():
+            term_index = (np.cumsum(used) - 1)[term_index]
+            vocab, counts = vocab[used], counts[used]
+        rows = np.searchsorted(doc_ids, all_ids).astype(np.int32)
+        order = np.lexsort((rows, term_index))
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        with open(path, "wb") as f:
+            np.savez(
+                f,
+                terms=vocab,
+                term_offsets=offsets,
+                posting_rows=rows[order],
+                posting_tfs=all_tfs[order],
+                doc_ids=doc_ids,
+                doc_lens=doc_lens,
+                params=np.array([self.k1, self.b], dtype=np.float64),
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Load an index written by BM25Index.write."""
+        with np.load(path, allow_pickle=False) as data:
+            k1, b = data["params"].tolist()
+            index = cls(k1=k1, b=b)
+            index._terms = data["terms"]
+            index._term_offsets = data["term_offsets"]
+            index._posting_rows = data["posting_rows"]
+            index._posting_tfs = data["posting_tfs"]
+            index._base_ids = data["doc_ids"]
+            index._base_lens = data["doc_lens"]
+        index._alive = np.ones(len(index._base_ids), dtype=bool)
+        index._n_docs = len(index._base_ids)
+        index._total_len = int(index._base_lens.sum())
+        return index
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict], **kwargs) -> "BM25Index":
+        """Build an index from chunk records (dicts with "id" and "text"), e.g. ChunkStore.records()."""
+        index = cls(**kwargs)
+        ids, texts = [], []
+        for meta in records:
+            ids.append(int(meta["id"]))
+            texts.append(meta["text"])
+            if len(ids) >= 10_000:
+                index.add(ids, texts)
+                ids, texts = [], []
+        index.add(ids, texts)
+        return index
@@ -0,0 +1,245 @@
+"""
+SQLite-backed chunk metadata store for the RAG system.
+
+Indexes used to keep every chunk's text and metadata in one indented
+metadata.json that had to be parsed in full on load and then stayed resident.
+The chunk store writes the same records into a compact SQLite file
+(chunks.sqlite) keyed by stable chunk id, so opening an index reads nothing and
+a query materializes only its top-k records.
+
+A saved file is never modified in place: changes are held in an in-memory
+overlay until the next full save writes a new file and renames it into place.
+That keeps the base file consistent with the faiss index next to it and safe to
+read from other processes.
+
+Key Components:
+- ChunkStore: Mutable mapping of chunk id -> metadata over an immutable SQLite file
+- convert_metadata_json: One-time conversion of a legacy metadata.json
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+
+CHUNKS_FILE = "chunks.sqlite"
+LEGACY_METADATA_FILE = "metadata.json"
+
+
+class ChunkStore(MutableMapping):
+    """
+    Mapping of stable chunk id -> metadata dict (with "id" and "text"), backed by a file.
+
+    Reads go to the overlay first, then to the SQLite file. Writes and deletes
+    only touch the overlay; write() persists the merged view to a new file.
+
+    Example:
+        >>> store = ChunkStore.open("/data/indexes/1/row_wise/chunks.sqlite")
+        >>> store.get_many([12, 40])          # one query for the top-k hits
+        >>> store[99] = {"id": 99, "text": "..."}
+        >>> ChunkStore.write(path, store.records())
+    """
+
+    # Stay well below SQLite's bound-parameter limit
+    QUERY_CHUNK = 500
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        Create a store, optionally backed by an existing chunks file.
+
+        Args:
+            path: Path of a file written by ChunkStore.write (None for an empty store)
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._overlay: Dict[int, Dict[str, Any]] = {}
+        self._deleted: set = set()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._base_count = 0
+
+        if path is not None:
+            # immutable=1: the file is replaced, never modified, so SQLite can skip locking.
+            # The open connection keeps reading this version even after a rename over it.
+            uri = f"file:{os.path.abspath(path)}?mode=ro&immutable=1"
+            self._conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            self._base_count = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        self._count = self._base_count
+
+    @classmethod
+    def open(cls, path: str) -> "ChunkStore":
+        """Open a chunks file written by ChunkStore.write."""
+        return cls(path)
+
+    # --------------------------------------------------------------------------
+    # Reads
+    # --------------------------------------------------------------------------
+
+    def _base_get_many(self, ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Fetch records from the file. Caller holds _lock."""
+        found: Dict[int, Dict[str, Any]] = {}
+        if self._conn is None or not ids:
+            return found
+        for i in range(0, len(ids), self.QUERY_CHUNK):
+            chunk = ids[i:i + self.QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT id, meta FROM chunks WHERE id IN ({placeholders})", chunk
+            ).fetchall()
+            for chunk_id, meta in rows:
+                found[chunk_id] = json.loads(meta)
+        return found
+
+    def get_many(self, ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+        """
+        Fetch the records of several chunks at once.
+
+        Args:
+            ids: Chunk ids to look up (unknown ids are skipped)
+
+        Returns:
+            Dict of chunk id -> metadata for the ids that exist
+        """
+        ids = [int(i) for i in ids]
+        with self._lock:
+            found = {i: self._overlay[i] for i in ids if i in self._overlay}
+            missing = [i for i in dict.fromkeys(ids) if i not in found and i not in self._deleted]
+            found.update(self._base_get_many(missing))
+        return found
+
+    def _in_base(self, chunk_id: int) -> bool:
+        """Whether the file holds a live record for chunk_id. Caller holds _lock."""
+        if self._conn is None or chunk_id in self._deleted:
+            return False
+        return self._conn.execute("SELECT 1 FROM chunks WHERE id = ?", (chunk_id,)).fetchone() is not None
+
+    def _contains(self, chunk_id: int) -> bool:
+        """Caller holds _lock."""
+        return chunk_id in self._overlay or self._in_base(chunk_id)
+
+    def __getitem__(self, chunk_id: int) -> Dict[str, Any]:
+        chunk_id = int(chunk_id)
+        with self._lock:
+            if chunk_id in self._overlay:
+                return self._overlay[chunk_id]
+            if chunk_id not in self._deleted:
+                found = self._base_get_many([chunk_id])
+                if chunk_id in found:
+                    return found[chunk_id]
+        raise KeyError(chunk_id)
+
+    def __contains__(self, chunk_id: object) -> bool:
+        try:
+            chunk_id = int(chunk_id)
+        except (TypeError, ValueError):
+            return False
+        with self._lock:
+            return self._contains(chunk_id)
+
+    def __iter__(self) -> Iterator[int]:
+        with self._lock:
+            base_ids = []
+            if self._conn is not None:
+                base_ids = [row[0] for row in self._conn.execute("SELECT id FROM chunks ORDER BY id")]
+            ids = [i for i in base_ids if i not in self._deleted and i not in self._overlay]
+            ids.extend(self._overlay)
+        return iter(ids)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def records(self, page_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """Iterate over all records, reading the file page by page (used when saving)."""
+        last_id = None
+        while self._conn is not None:
+            with self._lock:
+                if self._conn is None:
+                    break
+                if last_id is None:
+                    rows = self._conn.execute(
+                        "SELECT id, meta FROM chunks ORDER BY id LIMIT ?", (page_size,)
+                    ).fetchall()
+                else:
+                    rows = self._conn.execute(
+                        "SELECT id, meta FROM chunks WHERE id > ? ORDER BY id LIMIT ?", (last_id, page_size)
+                    ).fetchall()
+                page = [
+                    json.loads(meta) for chunk_id, meta in rows
+                    if chunk_id not in self._deleted and chunk_id not in self._overlay
+                ]
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            yield from page
+        yield from list(self._overlay.values())
+
+    # --------------------------------------------------------------------------
+    # Writes (in-memory overlay)
+    # --------------------------------------------------------------------------
+
+    def __setitem__(self, chunk_id: int, metadata: Dict[str, Any]) -> None:
+        chunk_id = int(chunk_id)
+        with self._lock:
+            if not self._contains(chunk_id):
+                self._count += 1
+            self._overlay[chunk_id] = metadata
+
+    def __delitem__(self, chunk_id: int) -> None:
+        chunk_id = int(chunk_id)
+        with self._lock:
+            if not self._contains(chunk_id):
+                raise KeyError(chunk_id)
+            self._overlay.pop(chunk_id, None)
+            if self._conn is not None:
+                self._deleted.add(chunk_id)
+            self._count -= 1
+
+    # --------------------------------------------------------------------------
+    # Persistence
+    # --------------------------------------------------------------------------
+
+    @classmethod
+    def write(cls, path: str, records: Iterable[Dict[str, Any]]) -> None:
+        """
+        Write records to a new chunks file at path (the file must not exist).
+
+        Args:
+            path: Destination path (write to a temp path and rename for atomicity)
+            records: Metadata dicts, each with an "id" key
+        """
+        if os.path.exists(path):
+            os.remove(path)  # leftover of an interrupted save
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute("CREATE TABLE chunks (id INTEGER PRIMARY KEY, meta TEXT NOT NULL)")
+            conn.executemany(
+                "INSERT INTO chunks (id, meta) VALUES (?, ?)",
+                ((int(meta["id"]), json.dumps(meta, ensure_ascii=False, separators=(",", ":"))) for meta in records)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def close(self) -> None:
+        """Close the underlying SQLite connection."""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def convert_metadata_json(json_path: str, store_path: str) -> None:
+    """
+    Convert a legacy metadata.json (list of chunk dicts) into a chunks file.
+
+    Args:
+        json_path: Path of the legacy metadata.json
+        store_path: Destination chunks file (must not exist)
+    """
+    with open(json_path, "r", encoding="utf-8") as f:
+        records = json.load(f)
+    ChunkStore.write(store_path, records)
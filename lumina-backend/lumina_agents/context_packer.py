@@ -0,0 +1,120 @@
+"""
+Token-budgeted context packing for answer generation.
+
+Retrieved passages used to be pasted into the generation prompt as they were,
+so one windowed column chunk or a handful of long rows could make the prompt
+arbitrarily large. This module packs passages, best first, into a fixed token
+budget: a passage already in the context is not repeated, nor is the table
+header line that every table-row chunk starts with, each passage is trimmed to
+its own budget, and packing stops once the budget is full. Other lines are
+never dropped: different records routinely share field values
+("- Year: 2020"), and each record needs all of its own.
+
+Key Components:
+- pack_contexts: Deduplicate, trim and budget a score-ordered list of passages
+- estimate_tokens: The cheap token estimate the budgets are measured in
+"""
+
+import re
+from typing import Iterable, List, Optional, Set
+
+
+# Rough characters-per-token ratio (no tokenizer round trip)
+CHARS_PER_TOKEN = 4
+
+DEFAULT_CONTEXT_TOKENS = 3000
+DEFAULT_PASSAGE_TOKENS = 600
+
+# A trimmed remainder smaller than this is not worth adding to the context
+MIN_PASSAGE_TOKENS = 32
+
+TRUNCATION_MARKER = " [...]"
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token count estimate (no tokenizer needed)."""
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def _normalize(line: str) -> str:
+    """Comparison key of a line: case- and whitespace-insensitive."""
+    return _WHITESPACE_RE.sub(" ", line).strip().lower()
+
+
+def _is_table_row(line: str) -> bool:
+    stripped = line.strip()
+    return len(stripped) > 1 and stripped.startswith("|") and stripped.endswith("|")
+
+
+def _table_header(lines: List[str]) -> Optional[str]:
+    """The header line of a "header\nrow" table-row chunk (see RAGSystem.iter_table_row_chunks)."""
+    if len(lines) > 1 and _is_table_row(lines[0]) and _is_table_row(lines[1]):
+        return lines[0]
+    return None
+
+
+def _trim(text: str, max_tokens: int) -> str:
+    """Cut text to about max_tokens, at a word boundary, marking the cut."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max(0, max_chars - len(TRUNCATION_MARKER))]
+    space = cut.rfind(" ")
+    if space > len(cut) // 2:
+        cut = cut[:space]
+    return cut.rstrip() + TRUNCATION_MARKER
+
+
+def pack_contexts(
+    passages: Iterable[str],
+    max_tokens: int = DEFAULT_CONTEXT_TOKENS,
+    max_passage_tokens: int = DEFAULT_PASSAGE_TOKENS,
+    separator_tokens: int = 2
+) -> List[str]:
+    """
+    Pack passages into a token budget, in the order given.
+
+    A passage identical to an earlier one (ignoring case and whitespace) is
+    skipped, and a table header line already packed with an earlier row is
+    dropped from later rows. Each passage is trimmed to max_passage_tokens,
+    and the last passage that fits is trimmed to the remaining budget.
+
+    Args:
+        passages: Passage texts, best first
+        max_tokens: Total token budget of the packed context
+        max_passage_tokens: Token budget of a single passage
+        separator_tokens: Tokens charged for the separator between passages
+
+    Returns:
+        The packed passages, in order
+    """
+    packed: List[str] = []
+    seen_passages: Set[str] = set()
+    seen_headers: Set[str] = set()
+    remaining = max_tokens
+
+    for passage in passages:
+        key = _normalize(passage)
+        if not key or key in seen_passages:
+            continue
+
+        lines = [line for line in passage.splitlines() if line.strip()]
+        header = _table_header(lines)
+        header_key = _normalize(header) if header is not None else None
+        if header_key in seen_headers:
+            lines = lines[1:]
+
+        text = "\n".join(lines)
+        budget = min(max_passage_tokens, remaining - (separator_tokens if packed else 0))
+        if budget < min(MIN_PASSAGE_TOKENS, estimate_tokens(text)):
+            break
+        text = _trim(text, budget)
+        packed.append(text)
+        seen_passages.add(key)
+        if header_key is not None:
+            seen_headers.add(header_key)
+        remaining -= estimate_tokens(text) + (separator_tokens if len(packed) > 1 else 0)
+
+    return packed
@@ -0,0 +1,475 @@
+"""
+Persistent, content-addressed embedding cache for the RAG system.
+
+Embeddings are stored in a single SQLite file keyed by a hash of
+(embed model, input_type, text), so an unchanged chunk is never sent to the
+paid embedding API twice, no matter which service or index it belongs to.
+The file lives on the shared /data volume, letting the extraction and query
+services reuse each other's work.
+
+Query embeddings are cached separately, in memory: a process-wide LRU keyed
+by (model, normalized query) that also lets concurrent lookups of the same query
+share one in-flight API call.
+
+Key Components:
+- EmbeddingCache: Disk-backed cache with size-capped LRU eviction and hit/miss counters
+- QueryEmbeddingCache: In-memory LRU of query embeddings with in-flight deduplication
+- shared_query_embedding_cache: The process-wide QueryEmbeddingCache instance
+"""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Disk-backed embedding cache with size-capped LRU eviction.
+
+    Each entry holds one float32 vector. When the total stored vector bytes
+    exceed `max_bytes`, the least recently used entries are evicted until the
+    cache is back under `evict_to_ratio * max_bytes`.
+
+    Example:
+        >>> cache = EmbeddingCache("/data/embedding_cache/embeddings.sqlite")
+        >>> cached = cache.get_many(texts, model, "passage")  # None for misses
+        >>> cache.put_many(missing_texts, vectors, model, "passage")
+        >>> cache.stats()
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 2 * 1024 ** 3,
+        evict_to_ratio: float = 0.9,
+        verbose: bool = False
+    ):
+        """
+        Open (or create) the cache file.
+
+        Args:
+            path: Path of the SQLite cache file
+            max_bytes: Maximum total size of stored vectors before eviction
+            evict_to_ratio: Fraction of max_bytes to shrink to when evicting
+            verbose: If True, print detailed logging information
+        """
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.evict_to_ratio = evict_to_ratio
+        self.verbose = verbose
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        # Shared between the services' worker threads; access is serialized by _lock
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                dim INTEGER NOT NULL,
+                vector BLOB NOT NULL,
+                nbytes INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    # --------------------------------------------------------------------------
+    # Keys
+    # --------------------------------------------------------------------------
+
+    @staticmethod
+    def make_key(text: str, model: str, input_type: str) -> str:
+        """Content address for a (text, model, input_type) triple."""
+        text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{model}|{input_type}|{text_hash}"
+
+    # --------------------------------------------------------------------------
+    # Lookup & Insert
+    # --------------------------------------------------------------------------
+
+    def get_many(self, texts: List[str], model: str, input_type: str) -> List[Optional[np.ndarray]]:
+        """
+        Look up cached embeddings for a list of texts.
+
+        Args:
+            texts: Texts to look up
+            model: The embedding model the vectors were produced with
+            input_type: Either "query" or "passage"
+
+        Returns:
+            List aligned with texts: a float32 vector on a hit, None on a miss
+        """
+        keys = [self.make_key(text, model, input_type) for text in texts]
+        found: Dict[str, np.ndarray] = {}
+
+        with self._lock:
+            unique_keys = list(dict.fromkeys(keys))
+            # Stay well below SQLite's bound-parameter limit
+            for i in range(0, len(unique_keys), 500):
+                chunk = unique_keys[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+
+            results = [found.get(key) for key in keys]
+            hits = sum(1 for r in results if r is not None)
+            self.hits += hits
+            self.misses += len(results) - hits
+
+        return results
+
+    def put_many(self, texts: List[str], vectors: np.ndarray, model: str, input_type: str) -> None:
+        """
+        Store embeddings for a list of texts, evicting old entries if over capacity.
+
+        Args:
+            texts: Texts the vectors belong to
+            vectors: Array of shape (len(texts), dim)
+            model: The embedding model the vectors were produced with
+            input_type: Either "query" or "passage"
+        """
+        if len(texts) == 0:
+            return
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            blob = vector.tobytes()
+            rows.append((self.make_key(text, model, input_type), int(vector.shape[0]), blob, len(blob), now))
+
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, dim, vector, nbytes, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+            self._evict_if_needed()
+
+    # --------------------------------------------------------------------------
+    # Eviction & Stats
+    # --------------------------------------------------------------------------
+
+    def _total_bytes(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()[0]
+
+    def _evict_if_needed(self) -> None:
+        """Drop least recently used entries until under the size cap. Caller holds _lock."""
+        total = self._total_bytes()
+        if total <= self.max_bytes:
+            return
+
+        target = int(self.max_bytes * self.evict_to_ratio)
+        to_free = total - target
+        freed = 0
+        evict_keys = []
+        for key, nbytes in self._conn.execute("SELECT key, nbytes FROM embeddings ORDER BY last_used ASC, rowid ASC"):
+            evict_keys.append((key,))
+            freed += nbytes
+            if freed >= to_free:
+                break
+
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", evict_keys)
+        self._conn.commit()
+        self.evictions += len(evict_keys)
+        if self.verbose:
+            print(f"Embedding cache evicted {len(evict_keys)} entries ({freed} bytes).")
+
+    def stats(self) -> Dict[str, float]:
+        """Return hit/miss counters and current size of the cache."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self._total_bytes()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+        }
+
+    def close(self) -> None:
+        """Close the underlying SQLite connection."""
+        with self._lock:
+            self._conn.close()
+
+
+class QueryEmbeddingCache:
+    """
+    Size-bounded in-memory LRU of query embeddings with in-flight deduplication.
+
+    Keys are (model, normalized query). If several threads ask for the same key
+    while it is being embedded, only the first one calls the API; the others
+    wait on its result. Failed lookups (None or an exception) are not cached.
+
+    Example:
+        >>> cache = QueryEmbeddingCache(max_entries=4096)
+        >>> vector = cache.get_or_compute(model, query, lambda: embed(query))
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Maximum number of query embeddings kept in memory
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self._in_flight: Dict[Tuple[str, str], concurrent.futures.Future] = {}
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Unicode-normalize and collapse whitespace so trivially different queries share a key."""
+        return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", query)).strip()
+
+    def get_or_compute(
+        self,
+        model: str,
+        query: str,
+        compute: Callable[[], Optional[np.ndarray]]
+    ) -> Optional[np.ndarray]:
+        """
+        Return the cached embedding for a query, computing it at most once.
+
+        Args:
+            model: The embedding model the vector is produced with
+            query: The raw query text
+            compute: Zero-argument callable that embeds the query (None on failure)
+
+        Returns:
+            A read-only float32 vector, or None if compute() failed
+        """
+        key = (model, self.normalize_query(query))
+        vector, future, owner = self._claim(key)
+        if future is None:
+            return vector
+        if not owner:
+            return future.result()
+
+        try:
+            vector = self._store(key, compute())
+            future.set_result(vector)
+            return vector
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    async def aget_or_compute(
+        self,
+        model: str,
+        query: str,
+        compute: Callable[[], Awaitable[Optional[np.ndarray]]]
+    ) -> Optional[np.ndarray]:
+        """
+        Async variant of get_or_compute() for callers on an event loop.
+
+        Waiters share the same in-flight futures as get_or_compute(), so a sync
+        and an async lookup of the same query still make a single API call.
+
+        Args:
+            model: The embedding model the vector is produced with
+            query: The raw query text
+            compute: Zero-argument coroutine function that embeds the query (None on failure)
+
+        Returns:
+            A read-only float32 vector, or None if compute() failed
+        """
+        key = (model, self.normalize_query(query))
+        vector, future, owner = self._claim(key)
+        if future is None:
+            return vector
+        if not owner:
+            return await asyncio.wrap_future(future)
+
+        try:
+            vector = self._store(key, await compute())
+            future.set_result(vector)
+            return vector
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def get_many_or_compute(
+        self,
+        model: str,
+        queries: List[str],
+        compute_many: Callable[[List[str]], List[Optional[np.ndarray]]]
+    ) -> List[Optional[np.ndarray]]:
+        """
+        Batched get_or_compute(): every query not cached or in flight is embedded
+        in a single compute_many() call.
+
+        Args:
+            model: The embedding model the vectors are produced with
+            queries: The raw query texts (duplicates are embedded once)
+            compute_many: Callable embedding a list of queries, returning vectors
+                aligned with it (None entries on failure)
+
+        Returns:
+            Read-only float32 vectors aligned with queries (None where embedding failed)
+        """
+        keys, claims, owned = self._claim_many(model, queries)
+        if owned:
+            try:
+                vectors = compute_many([query for _, query in owned])
+            except BaseException as e:
+                self._settle(owned, claims, error=e)
+                raise
+            self._settle(owned, claims, vectors=vectors)
+        return [claims[key][1].result() if claims[key][1] is not None else claims[key][0] for key in keys]
+
+    async def aget_many_or_compute(
+        self,
+        model: str,
+        queries: List[str],
+        compute_many: Callable[[List[str]], Awaitable[List[Optional[np.ndarray]]]]
+    ) -> List[Optional[np.ndarray]]:
+        """Async variant of get_many_or_compute(); compute_many is a coroutine function."""
+        keys, claims, owned = self._claim_many(model, queries)
+        if owned:
+            try:
+                vectors = await compute_many([query for _, query in owned])
+            except BaseException as e:
+                self._settle(owned, claims, error=e)
+                raise
+            self._settle(owned, claims, vectors=vectors)
+        return [
+            await asyncio.wrap_future(claims[key][1]) if claims[key][1] is not None else claims[key][0]
+            for key in keys
+        ]
+
+    def _claim_many(self, model: str, queries: List[str]):
+        """Claim each distinct query key; returns (keys aligned with queries, claims by key, owned (key, query) pairs)."""
+        keys = [(model, self.normalize_query(query)) for query in queries]
+        claims: Dict[Tuple[str, str], Tuple[Optional[np.ndarray], Optional[concurrent.futures.Future], bool]] = {}
+        owned: List[Tuple[Tuple[str, str], str]] = []
+        for key, query in zip(keys, queries):
+            if key in claims:
+                continue
+            claims[key] = self._claim(key)
+            if claims[key][2]:
+                owned.append((key, query))
+        return keys, claims, owned
+
+    def _settle(
+        self,
+        owned: List[Tuple[Tuple[str, str], str]],
+        claims: Dict[Tuple[str, str], Tuple[Optional[np.ndarray], Optional[concurrent.futures.Future], bool]],
+        vectors: Optional[List[Optional[np.ndarray]]] = None,
+        error: Optional[BaseException] = None
+    ) -> None:
+        """Store computed vectors (or the error) for the keys this caller owned and release them."""
+        try:
+            for i, (key, _) in enumerate(owned):
+                future = claims[key][1]
+                if error is not None:
+                    future.set_exception(error)
+                    continue
+                vector = self._store(key, vectors[i] if vectors is not None and i < len(vectors) else None)
+                future.set_result(vector)
+        finally:
+            with self._lock:
+                for key, _ in owned:
+                    self._in_flight.pop(key, None)
+
+    def _claim(self, key: Tuple[str, str]) -> Tuple[Optional[np.ndarray], Optional[concurrent.futures.Future], bool]:
+        """
+        Look up a key, registering an in-flight future on a miss.
+
+        Returns:
+            (vector, None, False) on a hit; otherwise (None, future, owner) where
+            owner is True if the caller must compute and resolve the future
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key], None, False
+
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self._in_flight[key] = future
+                self.misses += 1
+            else:
+                self.deduplicated += 1
+        return None, future, owner
+
+    def _store(self, key: Tuple[str, str], vector: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        """Freeze and cache a freshly computed vector (None is passed through uncached)."""
+        if vector is None:
+            return None
+        vector = np.array(vector, dtype=np.float32)
+        vector.flags.writeable = False
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return vector
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss/deduplication counters and current size."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "deduplicated": self.deduplicated,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+            }
+
+    def clear(self) -> None:
+        """Drop all cached query embeddings."""
+        with self._lock:
+            self._entries.clear()
+
+
+# Shared by every RAGSystem in the process (e.g. all column indexes of a session)
+shared_query_embedding_cache = QueryEmbeddingCache()
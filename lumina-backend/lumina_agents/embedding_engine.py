@@ -0,0 +1,406 @@
+"""
+Async batched embedding engine for the RAG system.
+
+This module sends passage embeddings to the NVIDIA (OpenAI-compatible) embedding
+endpoint concurrently instead of one batch after another. Batches are sized from
+the payload (an estimate of tokens per request), failed batches are retried with
+exponential backoff instead of being dropped, and results are always returned in
+input order so embedding rows stay aligned with chunk metadata.
+
+Query embeddings arrive one text at a time, often dozens within a few
+milliseconds. The embedding batcher coalesces those calls, from every RAGSystem
+in the process, into one API request per short time window.
+
+Key Components:
+- AsyncEmbeddingEngine: Concurrent, order-preserving batch embedder
+- EmbeddingBatcher: Coalesces concurrent embed calls into batched requests
+- shared_embedding_batcher: The process-wide EmbeddingBatcher instance
+- run_coroutine_sync: Runs a coroutine from sync code (scripts, worker threads)
+"""
+
+import asyncio
+import concurrent.futures
+import weakref
+from random import random
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from openai import AsyncOpenAI, BadRequestError
+
+from shared.api_types import MaxRetriesExceededError
+
+
+def run_coroutine_sync(coro):
+    """
+    Run a coroutine to completion from synchronous code.
+
+    Uses asyncio.run() when the current thread has no running event loop
+    (the usual case for asyncio.to_thread workers and scripts). If a loop is
+    already running in this thread, the coroutine is run on a helper thread
+    so we never try to nest event loops.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
+
+class AsyncEmbeddingEngine:
+    """
+    Concurrent batch embedder with adaptive batch sizes and retries.
+
+    Texts are packed into batches until either `max_batch_size` items or
+    `max_batch_tokens` (estimated) is reached, so a batch of long passages is
+    smaller than a batch of short ones. Up to `max_concurrency` batches are in
+    flight at once. A batch that keeps failing is retried with backoff; if the
+    API rejects the payload itself, the batch is split in half and retried.
+
+    Example:
+        >>> engine = AsyncEmbeddingEngine(api_key, base_url, model)
+        >>> vectors = await engine.embed(chunks, input_type="passage")
+        >>> vectors = engine.embed_sync(chunks)  # from sync code
+    """
+
+    # Rough characters-per-token ratio used to size batches
+    CHARS_PER_TOKEN = 4
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str,
+        model: str,
+        max_concurrency: int = 4,
+        max_batch_size: int = 64,
+        max_batch_tokens: int = 16000,
+        max_retries: int = 4,
+        initial_delay: float = 1.0,
+        verbose: bool = False
+    ):
+        """
+        Initialize the embedding engine.
+
+        Args:
+            api_key: NVIDIA API key for the embedding service
+            base_url: The base URL for the embedding API
+            model: The embedding model to use
+            max_concurrency: Maximum number of batches in flight at once
+            max_batch_size: Maximum number of texts per request
+            max_batch_tokens: Maximum estimated tokens per request
+            max_retries: Attempts per batch before giving up
+            initial_delay: Base delay (seconds) for exponential backoff
+            verbose: If True, print detailed logging information
+        """
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_retries = max_retries
+        self.initial_delay = initial_delay
+        self.verbose = verbose
+
+        # One client per event loop; httpx connection pools are loop-bound
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    # --------------------------------------------------------------------------
+    # Clients
+    # --------------------------------------------------------------------------
+
+    def _new_client(self) -> AsyncOpenAI:
+        """Create a fresh async client (caller owns its lifetime)."""
+        return AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
+
+    def _get_client(self) -> AsyncOpenAI:
+        """Return the client bound to the running event loop, creating it if needed."""
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._new_client()
+            self._clients[loop] = client
+        return client
+
+    # --------------------------------------------------------------------------
+    # Batch Planning
+    # --------------------------------------------------------------------------
+
+    @classmethod
+    def estimate_tokens(cls, text: str) -> int:
+        """Cheap token estimate for batch sizing (no tokenizer round trip)."""
+        return max(1, len(text) // cls.CHARS_PER_TOKEN)
+
+    def plan_batches(self, texts: List[str], max_batch_size: Optional[int] = None) -> List[Tuple[int, int]]:
+        """
+        Split texts into contiguous [start, end) batches sized by payload.
+
+        Args:
+            texts: Texts to embed
+            max_batch_size: Optional override for the per-request item cap
+
+        Returns:
+            List of (start, end) index pairs covering all texts in order
+        """
+        item_cap = max(1, min(max_batch_size or self.max_batch_size, self.max_batch_size))
+        batches = []
+        start = 0
+        batch_tokens = 0
+
+        for i, text in enumerate(texts):
+            tokens = self.estimate_tokens(text)
+            full = (i - start) >= item_cap or (batch_tokens + tokens) > self.max_batch_tokens
+            if i > start and full:
+                batches.append((start, i))
+                start = i
+                batch_tokens = 0
+            batch_tokens += tokens
+
+        if start < len(texts):
+            batches.append((start, len(texts)))
+        return batches
+
+    # --------------------------------------------------------------------------
+    # Embedding
+    # --------------------------------------------------------------------------
+
+    async def _request(self, client: AsyncOpenAI, batch: List[str], input_type: str) -> List[List[float]]:
+        """Send a single embeddings request and return vectors in input order."""
+        response = await client.embeddings.create(
+            input=batch,
+            model=self.model,
+            encoding_format="float",
+            extra_body={"input_type": input_type, "truncate": "NONE"}
+        )
+        data = sorted(response.data, key=lambda d: d.index)
+        if len(data) != len(batch):
+            raise ValueError(f"Embedding API returned {len(data)} vectors for {len(batch)} inputs.")
+        return [d.embedding for d in data]
+
+    async def _embed_batch(
+        self,
+        client: AsyncOpenAI,
+        batch: List[str],
+        input_type: str,
+        label: str
+    ) -> List[List[float]]:
+        """
+        Embed one batch with retries, splitting it if the payload is rejected.
+
+        Raises:
+            MaxRetriesExceededError: If the batch still fails after all retries
+        """
+        for attempt in range(self.max_retries):
+            try:
+                return await self._request(client, batch, input_type)
+            except BadRequestError as e:
+                # The payload itself was rejected; smaller requests may go through
+                if len(batch) > 1:
+                    if self.verbose:
+                        print(f"Batch {label} rejected ({e}). Splitting {len(batch)} texts in half.")
+                    mid = len(batch) // 2
+                    left, right = await asyncio.gather(
+                        self._embed_batch(client, batch[:mid], input_type, f"{label}a"),
+                        self._embed_batch(client, batch[mid:], input_type, f"{label}b"),
+                    )
+                    return left + right
+                raise
+            except Exception as e:
+                if attempt == self.max_retries - 1:
+                    raise MaxRetriesExceededError(
+                        f"Embedding batch {label} failed after {self.max_retries} attempts: {e}"
+                    ) from e
+                delay = (self.initial_delay * (2 ** attempt)) + random()
+                if self.verbose:
+                    print(f"Error in batch {label}: {e}. Retrying in {delay:.2f} seconds...")
+                await asyncio.sleep(delay)
+
+    async def embed(
+        self,
+        texts: List[str],
+        input_type: str = "passage",
+        max_batch_size: Optional[int] = None,
+        show_progress: bool = True,
+        client: Optional[AsyncOpenAI] = None
+    ) -> np.ndarray:
+        """
+        Embed texts concurrently and return a (len(texts), dim) float32 array.
+
+        Args:
+            texts: Texts to embed
+            input_type: Either "query" or "passage"
+            max_batch_size: Optional override for the per-request item cap
+            show_progress: Whether to print progress information
+            client: Optional client to use instead of the per-loop client
+
+        Returns:
+            NumPy array of embeddings, row i corresponding to texts[i]
+        """
+        if not texts:
+            raise ValueError("No texts were provided for embedding.")
+
+        client = client or self._get_client()
+        batches = self.plan_batches(texts, max_batch_size)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        total = len(batches)
+        done = 0
+
+        async def run(batch_num: int, start: int, end: int) -> List[List[float]]:
+            nonlocal done
+            async with semaphore:
+                vectors = await self._embed_batch(client, texts[start:end], input_type, f"{batch_num}/{total}")
+            done += 1
+            if show_progress and self.verbose:
+                print(f"Embedded batch {done}/{total} ({end - start} texts).")
+            return vectors
+
+        results = await asyncio.gather(
+            *(run(n, start, end) for n, (start, end) in enumerate(batches, start=1))
+        )
+
+        embeddings = [vector for batch_vectors in results for vector in batch_vectors]
+        return np.array(embeddings, dtype=np.float32)
+
+    def embed_sync(
+        self,
+        texts: List[str],
+        input_type: str = "passage",
+        max_batch_size: Optional[int] = None,
+        show_progress: bool = True
+    ) -> np.ndarray:
+        """
+        Blocking wrapper around embed() for sync callers.
+
+        A dedicated client is opened and closed for the call, since the event
+        loop created here does not outlive it.
+        """
+        async def _run():
+            async with self._new_client() as client:
+                return await self.embed(
+                    texts,
+                    input_type=input_type,
+                    max_batch_size=max_batch_size,
+                    show_progress=show_progress,
+                    client=client
+                )
+
+        return run_coroutine_sync(_run())
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent embed calls into batched API requests.
+
+    The first call for an (endpoint, model, input_type) opens a batch; calls
+    arriving within `max_wait` seconds join it, and the batch is sent as one
+    request when the window closes or `max_batch_size` texts are queued.
+    Every caller then gets the rows for its own texts. Batches are kept per
+    event loop, since the engines' clients are loop-bound.
+
+    Example:
+        >>> batcher = EmbeddingBatcher(max_wait=0.005)
+        >>> vectors = await batcher.embed(engine, [query], input_type="query")
+        >>> batcher.stats()
+    """
+
+    def __init__(self, max_wait: float = 0.005, max_batch_size: int = 64):
+        """
+        Initialize the batcher.
+
+        Args:
+            max_wait: Seconds a batch stays open for more texts after its first call
+            max_batch_size: Queued texts that flush a batch before max_wait
+        """
+        self.max_wait = max_wait
+        self.max_batch_size = max_batch_size
+        self.calls = 0
+        self.requests = 0
+
+        # Open batches of each event loop, keyed by (base_url, api_key, model, input_type)
+        self._pending: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[tuple, dict]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        # The loop only keeps weak references to tasks; in-flight sends must not be collected
+        self._sending: Set[asyncio.Task] = set()
+
+    async def embed(
+        self,
+        engine: AsyncEmbeddingEngine,
+        texts: List[str],
+        input_type: str = "query"
+    ) -> np.ndarray:
+        """
+        Embed texts as part of the next batched request for engine's endpoint and model.
+
+        Args:
+            engine: Engine that sends the request (the first caller's engine is used for the batch)
+            texts: Texts to embed
+            input_type: Either "query" or "passage"
+
+        Returns:
+            NumPy array of embeddings, row i corresponding to texts[i]
+
+        Raises:
+            Whatever the batched request raised; every caller in the batch gets it
+        """
+        if not texts:
+            raise ValueError("No texts were provided for embedding.")
+
+        loop = asyncio.get_running_loop()
+        batches = self._pending.setdefault(loop, {})
+        key = (engine.base_url, engine.api_key, engine.model, input_type)
+        batch = batches.get(key)
+        if batch is None:
+            batch = {"engine": engine, "texts": {}, "future": loop.create_future()}
+            batch["timer"] = loop.call_later(self.max_wait, self._flush, loop, key, batch)
+            batches[key] = batch
+
+        rows = [batch["texts"].setdefault(text, len(batch["texts"])) for text in texts]
+        self.calls += 1
+        future = batch["future"]
+        if len(batch["texts"]) >= self.max_batch_size:
+            batch["timer"].cancel()
+            self._flush(loop, key, batch)
+
+        vectors = await asyncio.shield(future)
+        return vectors[rows]
+
+    def _flush(self, loop: asyncio.AbstractEventLoop, key: tuple, batch: dict) -> None:
+        """Close the batch to new callers and send it (runs on its loop)."""
+        batches = self._pending.get(loop)
+        if batches is not None and batches.get(key) is batch:
+            del batches[key]
+        task = loop.create_task(self._send(key[3], batch))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, input_type: str, batch: dict) -> None:
+        """Send one batched request and resolve the batch's future with its vectors."""
+        texts = list(batch["texts"])
+        self.requests += 1
+        future = batch["future"]
+        vectors, error = None, None
+        try:
+            vectors = await batch["engine"].embed(texts, input_type=input_type, show_progress=False)
+        except Exception as e:
+            error = e
+        finally:
+            # Also runs on cancellation, so coalesced callers are never left waiting
+            if not future.done():
+                if error is not None:
+                    future.set_exception(error)
+                elif vectors is None:
+                    future.set_exception(RuntimeError("The batched embedding request was cancelled."))
+                else:
+                    future.set_result(vectors)
+
+    def stats(self) -> Dict[str, int]:
+        """Return how many embed calls were coalesced into how many API requests."""
+        return {"calls": self.calls, "requests": self.requests}
+
+
+# Shared by every RAGSystem in the process, so concurrent queries to any index share requests
+shared_embedding_batcher = EmbeddingBatcher()
@@ -0,0 +1,207 @@
+"""
+Per-session manifest of the RAG indexes on the shared /data volume.
+
+Each session directory holds one small manifest.json describing every index
+saved under it: ANN type, dimension, vector count, embed model, a checksum of
+its file layout and a generation number that grows with every save. Services
+discover and validate indexes from this file alone instead of listing the
+directory and loading an index to find out whether it is usable: a missing or
+truncated file is caught by comparing sizes, never by parsing it. Readers can
+also compare generations to notice that another service rewrote an index.
+
+The manifest is updated with a read-modify-write under an exclusive file lock
+(the query and extraction services both write indexes) and replaced atomically,
+so readers never see a partial manifest.
+
+Key Components:
+- read_manifest: Load a session's manifest (cached by file mtime)
+- record_index: Describe a freshly saved index in the manifest, bumping its generation
+- validate_index: Check an index directory against its manifest entry (stat only)
+- index_signature: Identity of an index's files, to notice a save that ran during a load
+"""
+
+import datetime
+import fcntl
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_LOCK_FILE = ".manifest.lock"
+MANIFEST_VERSION = 1
+
+# Files that come and go while an index is in use and are not part of its content
+_TRANSIENT_SUFFIXES = (".tmp", "-wal", "-shm", "-journal")
+
+_cache_lock = threading.Lock()
+_manifest_cache: Dict[str, Tuple[Tuple[int, int], Dict[str, Any]]] = {}
+
+
+def _index_files(index_dir: str) -> Dict[str, int]:
+    """Relative path -> size of the files making up an index (deltas included)."""
+    files = {}
+    for root, _, names in os.walk(index_dir):
+        for name in names:
+            if ".tmp" in name or name.endswith(_TRANSIENT_SUFFIXES):
+                continue
+            path = os.path.join(root, name)
+            files[os.path.relpath(path, index_dir)] = os.path.getsize(path)
+    return files
+
+
+def index_signature(index_dir: str) -> Dict[str, Tuple[int, int, int]]:
+    """
+    Relative path -> (inode, mtime, size) of the files making up an index.
+
+    save_index replaces files by renaming new ones into place, so the signature
+    changes as soon as a save replaces any file, even with an identical size.
+    Compare the signatures taken before and after load_index to detect a load
+    that may have mixed files of two saves.
+    """
+    signature = {}
+    for name in _index_files(index_dir):
+        try:
+            stat = os.stat(os.path.join(index_dir, name))
+        except FileNotFoundError:
+            continue  # removed by a concurrent save; the signatures will differ
+        signature[name] = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    return signature
+
+
+def _checksum(index_dir: str, files: Dict[str, int]) -> str:
+    """Hash of the file layout (names and sizes) plus the small index_config.json."""
+    digest = hashlib.sha256(json.dumps(sorted(files.items())).encode("utf-8"))
+    config_path = os.path.join(index_dir, "index_config.json")
+    if os.path.exists(config_path):
+        with open(config_path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def read_manifest(session_dir: str) -> Optional[Dict[str, Any]]:
+    """
+    Load a session's manifest.
+
+    Parsed manifests are cached by file mtime and size, so repeated lookups
+    cost one stat() call.
+
+    Args:
+        session_dir: The session's index directory
+
+    Returns:
+        {"version", "indexes": {name: entry}}, or None if the session has no
+        (readable) manifest, e.g. it was indexed before manifests existed
+    """
+    path = os.path.join(session_dir, MANIFEST_FILE)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    key = (stat.st_mtime_ns, stat.st_size)
+
+    with _cache_lock:
+        cached = _manifest_cache.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    with _cache_lock:
+        _manifest_cache[path] = (key, manifest)
+    return manifest
+
+
+def record_index(
+    session_dir: str,
+    index_name: str,
+    embed_model: str,
+    n_vectors: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Describe a freshly saved index in the session manifest.
+
+    Call after every save_index(); the entry's generation is one more than the
+    previous one for this index.
+
+    Args:
+        session_dir: The session's index directory
+        index_name: Name of the index directory (e.g. "row_wise", "columns")
+        embed_model: Model the index vectors were embedded with
+        n_vectors: Current vector count (index_config.json is not rewritten by
+            incremental saves, so its count may be stale)
+
+    Returns:
+        The new manifest entry
+    """
+    index_dir = os.path.join(session_dir, index_name)
+    with open(os.path.join(index_dir, "index_config.json"), "r", encoding="utf-8") as f:
+        index_config = json.load(f)
+    files = _index_files(index_dir)
+
+    os.makedirs(session_dir, exist_ok=True)
+    with open(os.path.join(session_dir, MANIFEST_LOCK_FILE), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            path = os.path.join(session_dir, MANIFEST_FILE)
+            manifest = {"version": MANIFEST_VERSION, "indexes": {}}
+            if os.path.exists(path):
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        manifest = json.load(f)
+                except ValueError:
+                    pass  # a corrupt manifest is rebuilt entry by entry
+
+            previous = manifest["indexes"].get(index_name, {})
+            entry = {
+                "index_type": index_config.get("index_type", "flat"),
+                "dimension": index_config.get("dimension"),
+                "ntotal": n_vectors if n_vectors is not None else index_config.get("ntotal"),
+                "embed_model": embed_model,
+                "embedding_quantization": index_config.get("embedding_quantization", "none"),
+                "files": files,
+                "checksum": _checksum(index_dir, files),
+                "generation": previous.get("generation", 0) + 1,
+                "updated_at": datetime.datetime.now().isoformat(),
+            }
+            manifest["indexes"][index_name] = entry
+
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return entry
+
+
+def validate_index(session_dir: str, index_name: str, entry: Dict[str, Any]) -> Optional[str]:
+    """
+    Check an index directory against its manifest entry without reading the large files.
+
+    Args:
+        session_dir: The session's index directory
+        index_name: Name of the index directory
+        entry: The index's manifest entry
+
+    Returns:
+        None if the index matches its entry, else a description of the problem
+    """
+    index_dir = os.path.join(session_dir, index_name)
+    files = entry.get("files", {})
+    for name, size in files.items():
+        try:
+            actual = os.path.getsize(os.path.join(index_dir, name))
+        except OSError:
+            return f"missing file {name}"
+        if actual != size:
+            return f"{name} is {actual} bytes, expected {size}"
+    if _checksum(index_dir, files) != entry.get("checksum"):
+        return "index_config.json does not match the manifest"
+    return None
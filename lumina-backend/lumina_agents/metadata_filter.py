@@ -0,0 +1,456 @@
+"""
+Metadata filtering for row-wise RAG search.
+
+The query router attaches row filters to row-wise queries, e.g.
+{'author': 'Smith', 'year': 2020} or "year > 2020". This module keeps an index
+of the short, filterable fields of every record (source document, categorical
+and numeric values), parses a filter into conditions, and resolves them to the
+chunk ids that match. The vector search then scans only those rows instead of
+over-fetching and filtering afterwards.
+
+Key Components:
+- MetadataIndex: Per-field postings of categorical and numeric values, keyed by chunk id
+- parse_row_filters: Turn a router filter (dict, JSON or "field op value" text) into conditions
+- filterable_fields: Pick the fields of a record worth indexing for filters
+"""
+
+import ast
+import json
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+
+METADATA_INDEX_FILE = "metadata_index.json"
+
+# Keys of chunk metadata that are never filter fields
+RESERVED_KEYS = ("id", "text", "session_id", "index_type", "row_index")
+
+# Longer strings (abstracts, findings) are free text, not filterable values
+MAX_VALUE_CHARS = 200
+
+Condition = Tuple[str, str, Any]  # (field, op, value)
+
+_NUMBER_RE = re.compile(r"^[-+]?\d[\d,]*(?:\.\d+)?$")
+_DATE_RE = re.compile(r"^(\d{4})(?:[-/]\d{1,2}(?:[-/]\d{1,2})?)?$")  # years and ISO-like dates
+
+_OPS = {
+    "=": "=", "==": "=", ":": "=", "is": "=",
+    "!=": "!=",
+    ">": ">", ">=": ">=", "<": "<", "<=": "<=",
+    "after": ">", "before": "<", "since": ">=",
+    "contains": "contains",
+}
+_DICT_OPS = {
+    "$eq": "=", "eq": "=", "$ne": "!=", "ne": "!=",
+    "$gt": ">", "gt": ">", "$gte": ">=", "gte": ">=", "min": ">=",
+    "$lt": "<", "lt": "<", "$lte": "<=", "lte": "<=", "max": "<=",
+    "$in": "in", "in": "in", "$contains": "contains", "contains": "contains",
+}
+_OP_PATTERN = r">=|<=|!=|==|=|>|<|:|\b(?:after|before|since|contains|is)\b"
+_CLAUSE_RE = re.compile(rf"^(?P<field>[A-Za-z_][\w ]*?)\s*(?P<op>{_OP_PATTERN})\s*(?P<value>.+)$", re.IGNORECASE)
+# Clause separators (',', ';', 'and') that are followed by another "field op" clause
+_CLAUSE_SPLIT_RE = re.compile(
+    rf"\s*(?:,|;|\band\b)\s*(?=[A-Za-z_][\w ]*?\s*(?:{_OP_PATTERN}))", re.IGNORECASE
+)
+
+
+def _normalize_value(value: str) -> str:
+    return re.sub(r"\s+", " ", value).strip().casefold()
+
+
+def _normalize_field(name: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def _as_number(value: Any) -> Optional[float]:
+    """Numeric view of a value: numbers, number-like strings, and the year of date strings."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        text = value.strip()
+        if _NUMBER_RE.match(text):
+            return float(text.replace(",", ""))
+        date = _DATE_RE.match(text)
+        if date:
+            return float(date.group(1))
+    return None
+
+
+def filterable_fields(record: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Select the fields of an extracted record that can be used in row filters.
+
+    Keeps numbers, booleans, short strings and lists of those (e.g. authors);
+    drops long free text and nested objects, which are only searched semantically.
+
+    Args:
+        record: An extracted record (ExtractedRecord.data)
+
+    Returns:
+        Dict of field name -> value, suitable as per-chunk metadata
+    """
+    def filterable(value: Any) -> bool:
+        if isinstance(value, (bool, int, float)):
+            return True
+        return isinstance(value, str) and 0 < len(value) <= MAX_VALUE_CHARS
+
+    fields = {}
+    for key, value in record.items():
+        if key in RESERVED_KEYS:
+            continue
+        if isinstance(value, list):
+            values = [v for v in value if filterable(v)]
+            if values:
+                fields[key] = values
+        elif filterable(value):
+            fields[key] = value
+    return fields
+
+
+# --------------------------------------------------------------------------
+# Filter parsing
+# --------------------------------------------------------------------------
+
+def _parse_literal(text: str) -> Any:
+    """Parse JSON or a Python literal (the router often emits "{'author': 'Smith'}")."""
+    for parse in (json.loads, ast.literal_eval):
+        try:
+            return parse(text)
+        except (ValueError, SyntaxError, TypeError):
+            continue
+    return None
+
+
+def _conditions_from_dict(filters: Dict[str, Any]) -> List[Condition]:
+    conditions: List[Condition] = []
+    for field, value in filters.items():
+        if isinstance(value, dict):
+            for op, target in value.items():
+                if str(op).lower() in _DICT_OPS:
+                    conditions.append((str(field), _DICT_OPS[str(op).lower()], target))
+        elif isinstance(value, (list, tuple, set)):
+            conditions.append((str(field), "in", list(value)))
+        elif value is not None:
+            conditions.append((str(field), "=", value))
+    return conditions
+
+
+def _parse_clauses(text: str) -> List[Condition]:
+    """Parse "field op value" clauses joined by ',', ';' or 'and'."""
+    conditions: List[Condition] = []
+    for clause in _CLAUSE_SPLIT_RE.split(text.strip()):
+        match = _CLAUSE_RE.match(clause.strip())
+        if match is None:
+            continue
+        value = match.group("value").strip().strip("'\"")
+        if value:
+            conditions.append((match.group("field").strip(), _OPS[match.group("op").lower()], value))
+    return conditions
+
+
+def parse_row_filters(row_filters: Any) -> List[Condition]:
+    """
+    Parse a row filter into (field, op, value) conditions, all of which must hold.
+
+    Accepts a dict ({'year': 2020, 'citations': {'$gt': 10}, 'author': ['Smith', 'Lee']}),
+    its JSON / Python-literal string form, or text clauses such as
+    "author = Smith, year > 2020" and "published after 2019".
+
+    Args:
+        row_filters: The filter, e.g. QueryIntent.row_filters
+
+    Returns:
+        List of conditions (empty if nothing could be parsed). Operators are
+        "=", "!=", ">", ">=", "<", "<=", "in" and "contains".
+    """
+    if not row_filters:
+        return []
+    if isinstance(row_filters, str):
+        parsed = _parse_literal(row_filters.strip())
+        if not isinstance(parsed, (dict, list)):
+            return _parse_clauses(row_filters)
+        row_filters = parsed
+    if isinstance(row_filters, dict):
+        return _conditions_from_dict(row_filters)
+    if isinstance(row_filters, list):
+        return [c for item in row_filters if isinstance(item, dict) for c in _conditions_from_dict(item)]
+    return []
+
+
+# --------------------------------------------------------------------------
+# Metadata index
+# --------------------------------------------------------------------------
+
+class MetadataIndex:
+    """
+    Index of filterable chunk metadata, resolving row filters to chunk ids.
+
+    Example:
+        >>> index = MetadataIndex()
+        >>> index.add([7], [{"id": 7, "text": "...", "authors": ["J. Smith"], "year": 2021}])
+        >>> index.filter_ids("{'author': 'Smith', 'year': {'$gte': 2020}}")
+        array([7])
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # field -> normalized string value -> chunk ids
+        self._categorical: Dict[str, Dict[str, Set[int]]] = {}
+        # field -> chunk id -> numeric values
+        self._numeric: Dict[str, Dict[int, List[float]]] = {}
+        # chunk id -> (field, value) categorical entries and numeric fields, for removal
+        self._entries: Dict[int, Tuple[Set[Tuple[str, str]], Set[str]]] = {}
+        # field -> (ids, values) arrays for range queries, rebuilt after changes
+        self._numeric_arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def fields(self) -> List[str]:
+        """Names of the indexed fields."""
+        with self._lock:
+            return sorted(set(self._categorical) | set(self._numeric))
+
+    # --------------------------------------------------------------------------
+    # Updates
+    # --------------------------------------------------------------------------
+
+    def _remove(self, chunk_id: int) -> None:
+        """Caller holds _lock."""
+        entries = self._entries.pop(chunk_id, None)
+        if entries is None:
+            return
+        categorical, numeric = entries
+        for field, key in categorical:
+            values = self._categorical[field]
+            values[key].discard(chunk_id)
+            if not values[key]:
+                del values[key]
+                if not values:
+                    del self._categorical[field]
+        for field in numeric:
+            by_id = self._numeric[field]
+            del by_id[chunk_id]
+            if not by_id:
+                del self._numeric[field]
+        self._numeric_arrays.clear()
+
+    def add(self, ids: Iterable[int], metadatas: Iterable[Dict[str, Any]]) -> None:
+        """
+        Index the filterable metadata of chunks, replacing any previous version.
+
+        Args:
+            ids: Stable chunk ids
+            metadatas: Chunk metadata dicts aligned with ids
+        """
+        with self._lock:
+            for chunk_id, meta in zip(ids, metadatas):
+                chunk_id = int(chunk_id)
+                self._remove(chunk_id)
+                categorical, numeric = self._entries.setdefault(chunk_id, (set(), set()))
+                for field, value in meta.items():
+                    if field in RESERVED_KEYS:
+                        continue
+                    for item in (value if isinstance(value, list) else [value]):
+                        number = _as_number(item)
+                        if number is not None:
+                            self._numeric.setdefault(field, {}).setdefault(chunk_id, []).append(number)
+                            numeric.add(field)
+                        if isinstance(item, bool):
+                            item = str(item).lower()
+                        if isinstance(item, str) and 0 < len(item) <= MAX_VALUE_CHARS:
+                            key = _normalize_value(item)
+                            self._categorical.setdefault(field, {}).setdefault(key, set()).add(chunk_id)
+                            categorical.add((field, key))
+            self._numeric_arrays.clear()
+
+    def remove(self, ids: Iterable[int]) -> None:
+        """Drop chunks from the index (unknown ids are ignored)."""
+        with self._lock:
+            for chunk_id in ids:
+                self._remove(int(chunk_id))
+
+    # --------------------------------------------------------------------------
+    # Matching
+    # --------------------------------------------------------------------------
+
+    def resolve_field(self, name: str) -> Optional[str]:
+        """
+        Map a field name from a filter to an indexed field.
+
+        Tries an exact match, then case/punctuation-insensitive and singular/plural
+        matches, then the shortest field containing the name (e.g. "year" ->
+        "publication_year", "source" -> "_source_document").
+        """
+        fields = self.fields()
+        if name in fields:
+            return name
+        target = _normalize_field(name)
+        if not target:
+            return None
+        by_norm = {_normalize_field(f): f for f in fields}
+        for candidate in (target, target.rstrip("s"), target + "s"):
+            if candidate in by_norm:
+                return by_norm[candidate]
+        containing = [f for norm, f in by_norm.items() if target in norm or target.rstrip("s") in norm]
+        return min(containing, key=len) if containing else None
+
+    def _numeric_view(self, field: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(ids, values) arrays of a numeric field. Caller holds _lock."""
+        if field not in self._numeric_arrays:
+            by_id = self._numeric.get(field, {})
+            ids = [i for i, values in by_id.items() for _ in values]
+            values = [v for vs in by_id.values() for v in vs]
+            self._numeric_arrays[field] = (np.asarray(ids, dtype=np.int64), np.asarray(values, dtype=np.float64))
+        return self._numeric_arrays[field]
+
+    def _equals(self, field: str, target: Any) -> Set[int]:
+        """Ids whose value equals target: numerically, exactly, or as a whole word. Caller holds _lock."""
+        matched: Set[int] = set()
+        number = _as_number(target)
+        if number is not None and field in self._numeric:
+            ids, values = self._numeric_view(field)
+            matched.update(ids[np.isclose(values, number)].tolist())
+        if isinstance(target, bool):
+            target = str(target).lower()
+        text = _normalize_value(str(target))
+        if not text:
+            return matched
+        word = re.compile(rf"(?<!\w){re.escape(text)}(?!\w)")
+        for key, ids in self._categorical.get(field, {}).items():
+            if key == text or word.search(key):
+                matched.update(ids)
+        return matched
+
+    def _evaluate(self, field: str, op: str, target: Any) -> Optional[Set[int]]:
+        """Ids satisfying one condition, or None if it cannot be evaluated. Caller holds _lock."""
+        if op == "=":
+            return self._equals(field, target)
+        if op == "in":
+            targets = target if isinstance(target, (list, tuple, set)) else [target]
+            return set().union(*(self._equals(field, t) for t in targets)) if targets else set()
+        if op == "!=":
+            return set(self._entries) - self._equals(field, target)
+        if op == "contains":
+            text = _normalize_value(str(target))
+            return {i for key, ids in self._categorical.get(field, {}).items() if text in key for i in ids}
+        if op in (">", ">=", "<", "<="):
+            number = _as_number(target)
+            if number is None:
+                return None
+            ids, values = self._numeric_view(field)
+            compare = {">": np.greater, ">=": np.greater_equal, "<": np.less, "<=": np.less_equal}[op]
+            return set(ids[compare(values, number)].tolist())
+        return None
+
+    def match(self, conditions: List[Condition]) -> Optional[np.ndarray]:
+        """
+        Resolve conditions (combined with AND) to matching chunk ids.
+
+        Conditions on unknown fields or with unusable values are skipped.
+
+        Args:
+            conditions: (field, op, value) tuples from parse_row_filters
+
+        Returns:
+            Sorted int64 array of matching chunk ids, or None if no condition
+            could be applied (i.e. the search should not be restricted)
+        """
+        resolved = [(self.resolve_field(field), op, value) for field, op, value in conditions]
+        matched: Optional[Set[int]] = None
+        with self._lock:
+            for field, op, value in resolved:
+                if field is None:
+                    continue
+                ids = self._evaluate(field, op, value)
+                if ids is None:
+                    continue
+                matched = ids if matched is None else matched & ids
+        if matched is None:
+            return None
+        return np.asarray(sorted(matched), dtype=np.int64)
+
+    def filter_ids(self, row_filters: Any) -> Optional[np.ndarray]:
+        """Parse a row filter and resolve it to matching chunk ids (see match())."""
+        return self.match(parse_row_filters(row_filters))
+
+    def facet_ids(self, field: str, value: Any) -> np.ndarray:
+        """
+        Ids of the chunks whose field has exactly this value (case-insensitive).
+
+        Unlike match(), the field name is not resolved loosely and values are
+        not matched by word, so facets such as "title" and "title_short" stay apart.
+        """
+        if isinstance(value, bool):
+            value = str(value).lower()
+        key = _normalize_value(str(value))
+        with self._lock:
+            ids = self._categorical.get(field, {}).get(key, set())
+            return np.asarray(sorted(ids), dtype=np.int64)
+
+    def facet_groups(self, field: str) -> Dict[str, np.ndarray]:
+        """All values of a field (normalized) with the ids of the chunks holding each."""
+        with self._lock:
+            return {
+                key: np.asarray(sorted(ids), dtype=np.int64)
+                for key, ids in self._categorical.get(field, {}).items()
+                if ids
+            }
+
+    # --------------------------------------------------------------------------
+    # Persistence
+    # --------------------------------------------------------------------------
+
+    def write(self, path: str) -> None:
+        """Write the index as JSON to path (write to a temp path and rename for atomicity)."""
+        with self._lock:
+            data = {
+                "ids": sorted(self._entries),
+                "categorical": {
+                    field: {key: sorted(ids) for key, ids in values.items()}
+                    for field, values in self._categorical.items()
+                },
+                "numeric": {
+                    field: {str(chunk_id): values for chunk_id, values in by_id.items()}
+                    for field, by_id in self._numeric.items()
+                },
+            }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path: str) -> "MetadataIndex":
+        """Load an index written by MetadataIndex.write."""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls()
+        index._categorical = {
+            field: {key: set(ids) for key, ids in values.items()}
+            for field, values in data.get("categorical", {}).items()
+        }
+        index._numeric = {
+            field: {int(chunk_id): values for chunk_id, values in by_id.items()}
+            for field, by_id in data.get("numeric", {}).items()
+        }
+        index._entries = {int(chunk_id): (set(), set()) for chunk_id in data.get("ids", [])}
+        for field, values in index._categorical.items():
+            for key, ids in values.items():
+                for chunk_id in ids:
+                    index._entries[chunk_id][0].add((field, key))
+        for field, by_id in index._numeric.items():
+            for chunk_id in by_id:
+                index._entries[chunk_id][1].add(field)
+        return index
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, Any]]) -> "MetadataIndex":
+        """Build an index from chunk records (dicts with "id"), e.g. ChunkStore.records()."""
+        index = cls()
+        for meta in records:
+            index.add([meta["id"]], [meta])
+        return index
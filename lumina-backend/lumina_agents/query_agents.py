@@ -6,6 +6,7 @@ It includes:
 - QueryIntent: Pydantic model for query classification
 - query_router_agent: Routes queries to appropriate handlers
 - synthesis_agent: Synthesizes answers from multiple sources
+- column_summary_agent: Summarizes column data at index time (map-reduce)
 """
 
 from agents import Agent
@@ -30,6 +31,10 @@ class QueryIntent(BaseModel):
         default=None,
         description="List of columns to analyze for 'rag_column_wise' intent. E.g., ['key_findings', 'methodology']."
     )
+    aggregate: bool = Field(
+        default=False,
+        description="For 'rag_column_wise': true when the query asks about the target columns as a whole (summaries, overall themes, trends, range of values across all records); false when it asks for specific records or details."
+    )
     
     # For row-wise queries
     row_filters: Optional[str] = Field(
@@ -71,6 +76,7 @@ You have four choices for the intent:
     - You can specify MULTIPLE columns to analyze together
     - Use this for: summaries, comparisons, trends, patterns across records
     - Examples: "Summarize the key findings from all papers.", "What methodologies were used and what were their results?", "Compare conclusions about Method X."
+    - Set `aggregate` to true when the query is about the columns as a whole across all records (e.g. "Summarize the key findings from all papers.", "What are the common limitations?"), and false when it looks for specific records or details within them (e.g. "Compare conclusions about Method X.")
 
 2.  **rag_row_wise**: For questions about specific records or that require full document context.
     - Specify filter criteria to narrow down which rows to search (optional but recommended)
@@ -127,3 +133,11 @@ synthesis_agent = Agent(
     hooks=CustomAgentHooks(display_name="Synthesis Agent"),
     model=LitellmModelSelector.get_model(use_custom=True),
 )
+
+column_summary_agent = Agent(
+    name="Column Summary Agent",
+    instructions="You are an expert data analyst. Your task is to write concise, factual summaries of the values of a data column, citing Record IDs for specific claims.",
+    output_type=str,
+    hooks=CustomAgentHooks(display_name="Column Summary Agent"),
+    model=LitellmModelSelector.get_model(use_custom=True),
+)
@@ -14,30 +14,61 @@ to query answering with citation support.
 
 import os
 import re
+import asyncio
 import json
+import shutil
+import threading
 import datetime
-from typing import List, Dict, Any, Optional, Tuple
+from typing import AsyncIterator, Iterable, Iterator, List, Dict, Any, Optional, Set, Tuple, Union
 
-import requests
+import httpx
 from openai import OpenAI
 import google.generativeai as genai
 import faiss
 import numpy as np
 
+from .embedding_engine import AsyncEmbeddingEngine, EmbeddingBatcher, shared_embedding_batcher
+from .embedding_cache import EmbeddingCache, QueryEmbeddingCache, shared_query_embedding_cache
+from .reranker_client import AsyncRerankerClient, RerankScoreCache
+from .chunk_store import ChunkStore, CHUNKS_FILE, LEGACY_METADATA_FILE, convert_metadata_json
+from .bm25_index import BM25Index, BM25_FILE, reciprocal_rank_fusion
+from .metadata_filter import MetadataIndex, METADATA_INDEX_FILE
+from .context_packer import pack_contexts, DEFAULT_CONTEXT_TOKENS, DEFAULT_PASSAGE_TOKENS
+from .ann_index import (
+    INDEX_TYPES, REMOVABLE_INDEX_TYPES, QUANTIZATION_TYPES,
+    choose_index_type, default_index_params, build_index, configure_search, search_index,
+    read_index, is_mapped, copy_index, quantize_vectors, dequantize_rows, StackedRows,
+)
+
 
 class RAGSystem:
     """
     A complete RAG pipeline implementation.
     
     This class provides methods for:
-    - Chunking markdown documents into table rows
+    - Chunking markdown documents into table rows, streamed with their table header
     - Embedding text using NVIDIA's embedding models
-    - Indexing documents with FAISS for fast retrieval
-    - Retrieving relevant documents based on semantic similarity
+    - Indexing documents with FAISS for fast retrieval, switching from exact to
+      approximate (HNSW, IVF-PQ) indexes as the corpus grows
+    - Adding, updating and removing indexed chunks by stable id
+    - Retrieving relevant documents based on semantic similarity, fused with
+      BM25 keyword matches (hybrid search), optionally restricted to the rows
+      matching a metadata filter
+    - Searching very large indexes coarse-to-fine: documents first, then the
+      records of the best-matching documents
+    - Retrieving for many queries at once (one batched embedding request,
+      one index search over the query matrix)
+    - Searching several facet groups of one index (e.g. the columns of a
+      session) with one query embedding and one reranker call
+    - Adapting the retrieval depth to the score distribution and picking a
+      diverse (MMR) candidate set before reranking
     - Reranking results using NVIDIA's reranker
-    - Generating answers using Google Gemini
+    - Generating answers using Google Gemini, optionally streamed token by token
     
-    The system supports saving and loading indexes for persistence.
+    The system supports saving and loading indexes for persistence, including
+    appending small deltas instead of rewriting the whole index,
+    memory-mapping indexes on load instead of copying them into RAM, and
+    storing vectors as float16 or int8 instead of float32.
     """
 
     # --- Constants ---
@@ -49,6 +80,37 @@ class RAGSystem:
 
     DEFAULT_GENERATOR_MODEL = 'gemini-2.5-flash'
 
+    # Incremental saves: delta files are compacted into the base after this many
+    DELTAS_DIR = "deltas"
+    MAX_DELTAS = 20
+
+    # Hybrid search: damping constant of reciprocal-rank fusion
+    RRF_K = 60
+
+    # Filtered search: up to this many matching rows are scored exactly instead
+    # of searching the index with an ID selector
+    FILTER_EXACT_MAX_ROWS = 20_000
+
+    # Adaptive retrieval: only candidates within ADAPTIVE_SCORE_WINDOW of the best
+    # similarity go to the reranker; if even the last candidate is that close the
+    # search is widened (up to ADAPTIVE_MAX_TOP_K); a top hit RERANK_SKIP_MARGIN
+    # ahead of the runner-up is decisive and reranking is skipped
+    ADAPTIVE_SCORE_WINDOW = 0.2
+    ADAPTIVE_MAX_TOP_K = 50
+    RERANK_SKIP_MARGIN = 0.1
+
+    # MMR diversification: relevance vs. novelty trade-off, and how many candidates
+    # (per reranked result) are kept for the reranker
+    MMR_LAMBDA = 0.7
+    MMR_CANDIDATE_FACTOR = 2
+
+    # Hierarchical retrieval: records are grouped into documents by DOCUMENT_FIELD,
+    # and a hierarchical search only scores the records of the best documents
+    DOCUMENT_FIELD = "_source_document"
+    DOCUMENTS_FILE = "documents.npz"
+    HIERARCHY_MIN_VECTORS = 100_000  # below this a flat search is already cheap
+    HIERARCHY_TOP_DOCUMENTS = 10
+
     def __init__(
         self,
         embed_api_key: str,
@@ -59,6 +121,21 @@ class RAGSystem:
         reranker_model: str = DEFAULT_RERANKER_MODEL,
         reranker_url: str = DEFAULT_RERANKER_URL,
         generator_model: str = DEFAULT_GENERATOR_MODEL,
+        embed_concurrency: int = 4,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        query_embedding_cache: Optional[QueryEmbeddingCache] = None,
+        rerank_score_cache: Optional[RerankScoreCache] = None,
+        embedding_batcher: Optional[EmbeddingBatcher] = None,
+        index_type: str = "auto",
+        background_index_build: bool = True,
+        mmap_index: bool = False,
+        hybrid_search: bool = False,
+        embedding_quantization: str = "none",
+        adaptive_retrieval: bool = False,
+        mmr_diversification: bool = False,
+        max_context_tokens: int = DEFAULT_CONTEXT_TOKENS,
+        max_passage_tokens: int = DEFAULT_PASSAGE_TOKENS,
+        hierarchical_retrieval: bool = True,
         verbose: bool = False
     ):
         """
@@ -73,9 +150,41 @@ class RAGSystem:
             reranker_model: The reranker model to use
             reranker_url: The API endpoint for the reranker
             generator_model: The Gemini model to use for generation
+            embed_concurrency: Maximum number of embedding batches in flight at once
+            embedding_cache: Optional persistent cache consulted before embedding passages
+            query_embedding_cache: LRU for query embeddings; defaults to the process-wide cache
+            rerank_score_cache: LRU for reranker logits; defaults to the process-wide cache
+            embedding_batcher: Coalesces async query embeddings into batched requests;
+                defaults to the process-wide batcher
+            index_type: "auto" (chosen from the vector count) or one of "flat", "hnsw", "ivfpq"
+            background_index_build: If True, approximate indexes are built on a background
+                thread while searches keep using the current index
+            mmap_index: If True, load_index() memory-maps the index and embeddings instead
+                of reading them into RAM (for read-mostly serving); they are copied into
+                memory on the first modification
+            hybrid_search: If True, retrieve() fuses the dense ranking with a BM25
+                keyword ranking (reciprocal-rank fusion); the BM25 index is kept
+                either way, so it can also be enabled per call
+            embedding_quantization: "none" (float32), "fp16" or "int8" storage for the
+                faiss vectors (flat / HNSW scalar quantizer) and embeddings.npy; a
+                loaded index keeps the quantization it was saved with
+            adaptive_retrieval: If True, the pipelines size the candidate list from the
+                similarity scores and skip reranking when the top hit is decisive
+            mmr_diversification: If True, the pipelines drop near-duplicate candidates
+                (Maximal Marginal Relevance) before reranking
+            max_context_tokens: Token budget of the context passed to the generator
+            max_passage_tokens: Token budget of a single passage in that context
+            hierarchical_retrieval: If True, retrieval goes through the document index
+                whenever one was built (see build_document_index)
             verbose: If True, print detailed logging information
         """
         self.verbose = verbose
+        if index_type != "auto" and index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index_type '{index_type}'. Expected 'auto' or one of {INDEX_TYPES}.")
+        if embedding_quantization not in QUANTIZATION_TYPES:
+            raise ValueError(
+                f"Unknown embedding_quantization '{embedding_quantization}'. Expected one of {QUANTIZATION_TYPES}."
+            )
 
         # --- Device Setup ---
         self.device = None
@@ -97,12 +206,26 @@ class RAGSystem:
         # 1. Embedding Client (OpenAI-compatible)
         self.embed_client = OpenAI(api_key=self.embed_api_key, base_url=embed_base_url)
 
-        # 2. Reranker Client (Requests Session)
-        self.reranker_session = requests.Session()
-        self.reranker_session.headers.update({
-            "Authorization": f"Bearer {self.rerank_api_key}",
-            "Accept": "application/json",
-        })
+        # 1b. Async batch embedder used for indexing (concurrent, order-preserving)
+        self.embedding_engine = AsyncEmbeddingEngine(
+            api_key=self.embed_api_key,
+            base_url=embed_base_url,
+            model=self.embed_model,
+            max_concurrency=embed_concurrency,
+            verbose=self.verbose
+        )
+        self.embedding_cache = embedding_cache
+        self.query_embedding_cache = query_embedding_cache or shared_query_embedding_cache
+        self.embedding_batcher = embedding_batcher or shared_embedding_batcher
+
+        # 2. Reranker Client (pooled httpx, with a logit cache)
+        self.reranker_client = AsyncRerankerClient(
+            api_key=self.rerank_api_key,
+            url=self.reranker_url,
+            model=self.reranker_model,
+            score_cache=rerank_score_cache,
+            verbose=self.verbose
+        )
 
         # 3. Generator Client (Gemini)
         try:
@@ -116,27 +239,81 @@ class RAGSystem:
             self.generator_client = None
 
         # --- Data Storage ---
-        self.document_embeddings: Optional[np.ndarray] = None
-        self.chunks_metadata: List[Dict[str, Any]] = []
+        self.faiss_index: Optional[faiss.Index] = None
+        self.document_embeddings: Optional[np.ndarray] = None  # float32, float16 or int8 rows
+        self.embedding_scales: Optional[np.ndarray] = None     # per-row scales of int8 rows
+        self.chunk_ids: np.ndarray = np.empty(0, dtype=np.int64)  # aligned with document_embeddings rows
+        self.chunks_metadata: ChunkStore = ChunkStore()         # keyed by stable chunk id
+        self.bm25_index: Optional[BM25Index] = BM25Index()      # None for indexes saved without one
+        self.metadata_index: Optional[MetadataIndex] = MetadataIndex()  # filterable fields, for row filters
+        # Deltas replayed over a memory-mapped base (see _overlay_deltas); None otherwise
+        self._masked_ids: Optional[np.ndarray] = None       # base ids hidden from base searches
+        self._overlay_ids: Optional[np.ndarray] = None      # ids of the rows appended by deltas
+        self._overlay_vectors: Optional[np.ndarray] = None  # their normalized float32 vectors
+        # Nothing is loaded from disk yet, so the first save must write a full base
+        self._reset_pending_delta(full_rewrite=True)
+
+        # --- Index Type ---
+        self.index_type = index_type              # requested type ("auto" resolves by size)
+        self.background_index_build = background_index_build
+        self.built_index_type = "flat"            # actual type of self.faiss_index
+        self.index_params: Dict[str, Any] = {}
+        self._index_generation = 0                # bumped on every mutation
+        self._index_lock = threading.RLock()      # guards index swaps against mutations
+        self._searches_done = threading.Condition(self._index_lock)
+        self._active_searches = 0                 # faiss searches running outside the lock
+        self._build_thread: Optional[threading.Thread] = None
+        self._row_of_id: Optional[Dict[int, int]] = None
+
+        # --- Quantization ---
+        self.embedding_quantization = embedding_quantization
+
+        # --- Memory Mapping ---
+        self.mmap_index = mmap_index
+        self._index_mapped = False                # faiss_index is a read-only mapped view
+
+        # --- Hybrid Search ---
+        self.hybrid_search = hybrid_search
+
+        # --- Adaptive Retrieval ---
+        self.adaptive_retrieval = adaptive_retrieval
+        self.mmr_diversification = mmr_diversification
+
+        # --- Hierarchical Retrieval ---
+        self.hierarchical_retrieval = hierarchical_retrieval
+        self.document_field: Optional[str] = None  # set once a document index is built
+        self.document_keys: List[str] = []
+        self.document_vectors: Optional[np.ndarray] = None  # (n_documents, d), normalized
+        self._document_rows: Optional[List[np.ndarray]] = None  # embedding rows of each document
+        self._documents_stale = False
+
+        # --- Generation Context Budget ---
+        self.max_context_tokens = max_context_tokens
+        self.max_passage_tokens = max_passage_tokens
 
     def __del__(self):
-        """Clean up resources, like the requests session."""
+        """Clean up resources, like the chunk store connection."""
         if self.verbose:
             print("Closing RAGSystem resources...")
-        if hasattr(self, 'reranker_session') and self.reranker_session:
-            self.reranker_session.close()
+        if hasattr(self, 'chunks_metadata'):
+            self.chunks_metadata.close()
 
     # --------------------------------------------------------------------------
     # 1. CHUNKING
     # --------------------------------------------------------------------------
 
+    # Lines made only of pipes, hyphens, colons and whitespace, e.g. |---| or |:---| or | --- |
+    TABLE_SEPARATOR_RE = re.compile(r'^[|\s:-]+$')
+
     @staticmethod
     def chunk_by_table_row(markdown_content: str, min_char_len: int = 10) -> List[str]:
         """
         Split markdown content into table row strings.
 
         Identifies lines that look like markdown table rows (start and end with '|')
-        and filters out the table separator line (e.g., |---|---|).
+        and filters out the table separator line (e.g., |---|---|). Header rows
+        are returned like any other row; use iter_table_row_chunks() for data
+        rows that carry their table header and position.
 
         Args:
             markdown_content: The full text content of the markdown file
@@ -145,21 +322,15 @@ class RAGSystem:
         Returns:
             A list of strings, where each string is a single table row
         """
-        # Regex to detect the separator line, e.g., |---| or |:---| or | --- |
-        # This matches lines containing *only* pipe, hyphen, colon, and whitespace
-        separator_regex = re.compile(r'^[|\s:-]+$')
-
-        lines = markdown_content.split('\n')
         table_rows = []
-
-        for line in lines:
+        for line in markdown_content.split('\n'):
             cleaned_line = line.strip()
 
             # Check if it looks like a table row (starts and ends with a pipe)
             if cleaned_line.startswith('|') and cleaned_line.endswith('|'):
 
                 # Check if it's the separator line. If so, skip it.
-                if separator_regex.match(cleaned_line):
+                if RAGSystem.TABLE_SEPARATOR_RE.match(cleaned_line):
                     continue
 
                 # Only add non-empty rows with at least the minimum characters
@@ -168,6 +339,90 @@ class RAGSystem:
 
         return table_rows
 
+    @staticmethod
+    def iter_table_row_chunks(
+        source: Union[str, "os.PathLike[str]", Iterable[str]],
+        min_char_len: int = 10
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Stream table rows out of a markdown document, one self-describing chunk at a time.
+
+        The document is read line by line, so memory stays flat however large it
+        is. Each row chunk is prefixed with the header row of its table (the row
+        just above the |---| separator), so the column names travel with the values.
+
+        Args:
+            source: Path of a markdown file, an open text file, or any iterable of
+                lines (e.g. markdown.splitlines() or a generator over a download)
+            min_char_len: The minimum character length for a row to be included
+
+        Yields:
+            (chunk_text, metadata) pairs; metadata has 'table_index' (0-based, per
+            run of table lines), 'table_row' (0-based data row within the table)
+            and 'line_number' (1-based). Rows of tables without a separator line
+            have no header prefix.
+        """
+        header: Optional[str] = None
+        pending: Optional[Tuple[int, str]] = None  # last table line; may turn out to be a header
+        table_index, table_row = -1, 0
+        in_table = False
+
+        def emit(line_number: int, row: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+            nonlocal table_row
+            if len(row) < min_char_len:
+                return None
+            chunk = f"{header}\n{row}" if header else row
+            meta = {
+                "table_index": table_index,
+                "table_row": table_row,
+                "line_number": line_number,
+            }
+            table_row += 1
+            return chunk, meta
+
+        for line_number, line in enumerate(RAGSystem._iter_lines(source), start=1):
+            cleaned_line = line.strip()
+            is_row = cleaned_line.startswith('|') and cleaned_line.endswith('|')
+
+            if not is_row:
+                # Anything else ends the current table
+                if pending is not None and (chunk := emit(*pending)):
+                    yield chunk
+                pending, header, in_table = None, None, False
+                continue
+
+            if not in_table:
+                in_table = True
+                table_index += 1
+                table_row = 0
+
+            if RAGSystem.TABLE_SEPARATOR_RE.match(cleaned_line):
+                # The line above the separator is the header, not data
+                if pending is not None:
+                    header = pending[1]
+                    pending = None
+                    table_row = 0
+                continue
+
+            if pending is not None and (chunk := emit(*pending)):
+                yield chunk
+            pending = (line_number, cleaned_line)
+
+        if pending is not None and (chunk := emit(*pending)):
+            yield chunk
+
+    @staticmethod
+    def _iter_lines(source: Union[str, "os.PathLike[str]", Iterable[str]]) -> Iterator[str]:
+        """Lines of a file path or of an iterable of lines, without reading it all at once."""
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, 'r', encoding='utf-8') as f:
+                yield from f
+            return
+
+        for piece in source:
+            # Pieces may keep their line ending or hold several lines
+            yield from piece.splitlines() or [""]
+
     # --------------------------------------------------------------------------
     # 2. EMBEDDING & INDEXING (Internal Helpers + Public Method)
     # --------------------------------------------------------------------------
@@ -199,6 +454,9 @@ class RAGSystem:
     def _embed_query(self, query: str) -> Optional[np.ndarray]:
         """
         Generate and tensorize embedding for a user query.
+
+        Served from the query embedding cache when the same (normalized) query
+        was embedded before, or is being embedded right now by another thread.
         
         Args:
             query: The query text to embed
@@ -206,18 +464,83 @@ class RAGSystem:
         Returns:
             NumPy array of the embedding, or None on error
         """
-        if self.verbose:
-            print(f"Generating embedding for query: '{query[:100]}...'")
-        embedding = self._embed_single_chunk(query, input_type="query")
-        if embedding:
+        def compute() -> Optional[np.ndarray]:
             if self.verbose:
-                print(f"Successfully generated query embedding (dimension: {len(embedding)})")
-            return np.array(embedding, dtype=np.float32)
-        else:
+                print(f"Generating embedding for query: '{query[:100]}...'")
+            embedding = self._embed_single_chunk(query, input_type="query")
+            if embedding:
+                if self.verbose:
+                    print(f"Successfully generated query embedding (dimension: {len(embedding)})")
+                return np.array(embedding, dtype=np.float32)
             if self.verbose:
                 print("Failed to generate query embedding")
             return None
 
+        # Identical queries (e.g. one per column index) share a single API call
+        return self.query_embedding_cache.get_or_compute(self.embed_model, query, compute)
+
+    async def _aembed_query(self, query: str) -> Optional[np.ndarray]:
+        """
+        Async version of _embed_query(). The API call is shared with concurrent
+        queries from any RAGSystem in the process (see EmbeddingBatcher).
+
+        Args:
+            query: The query text to embed
+
+        Returns:
+            NumPy array of the embedding, or None on error
+        """
+        async def compute() -> Optional[np.ndarray]:
+            if self.verbose:
+                print(f"Generating embedding for query: '{query[:100]}...'")
+            try:
+                vectors = await self.embedding_batcher.embed(self.embedding_engine, [query], input_type="query")
+            except Exception as e:
+                if self.verbose:
+                    print(f"Error embedding chunk: {e}")
+                return None
+            if self.verbose:
+                print(f"Successfully generated query embedding (dimension: {vectors.shape[1]})")
+            return vectors[0]
+
+        return await self.query_embedding_cache.aget_or_compute(self.embed_model, query, compute)
+
+    def _embed_queries(self, queries: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        Embed several queries, sending the uncached ones in one batched request.
+
+        Args:
+            queries: The query texts to embed
+
+        Returns:
+            Embeddings aligned with queries (None where embedding failed)
+        """
+        def compute_many(missing: List[str]) -> List[Optional[np.ndarray]]:
+            if self.verbose:
+                print(f"Generating embeddings for {len(missing)} queries in one batch...")
+            try:
+                return list(self.embedding_engine.embed_sync(missing, input_type="query", show_progress=False))
+            except Exception as e:
+                if self.verbose:
+                    print(f"Error embedding queries: {e}")
+                return [None] * len(missing)
+
+        return self.query_embedding_cache.get_many_or_compute(self.embed_model, queries, compute_many)
+
+    async def _aembed_queries(self, queries: List[str]) -> List[Optional[np.ndarray]]:
+        """Async version of _embed_queries(); the request is shared through the embedding batcher."""
+        async def compute_many(missing: List[str]) -> List[Optional[np.ndarray]]:
+            if self.verbose:
+                print(f"Generating embeddings for {len(missing)} queries in one batch...")
+            try:
+                return list(await self.embedding_batcher.embed(self.embedding_engine, missing, input_type="query"))
+            except Exception as e:
+                if self.verbose:
+                    print(f"Error embedding queries: {e}")
+                return [None] * len(missing)
+
+        return await self.query_embedding_cache.aget_many_or_compute(self.embed_model, queries, compute_many)
+
     def _embed_multiple_chunks(
         self,
         chunks: List[str],
@@ -226,52 +549,173 @@ class RAGSystem:
         show_progress: bool = True
     ) -> Optional[np.ndarray]:
         """
-        Generate embeddings for multiple text chunks in batches.
+        Generate embeddings for multiple text chunks in concurrent batches.
+
+        Chunks found in the embedding cache (if configured) are not re-embedded.
+        The rest are batched by payload size (capped at batch_size chunks) and
+        sent through the async embedding engine. Failed batches are retried
+        rather than skipped, so row i of the result always belongs to chunks[i].
         
         Args:
             chunks: List of text chunks to embed
             input_type: Either "query" or "passage"
-            batch_size: Number of chunks to process in each batch
+            batch_size: Maximum number of chunks per batch
             show_progress: Whether to print progress information
             
         Returns:
             NumPy array of embeddings with shape (num_chunks, embedding_dim)
+
+        Raises:
+            ValueError: If no chunks were provided
+            MaxRetriesExceededError: If a batch keeps failing after all retries
         """
-        embeddings = []
-        total_batches = (len(chunks) + batch_size - 1) // batch_size
+        if not chunks:
+            raise ValueError("No embeddings were generated for the provided chunks.")
 
-        for i in range(0, len(chunks), batch_size):
-            batch = chunks[i:i + batch_size]
-            batch_num = i // batch_size + 1
+        if self.embedding_cache is None:
+            return self.embedding_engine.embed_sync(
+                chunks,
+                input_type=input_type,
+                max_batch_size=batch_size,
+                show_progress=show_progress
+            )
 
-            if show_progress and self.verbose:
-                print(f"Processing embedding batch {batch_num}/{total_batches}...")
+        # 1. Serve what we can from the cache
+        cached = self.embedding_cache.get_many(chunks, self.embed_model, input_type)
+        miss_positions = [i for i, vector in enumerate(cached) if vector is None]
+        if self.verbose:
+            print(f"Embedding cache: {len(chunks) - len(miss_positions)} hits, {len(miss_positions)} misses.")
+
+        # 2. Embed only the misses (identical texts are sent once)
+        if miss_positions:
+            unique_misses = list(dict.fromkeys(chunks[i] for i in miss_positions))
+            new_vectors = self.embedding_engine.embed_sync(
+                unique_misses,
+                input_type=input_type,
+                max_batch_size=batch_size,
+                show_progress=show_progress
+            )
+            self.embedding_cache.put_many(unique_misses, new_vectors, self.embed_model, input_type)
+            by_text = dict(zip(unique_misses, new_vectors))
+            for i in miss_positions:
+                cached[i] = by_text[chunks[i]]
 
-            try:
-                response = self.embed_client.embeddings.create(
-                    input=batch,
-                    model=self.embed_model,
-                    encoding_format="float",
-                    extra_body={"input_type": input_type, "truncate": "NONE"}
-                )
-                for data in response.data:
-                    embeddings.append(data.embedding)
-            except Exception as e:
-                if self.verbose:
-                    print(f"Error in batch {batch_num}: {e}. Skipping batch.")
-                continue
+        return np.vstack(cached).astype(np.float32)
 
-        if not embeddings:
-            raise ValueError("No embeddings were generated for the provided chunks.")
+    def _build_chunk_metadata(
+        self,
+        chunks: List[str],
+        ids: List[int],
+        base_metadata: Optional[Dict[str, Any]],
+        per_chunk_metadata: Optional[List[Dict[str, Any]]]
+    ) -> Dict[int, Dict[str, Any]]:
+        """Assemble the stored metadata dict for each chunk, keyed by chunk id."""
+        metadata = {}
+        base_metadata = base_metadata or {}
+        for i, (chunk_id, text) in enumerate(zip(ids, chunks)):
+            meta = {"id": chunk_id, "text": text}
+            # apply base
+            meta.update(base_metadata)
+            # apply per-chunk
+            if per_chunk_metadata and i < len(per_chunk_metadata):
+                meta.update(per_chunk_metadata[i])
+            metadata[chunk_id] = meta
+        return metadata
+
+    @staticmethod
+    def _new_faiss_index(d: int) -> faiss.Index:
+        """Create an empty inner-product index addressed by stable int64 ids."""
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(d))
+
+    def _ensure_writable(self) -> None:
+        """Prepare the index for in-place updates. Caller holds _index_lock."""
+        self._materialize_overlay()
+        if self._index_mapped:
+            # Modifying a mapped faiss index aborts the process, so copy it into memory first
+            self._set_index(copy_index(self.faiss_index), self.built_index_type, self.index_params)
+        self._ensure_id_mapped()
+
+    def _ensure_id_mapped(self) -> None:
+        """
+        Upgrade an index built before stable ids (plain IndexFlatIP, ids == positions)
+        to an id-mapped index so it can be updated in place.
+        """
+        if isinstance(self.faiss_index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+            return
+        if self.document_embeddings is None:
+            raise ValueError("Cannot update a legacy index without its embeddings.npy.")
+        id_mapped = self._new_faiss_index(self.document_embeddings.shape[1])
+        id_mapped.add_with_ids(self._embedding_rows(), self.chunk_ids)
+        self.faiss_index = id_mapped
+
+    def index_markdown(
+        self,
+        source: Union[str, "os.PathLike[str]", Iterable[str]],
+        base_metadata: Optional[Dict[str, Any]] = None,
+        min_char_len: int = 10,
+        rows_per_batch: int = 10_000,
+        batch_size: int = 32,
+        show_progress: bool = True
+    ) -> int:
+        """
+        Index the table rows of a markdown document as header-prefixed chunks.
+
+        This replaces whatever was indexed before. Rows are streamed from
+        iter_table_row_chunks() and embedded rows_per_batch at a time, so the
+        document is never held in memory as a whole; each chunk's table_index,
+        table_row and line_number are stored as its metadata.
+
+        Args:
+            source: Path of a markdown file, an open text file, or any iterable of lines
+            base_metadata: Metadata applied to every chunk (e.g. the source file name)
+            min_char_len: The minimum character length for a row to be included
+            rows_per_batch: Rows embedded and added per add_documents() call
+            batch_size: Batch size for embedding generation
+            show_progress: Whether to show progress information
+
+        Returns:
+            Number of rows indexed
+
+        Raises:
+            ValueError: If the document has no table rows to index (the
+                current index is left unchanged)
+        """
+        total = 0
+        chunks: List[str] = []
+        per_chunk_metadata: List[Dict[str, Any]] = []
+
+        def flush() -> None:
+            add = self.index_documents if total == 0 else self.add_documents
+            add(
+                chunks,
+                base_metadata=base_metadata,
+                per_chunk_metadata=per_chunk_metadata,
+                batch_size=batch_size,
+                show_progress=show_progress
+            )
+
+        for chunk, meta in self.iter_table_row_chunks(source, min_char_len):
+            chunks.append(chunk)
+            per_chunk_metadata.append(meta)
+            if len(chunks) >= rows_per_batch:
+                flush()
+                total += len(chunks)
+                chunks, per_chunk_metadata = [], []
+        if not chunks and total == 0:
+            raise ValueError("No table rows found in the markdown document; nothing was indexed.")
+        if chunks:
+            flush()
+            total += len(chunks)
 
-        # Convert to NumPy array
-        embedding_array = np.array(embeddings, dtype=np.float32)
-        return embedding_array
+        if self.verbose:
+            print(f"Indexed {total} table rows.")
+        return total
 
     def index_documents(
         self,
         chunks: List[str],
         *,
+        ids: Optional[List[int]] = None,
         base_metadata: Optional[Dict[str, Any]] = None,
         per_chunk_metadata: Optional[List[Dict[str, Any]]] = None,
         batch_size: int = 32,
@@ -280,154 +724,667 @@ class RAGSystem:
         """
         Index documents by generating and storing their embeddings.
 
+        This replaces whatever was indexed before. Use add_documents,
+        update_documents and remove_documents to change an existing index.
+
         Args:
             chunks: List of text chunks to index
+            ids: Stable ids for the chunks (e.g. ExtractedRecord.id); defaults to positions
             base_metadata: Metadata applied to every chunk
             per_chunk_metadata: List of metadata dicts aligned with chunks
             batch_size: Batch size for embedding generation
             show_progress: Whether to show progress information
+
+        Raises:
+            ValueError: If chunks is empty (the current index is left unchanged)
         """
+        if not chunks:
+            raise ValueError("No chunks to index.")
         if self.verbose:
             print(f"Indexing {len(chunks)} documents...")
 
-        # Generate embeddings
-        self.document_embeddings = self._embed_multiple_chunks(
+        # Start from an empty index; everything written is a fresh base
+        with self._index_lock:
+            self.faiss_index = None
+            self.built_index_type = "flat"
+            self.index_params = {}
+            self.document_embeddings = None
+            self.embedding_scales = None
+            self.chunk_ids = np.empty(0, dtype=np.int64)
+            self.chunks_metadata = ChunkStore()
+            self.bm25_index = BM25Index()
+            self.metadata_index = MetadataIndex()
+            self.document_field, self.document_keys, self.document_vectors = None, [], None
+            self._masked_ids = self._overlay_ids = self._overlay_vectors = None
+            self._reset_pending_delta(full_rewrite=True)
+            self._mark_index_changed()
+
+        self.add_documents(
             chunks,
-            input_type="passage",
+            ids=ids,
+            base_metadata=base_metadata,
+            per_chunk_metadata=per_chunk_metadata,
             batch_size=batch_size,
             show_progress=show_progress
         )
 
-        if self.document_embeddings is None:
-            if self.verbose:
-                print("Indexing failed as no embeddings were generated.")
-            self.chunks_metadata = []
-            return
-
-        self.document_embeddings = self.document_embeddings.astype('float32')
-        faiss.normalize_L2(self.document_embeddings)
-        
-        d = self.document_embeddings.shape[1]  # dimension
-        self.faiss_index = faiss.IndexFlatIP(d)
-        self.faiss_index.add(self.document_embeddings)
-        
-        # Store metadata
-        self.chunks_metadata = []
-        base_metadata = base_metadata or {}
-        for i, text in enumerate(chunks):
-            meta = {"id": i, "text": text}
-            # apply base
-            meta.update(base_metadata)
-            # apply per-chunk
-            if per_chunk_metadata and i < len(per_chunk_metadata):
-                meta.update(per_chunk_metadata[i])
-            self.chunks_metadata.append(meta)
-
-        if self.verbose:
+        if self.verbose and self.document_embeddings is not None:
             print(f"Successfully indexed {len(self.chunks_metadata)} documents")
             print(f"Embeddings array shape: {self.document_embeddings.shape}")
             print(f"Embeddings stored in-memory (NumPy)")
 
     # --------------------------------------------------------------------------
-    # 3. RETRIEVAL (Internal Helpers + Public Method)
+    # 2b. INCREMENTAL UPDATES
     # --------------------------------------------------------------------------
-    
-    @staticmethod
-    def _batch_calculate_similarities(
-        query_embedding: np.ndarray,
-        document_embeddings: np.ndarray,
-        normalize: bool = True
-    ) -> np.ndarray:
+
+    def add_documents(
+        self,
+        chunks: List[str],
+        *,
+        ids: Optional[List[int]] = None,
+        base_metadata: Optional[Dict[str, Any]] = None,
+        per_chunk_metadata: Optional[List[Dict[str, Any]]] = None,
+        batch_size: int = 32,
+        show_progress: bool = True
+    ) -> None:
         """
-        Calculate cosine similarities between query and documents.
-        
+        Embed and add new chunks to the index under stable ids.
+
         Args:
-            query_embedding: Query embedding vector
-            document_embeddings: Document embedding matrix
-            normalize: Whether to normalize vectors
-            
-        Returns:
-            1D array of cosine similarities with shape (num_docs,)
-        """
-        # ensure 1D
-        if query_embedding.ndim > 1:
-            query = query_embedding.reshape(-1)
-        else:
-            query = query_embedding
+            chunks: List of text chunks to add
+            ids: Stable ids for the chunks; defaults to the next free integer ids
+            base_metadata: Metadata applied to every chunk
+            per_chunk_metadata: List of metadata dicts aligned with chunks
+            batch_size: Batch size for embedding generation
+            show_progress: Whether to show progress information
 
-        docs = document_embeddings  # (N, D)
+        Raises:
+            ValueError: If ids are duplicated or already present in the index
+        """
+        if not chunks:
+            return
 
-        if normalize:
-            # normalize query
-            q_norm = query / (np.linalg.norm(query) + 1e-12)
-            # normalize docs row-wise
-            d_norms = np.linalg.norm(docs, axis=1, keepdims=True) + 1e-12
-            docs_norm = docs / d_norms
-            sims = np.dot(docs_norm, q_norm)   # (N,)
-        else:
-            sims = np.dot(docs, query)
+        if ids is None:
+            start = int(self.chunk_ids.max()) + 1 if len(self.chunk_ids) else 0
+            ids = list(range(start, start + len(chunks)))
+        ids = [int(i) for i in ids]
+        if len(ids) != len(chunks):
+            raise ValueError(f"Got {len(ids)} ids for {len(chunks)} chunks.")
+        if len(set(ids)) != len(ids):
+            raise ValueError("Chunk ids must be unique.")
+        existing = [i for i in ids if i in self.chunks_metadata]
+        if existing:
+            raise ValueError(f"Ids already indexed (use update_documents): {existing[:10]}")
+
+        embeddings = self._embed_multiple_chunks(
+            chunks,
+            input_type="passage",
+            batch_size=batch_size,
+            show_progress=show_progress
+        )
+        metadata = self._build_chunk_metadata(chunks, ids, base_metadata, per_chunk_metadata)
+        self._add_vectors(np.asarray(ids, dtype=np.int64), embeddings, metadata)
 
-        return sims  # (N,)
+        if self.verbose:
+            print(f"Added {len(ids)} documents. Index now holds {len(self.chunks_metadata)}.")
 
-    @staticmethod
-    def _find_top_k_similar(
-        query_embedding: np.ndarray,
-        document_embeddings: np.ndarray,
-        top_k: int = 5,
-        threshold: Optional[float] = None
-    ) -> Tuple[np.ndarray, np.ndarray]:
+    def update_documents(
+        self,
+        chunks: List[str],
+        *,
+        ids: List[int],
+        base_metadata: Optional[Dict[str, Any]] = None,
+        per_chunk_metadata: Optional[List[Dict[str, Any]]] = None,
+        batch_size: int = 32,
+        show_progress: bool = True
+    ) -> None:
         """
-        Find top-k most similar documents to the query.
-        
+        Replace the text and metadata of existing chunks (upsert).
+
+        Only chunks whose text changed are re-embedded; ids not yet in the
+        index are added.
+
         Args:
-            query_embedding: Query embedding vector
-            document_embeddings: Document embedding matrix
-            top_k: Number of top results to return
-            threshold: Optional similarity threshold
-            
-        Returns:
-            Tuple of (indices, scores) for top-k results
+            chunks: New text for each chunk
+            ids: Stable ids of the chunks to update
+            base_metadata: Metadata applied to every chunk
+            per_chunk_metadata: List of metadata dicts aligned with chunks
+            batch_size: Batch size for embedding generation
+            show_progress: Whether to show progress information
         """
-        sims = RAGSystem._batch_calculate_similarities(query_embedding, document_embeddings)
-
-        if threshold is not None:
-            # mask out below threshold
-            mask = sims >= threshold
-            # to keep ordering, we can just set to -inf
-            sims = np.where(mask, sims, -np.inf)
+        if not chunks:
+            return
+        ids = [int(i) for i in ids]
+        if len(ids) != len(chunks):
+            raise ValueError(f"Got {len(ids)} ids for {len(chunks)} chunks.")
+
+        metadata = self._build_chunk_metadata(chunks, ids, base_metadata, per_chunk_metadata)
+
+        # Metadata-only changes keep their vectors
+        changed = []
+        for chunk_id in ids:
+            old = self.chunks_metadata.get(chunk_id)
+            if old is not None and old.get("text") == metadata[chunk_id]["text"]:
+                self.chunks_metadata[chunk_id] = metadata[chunk_id]
+                if self.metadata_index is not None:
+                    self.metadata_index.add([chunk_id], [metadata[chunk_id]])
+                self._pending_upserts.add(chunk_id)
+            else:
+                changed.append(chunk_id)
+
+        if changed:
+            stale = [i for i in changed if i in self.chunks_metadata]
+            if stale:
+                self.remove_documents(stale)
+            embeddings = self._embed_multiple_chunks(
+                [metadata[i]["text"] for i in changed],
+                input_type="passage",
+                batch_size=batch_size,
+                show_progress=show_progress
+            )
+            self._add_vectors(
+                np.asarray(changed, dtype=np.int64),
+                embeddings,
+                {i: metadata[i] for i in changed}
+            )
 
-        top_k = min(top_k, sims.shape[0])
+        if self.verbose:
+            print(f"Updated {len(ids)} documents ({len(changed)} re-embedded).")
 
-        # argpartition for top-k
-        top_idx = np.argpartition(-sims, top_k - 1)[:top_k]   # unsorted indices
-        # sort them by score descending
-        top_idx = top_idx[np.argsort(-sims[top_idx])]
+    def remove_documents(self, ids: List[int]) -> int:
+        """
+        Remove chunks from the index by stable id.
 
-        top_scores = sims[top_idx]
+        Args:
+            ids: Stable ids of the chunks to remove (unknown ids are ignored)
 
-        # if threshold, drop -inf
-        if threshold is not None:
-            valid = top_scores > -np.inf
-            top_idx = top_idx[valid]
-            top_scores = top_scores[valid]
+        Returns:
+            The number of chunks removed
+        """
+        ids = [int(i) for i in ids if int(i) in self.chunks_metadata]
+        if not ids:
+            return 0
+
+        id_array = np.asarray(ids, dtype=np.int64)
+        with self._index_lock:
+            self._wait_for_searches()
+            self._ensure_writable()
+            keep = ~np.isin(self.chunk_ids, id_array)
+            self.chunk_ids = self.chunk_ids[keep]
+            if self.document_embeddings is not None:
+                self.document_embeddings = self.document_embeddings[keep]
+            if self.embedding_scales is not None:
+                self.embedding_scales = self.embedding_scales[keep]
+
+            if self.built_index_type in REMOVABLE_INDEX_TYPES:
+                self.faiss_index.remove_ids(faiss.IDSelectorBatch(id_array))
+            else:
+                # HNSW graphs cannot drop nodes: serve exact search over the kept
+                # vectors until the approximate index is rebuilt
+                params = self._index_params_for("flat")
+                self._set_index(build_index("flat", self._embedding_rows(), self.chunk_ids, params), "flat", params)
+
+            if self.bm25_index is not None:
+                self.bm25_index.remove(ids)
+            if self.metadata_index is not None:
+                self.metadata_index.remove(ids)
+            for chunk_id in ids:
+                self.chunks_metadata.pop(chunk_id, None)
+                self._pending_upserts.discard(chunk_id)
+                self._pending_removals.add(chunk_id)
+            self._mark_index_changed()
 
-        return top_idx, top_scores
+        if self.verbose:
+            print(f"Removed {len(ids)} documents. Index now holds {len(self.chunks_metadata)}.")
+        return len(ids)
 
-    def retrieve(
+    def replace_facet(
         self,
-        query: str,
-        top_k: int = 10,
-        threshold: Optional[float] = None,
-        debug_json_path: Optional[str] = None
-    ) -> List[Dict[str, Any]]:
+        facet: str,
+        value: str,
+        chunks: List[str],
+        base_metadata: Optional[Dict[str, Any]] = None,
+        per_chunk_metadata: Optional[List[Dict[str, Any]]] = None,
+        batch_size: int = 32,
+        show_progress: bool = True
+    ) -> int:
         """
-        Search for documents similar to the query.
+        Replace every chunk of one facet group (e.g. a re-extracted column of a
+        session index) with new chunks, leaving the other groups untouched.
 
         Args:
-            query: Search query
+            facet: Chunk metadata field the groups are keyed by (e.g. "column_name")
+            value: The group to replace
+            chunks: New text chunks for the group (may be empty to just drop it)
+            base_metadata: Metadata applied to every new chunk
+            per_chunk_metadata: List of metadata dicts aligned with chunks; each
+                should carry the facet value so the group can be found again
+            batch_size: Batch size for embedding generation
+            show_progress: Whether to show progress information
+
+        Returns:
+            The number of chunks removed
+        """
+        if self.metadata_index is None:
+            self.metadata_index = MetadataIndex.from_records(self.chunks_metadata.records())
+        removed = self.remove_documents(self.metadata_index.facet_ids(facet, value).tolist())
+        self.add_documents(
+            chunks,
+            base_metadata=base_metadata,
+            per_chunk_metadata=per_chunk_metadata,
+            batch_size=batch_size,
+            show_progress=show_progress
+        )
+        return removed
+
+    def _add_vectors(
+        self,
+        ids: np.ndarray,
+        embeddings: np.ndarray,
+        metadata: Dict[int, Dict[str, Any]]
+    ) -> None:
+        """Normalize and insert vectors + metadata, recording them for the next delta save."""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        faiss.normalize_L2(embeddings)
+
+        stored, scales = quantize_vectors(embeddings, self.embedding_quantization)
+
+        with self._index_lock:
+            self._wait_for_searches()
+            if self.faiss_index is None:
+                # The first batch also trains the scalar quantizer, if any
+                params = self._index_params_for("flat")
+                self._set_index(build_index("flat", embeddings, ids, params), "flat", params)
+            else:
+                self._ensure_writable()
+                self.faiss_index.add_with_ids(embeddings, ids)
+
+            # Arrays are replaced rather than modified, so background builds can snapshot them
+            if self.document_embeddings is None or len(self.document_embeddings) == 0:
+                self.document_embeddings = stored
+                self.embedding_scales = scales
+            else:
+                self.document_embeddings = np.vstack([self.document_embeddings, stored])
+                if scales is not None:
+                    self.embedding_scales = np.concatenate([self.embedding_scales, scales])
+            self.chunk_ids = np.concatenate([self.chunk_ids, ids])
+            self.chunks_metadata.update(metadata)
+            if self.bm25_index is not None:
+                self.bm25_index.add(ids.tolist(), [metadata[int(i)]["text"] for i in ids])
+            if self.metadata_index is not None:
+                self.metadata_index.add(ids.tolist(), [metadata[int(i)] for i in ids])
+
+            for chunk_id in ids.tolist():
+                self._pending_upserts.add(chunk_id)
+            self._mark_index_changed()
+
+    def _reset_pending_delta(self, full_rewrite: bool = False) -> None:
+        """Forget recorded changes (after a save, or when the whole index is rebuilt)."""
+        self._pending_upserts = set()
+        self._pending_removals = set()
+        self._needs_full_save = full_rewrite
+
+    # --------------------------------------------------------------------------
+    # 2c. INDEX TYPE SELECTION
+    # --------------------------------------------------------------------------
+
+    def resolve_index_type(self, n_vectors: Optional[int] = None) -> str:
+        """
+        The index type this system should be using for its current size.
+
+        Args:
+            n_vectors: Vector count to resolve for (defaults to the indexed count)
+
+        Returns:
+            One of "flat", "hnsw", "ivfpq"
+        """
+        if self.index_type != "auto":
+            return self.index_type
+        return choose_index_type(len(self.chunk_ids) if n_vectors is None else n_vectors)
+
+    def _set_index(
+        self,
+        index: faiss.Index,
+        index_type: str,
+        params: Dict[str, Any],
+        mapped: bool = False
+    ) -> None:
+        """Swap in a new faiss index. Caller holds _index_lock."""
+        configure_search(index, index_type, params)
+        self.faiss_index = index
+        self.built_index_type = index_type
+        self.index_params = params
+        self._index_mapped = mapped
+
+    def _wait_for_searches(self) -> None:
+        """
+        Block until no search is using the faiss index. Caller holds _index_lock,
+        and must call this before changing anything: the lock is released while waiting.
+
+        Searches run outside the lock, so the index must not be modified in place
+        (add_with_ids, remove_ids) under them; swapping in a new index is always safe.
+        """
+        while self._active_searches:
+            self._searches_done.wait()
+
+    def _mark_index_changed(self) -> None:
+        """Invalidate derived state after vectors were added or removed. Caller holds _index_lock."""
+        self._index_generation += 1
+        self._row_of_id = None
+        self._documents_stale = self.document_vectors is not None
+
+    def _row_of_id_map(self) -> Dict[int, int]:
+        """Chunk id -> row of document_embeddings (rebuilt lazily after changes)."""
+        row_of_id = self._row_of_id
+        if row_of_id is None:
+            # Rows hidden by a delta overlay carry id -1
+            row_of_id = {chunk_id: row for row, chunk_id in enumerate(self.chunk_ids.tolist()) if chunk_id >= 0}
+            self._row_of_id = row_of_id
+        return row_of_id
+
+    def _index_params_for(self, index_type: str, n_vectors: Optional[int] = None) -> Dict[str, Any]:
+        """Default parameters of an index type for this system's size and quantization."""
+        d = self.document_embeddings.shape[1] if self.document_embeddings is not None else 0
+        n_vectors = len(self.chunk_ids) if n_vectors is None else n_vectors
+        return default_index_params(index_type, n_vectors, d, self.embedding_quantization)
+
+    def _embedding_rows(self, rows: Any = None) -> np.ndarray:
+        """float32 values of stored embedding rows (all rows if None), dequantized if needed."""
+        return dequantize_rows(self.document_embeddings, self.embedding_scales, rows)
+
+    def _build_target_index(self, index_type: str) -> Tuple[faiss.Index, Dict[str, Any]]:
+        """Build (and train) an index of the given type over the current vectors."""
+        vectors, ids = self._embedding_rows(), self.chunk_ids
+        params = default_index_params(index_type, len(ids), vectors.shape[1], self.embedding_quantization)
+        if self.verbose:
+            print(f"Building {index_type} index over {len(ids)} vectors...")
+        return build_index(index_type, vectors, ids, params), params
+
+    def ensure_index_type(self) -> None:
+        """Synchronously bring the faiss index to the resolved type (waits for any background build)."""
+        self.wait_for_index_build()
+        if self.faiss_index is None or self.document_embeddings is None:
+            return
+        target = self.resolve_index_type()
+        if target == self.built_index_type:
+            return
+        with self._index_lock:
+            self._wait_for_searches()
+            self._materialize_overlay()
+            index, params = self._build_target_index(target)
+            self._set_index(index, target, params)
+
+    def schedule_index_build(self) -> None:
+        """
+        Start building the resolved index type if the current index is a different one.
+
+        With background_index_build the (possibly long) HNSW build or IVF-PQ
+        training runs on a daemon thread, and searches keep using the current
+        index until the new one is swapped in.
+        """
+        if self.faiss_index is None or self.document_embeddings is None:
+            return
+        if self.resolve_index_type() == self.built_index_type:
+            return
+        if self._masked_ids is not None:
+            return  # a delta overlay is served as loaded until the next write folds it in
+        if not self.background_index_build:
+            self.ensure_index_type()
+            return
+        with self._index_lock:
+            if self._build_thread is not None:
+                return  # the running build re-checks the generation when it finishes
+            self._build_thread = threading.Thread(
+                target=self._background_index_build, name="rag-index-build", daemon=True
+            )
+            self._build_thread.start()
+
+    def _background_index_build(self) -> None:
+        """Build the target index from a snapshot; retry if the vectors changed meanwhile."""
+        try:
+            while True:
+                with self._index_lock:
+                    target = self.resolve_index_type()
+                    if target == self.built_index_type:
+                        return
+                    generation = self._index_generation
+                    stored, scales, ids = self.document_embeddings, self.embedding_scales, self.chunk_ids
+
+                vectors = dequantize_rows(stored, scales)
+                params = default_index_params(target, len(ids), vectors.shape[1], self.embedding_quantization)
+                if self.verbose:
+                    print(f"Building {target} index over {len(ids)} vectors in the background...")
+                index = build_index(target, vectors, ids, params)
+
+                with self._index_lock:
+                    if generation == self._index_generation:
+                        self._set_index(index, target, params)
+                        if self.verbose:
+                            print(f"Swapped in {target} index ({len(ids)} vectors).")
+                        return
+                # The index changed while we were building; start over with the new vectors
+        except Exception as e:
+            if self.verbose:
+                print(f"Background index build failed: {e}. Keeping the {self.built_index_type} index.")
+        finally:
+            with self._index_lock:
+                self._build_thread = None
+
+    def wait_for_index_build(self, timeout: Optional[float] = None) -> None:
+        """Block until a running background index build has finished."""
+        thread = self._build_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    # --------------------------------------------------------------------------
+    # 2d. DOCUMENT HIERARCHY
+    # --------------------------------------------------------------------------
+
+    def build_document_index(self, field: Optional[str] = None) -> int:
+        """
+        Build document-level vectors for coarse-to-fine retrieval.
+
+        Records are grouped by the value of a metadata field (the source
+        document by default) and each document gets the normalized mean of its
+        records' embeddings, so no embedding call is made. Once built, retrieval
+        (with hierarchical_retrieval) scores the documents first and then only
+        the records of the best HIERARCHY_TOP_DOCUMENTS of them.
+
+        Args:
+            field: Metadata field naming each record's document (defaults to DOCUMENT_FIELD)
+
+        Returns:
+            Number of documents indexed (0 if no record has the field)
+        """
+        field = field or self.DOCUMENT_FIELD
+        # Under the lock so writers cannot change the rows being grouped; every
+        # field is swapped in one statement so readers never mix two builds
+        with self._index_lock:
+            if self.document_embeddings is None:
+                raise ValueError("No documents indexed. Call index_documents first.")
+            if self.metadata_index is None:
+                self.metadata_index = MetadataIndex.from_records(self.chunks_metadata.records())
+
+            keys, centroids, member_rows = [], [], []
+            for key, rows in self._group_rows(field).items():
+                keys.append(key)
+                centroids.append(self._embedding_rows(rows).mean(axis=0))
+                member_rows.append(rows)
+
+            if not keys:
+                (self.document_field, self.document_keys, self.document_vectors,
+                 self._document_rows, self._documents_stale) = None, [], None, None, False
+                return 0
+            vectors = np.ascontiguousarray(np.stack(centroids), dtype=np.float32)
+            faiss.normalize_L2(vectors)
+            (self.document_field, self.document_keys, self.document_vectors,
+             self._document_rows, self._documents_stale) = field, keys, vectors, member_rows, False
+        if self.verbose:
+            print(f"Built document index over {len(keys)} documents ('{field}').")
+        return len(keys)
+
+    def _group_rows(self, field: str) -> Dict[str, np.ndarray]:
+        """Rows of document_embeddings grouped by the (normalized) value of a metadata field."""
+        row_of_id = self._row_of_id_map()
+        groups = {}
+        for key, ids in self.metadata_index.facet_groups(field).items():
+            rows = np.asarray([row_of_id[i] for i in ids.tolist() if i in row_of_id], dtype=np.int64)
+            if len(rows):
+                groups[key] = rows
+        return groups
+
+    def _top_document_rows(self, query_vector: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Coarse step of hierarchical retrieval: the embedding rows of the records
+        in the HIERARCHY_TOP_DOCUMENTS documents closest to the query.
+
+        Returns None when there is no document index.
+        """
+        with self._index_lock:
+            if self.document_vectors is None:
+                return None
+            if self._documents_stale:
+                # Records were added or removed since the documents were built
+                self.build_document_index(self.document_field)
+                if self.document_vectors is None:
+                    return None
+            if self._document_rows is None:
+                # Loaded from disk: member rows are derived once from the metadata index
+                groups = self._group_rows(self.document_field)
+                self._document_rows = [groups.get(key, np.empty(0, dtype=np.int64)) for key in self.document_keys]
+            # Vectors and member rows of the same build
+            document_vectors, document_rows = self.document_vectors, self._document_rows
+
+        scores = document_vectors @ query_vector[0]
+        n_top = min(self.HIERARCHY_TOP_DOCUMENTS, len(scores))
+        top = np.argpartition(-scores, n_top - 1)[:n_top]
+        rows = np.concatenate([document_rows[i] for i in top])
+        if self.verbose:
+            print(f"Hierarchical search: {n_top} of {len(scores)} documents, {len(rows)} records.")
+        return rows
+
+    def _exact_search_rows(self, rows: np.ndarray, query_vector: np.ndarray, top_k: int) -> List[Tuple[int, float]]:
+        """Score the given embedding rows by exact inner product; returns (id, score) best first."""
+        scores = self._embedding_rows(rows) @ query_vector[0]
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(self.chunk_ids[rows[i]]), float(scores[i])) for i in top]
+
+    # --------------------------------------------------------------------------
+    # 3. RETRIEVAL (Internal Helpers + Public Method)
+    # --------------------------------------------------------------------------
+    
+    @staticmethod
+    def _batch_calculate_similarities(
+        query_embedding: np.ndarray,
+        document_embeddings: np.ndarray,
+        normalize: bool = True
+    ) -> np.ndarray:
+        """
+        Calculate cosine similarities between query and documents.
+        
+        Args:
+            query_embedding: Query embedding vector
+            document_embeddings: Document embedding matrix
+            normalize: Whether to normalize vectors
+            
+        Returns:
+            1D array of cosine similarities with shape (num_docs,)
+        """
+        # ensure 1D
+        if query_embedding.ndim > 1:
+            query = query_embedding.reshape(-1)
+        else:
+            query = query_embedding
+
+        docs = document_embeddings  # (N, D)
+
+        if normalize:
+            # normalize query
+            q_norm = query / (np.linalg.norm(query) + 1e-12)
+            # normalize docs row-wise
+            d_norms = np.linalg.norm(docs, axis=1, keepdims=True) + 1e-12
+            docs_norm = docs / d_norms
+            sims = np.dot(docs_norm, q_norm)   # (N,)
+        else:
+            sims = np.dot(docs, query)
+
+        return sims  # (N,)
+
+    @staticmethod
+    def _find_top_k_similar(
+        query_embedding: np.ndarray,
+        document_embeddings: np.ndarray,
+        top_k: int = 5,
+        threshold: Optional[float] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find top-k most similar documents to the query.
+        
+        Args:
+            query_embedding: Query embedding vector
+            document_embeddings: Document embedding matrix
+            top_k: Number of top results to return
+            threshold: Optional similarity threshold
+            
+        Returns:
+            Tuple of (indices, scores) for top-k results
+        """
+        sims = RAGSystem._batch_calculate_similarities(query_embedding, document_embeddings)
+
+        if threshold is not None:
+            # mask out below threshold
+            mask = sims >= threshold
+            # to keep ordering, we can just set to -inf
+            sims = np.where(mask, sims, -np.inf)
+
+        top_k = min(top_k, sims.shape[0])
+
+        # argpartition for top-k
+        top_idx = np.argpartition(-sims, top_k - 1)[:top_k]   # unsorted indices
+        # sort them by score descending
+        top_idx = top_idx[np.argsort(-sims[top_idx])]
+
+        top_scores = sims[top_idx]
+
+        # if threshold, drop -inf
+        if threshold is not None:
+            valid = top_scores > -np.inf
+            top_idx = top_idx[valid]
+            top_scores = top_scores[valid]
+
+        return top_idx, top_scores
+
+    def retrieve(
+        self,
+        query: str,
+        top_k: int = 10,
+        threshold: Optional[float] = None,
+        debug_json_path: Optional[str] = None,
+        hybrid: Optional[bool] = None,
+        row_filters: Any = None,
+        hierarchical: Optional[bool] = None,
+        allowed_ids: Optional[np.ndarray] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Search for documents similar to the query.
+
+        With hybrid search, the top_k dense hits and the top_k BM25 hits are
+        fused with reciprocal-rank fusion, so exact matches on names, IDs or
+        units surface even when the embedding misses them.
+
+        Args:
+            query: Search query
             top_k: Number of results to return
             threshold: Optional similarity threshold
             debug_json_path: If provided, saves the raw retrieval results to this JSON file
+            hybrid: Fuse with BM25 keyword matches (defaults to self.hybrid_search)
+            row_filters: Optional metadata filter (see filter_ids); only matching rows are searched
+            hierarchical: Search the best documents first, then their records
+                (defaults to self.hierarchical_retrieval; needs build_document_index)
+            allowed_ids: Ids already resolved from row_filters by filter_ids();
+                used instead of row_filters when given
 
         Returns:
             List of search results with scores and metadata
@@ -439,19 +1396,280 @@ class RAGSystem:
         query_embedding = self._embed_query(query)
         if query_embedding is None:
             return []
-        query_embedding = query_embedding.astype('float32').reshape(1, -1)
-        faiss.normalize_L2(query_embedding)
-        
-        # 2. Find top-k similar documents
-        distances, indices = self.faiss_index.search(query_embedding, top_k)
+        return self._search_embedding(
+            query, query_embedding, top_k, threshold, debug_json_path, hybrid,
+            allowed_ids if allowed_ids is not None else self.filter_ids(row_filters), hierarchical
+        )
+
+    async def aretrieve(
+        self,
+        query: str,
+        top_k: int = 10,
+        threshold: Optional[float] = None,
+        debug_json_path: Optional[str] = None,
+        hybrid: Optional[bool] = None,
+        row_filters: Any = None,
+        hierarchical: Optional[bool] = None,
+        allowed_ids: Optional[np.ndarray] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Async version of retrieve(); the query embedding is awaited, not run in a thread.
+
+        The filter resolution and the index search run in a worker thread: an
+        exhaustive flat index (below HNSW_MIN_VECTORS), the id map of a large
+        index or a memory-mapped index paging in from disk would otherwise
+        stall every other request on the event loop.
+
+        Args:
+            query: Search query
+            top_k: Number of results to return
+            threshold: Optional similarity threshold
+            debug_json_path: If provided, saves the raw retrieval results to this JSON file
+            hybrid: Fuse with BM25 keyword matches (defaults to self.hybrid_search)
+            row_filters: Optional metadata filter (see filter_ids); only matching rows are searched
+            hierarchical: Search the best documents first, then their records
+                (defaults to self.hierarchical_retrieval; needs build_document_index)
+            allowed_ids: Ids already resolved from row_filters by filter_ids();
+                used instead of row_filters when given
+
+        Returns:
+            List of search results with scores and metadata
+        """
+        if self.document_embeddings is None:
+            raise ValueError("No documents indexed. Call index_documents first.")
+
+        query_embedding = await self._aembed_query(query)
+        if query_embedding is None:
+            return []
+        if allowed_ids is None and row_filters is not None:
+            allowed_ids = await asyncio.to_thread(self.filter_ids, row_filters)
+        return await asyncio.to_thread(
+            self._search_embedding,
+            query, query_embedding, top_k, threshold, debug_json_path, hybrid, allowed_ids, hierarchical
+        )
+
+    def retrieve_many(
+        self,
+        queries: List[str],
+        top_k: int = 10,
+        hybrid: Optional[bool] = None,
+        row_filters: Any = None,
+        allowed_ids: Optional[np.ndarray] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Search for several queries at once.
+
+        Queries not in the query embedding cache are embedded in one batched
+        request, and the index is searched once with the whole query matrix.
+        Suited to batch jobs (evaluation, prefetching suggested questions, batch
+        query endpoints).
+
+        Args:
+            queries: Search queries
+            top_k: Number of results per query
+            hybrid: Fuse with BM25 keyword matches (defaults to self.hybrid_search)
+            row_filters: Optional metadata filter applied to every query (see filter_ids)
+            allowed_ids: Ids already resolved from row_filters by filter_ids();
+                used instead of row_filters when given
+
+        Returns:
+            One list of search results per query, aligned with queries (empty
+            for queries that could not be embedded)
+        """
+        if self.document_embeddings is None:
+            raise ValueError("No documents indexed. Call index_documents first.")
+        if not queries:
+            return []
+
+        query_embeddings = self._embed_queries(queries)
+        if allowed_ids is None:
+            allowed_ids = self.filter_ids(row_filters)
+        return self._search_embeddings(queries, query_embeddings, top_k, hybrid, allowed_ids)
+
+    async def aretrieve_many(
+        self,
+        queries: List[str],
+        top_k: int = 10,
+        hybrid: Optional[bool] = None,
+        row_filters: Any = None,
+        allowed_ids: Optional[np.ndarray] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """Async version of retrieve_many(); the batched query embedding is awaited, the search runs in a thread."""
+        if self.document_embeddings is None:
+            raise ValueError("No documents indexed. Call index_documents first.")
+        if not queries:
+            return []
+
+        query_embeddings = await self._aembed_queries(queries)
+        if allowed_ids is None and row_filters is not None:
+            allowed_ids = await asyncio.to_thread(self.filter_ids, row_filters)
+        return await asyncio.to_thread(self._search_embeddings, queries, query_embeddings, top_k, hybrid, allowed_ids)
+
+    def _search_embeddings(
+        self,
+        queries: List[str],
+        query_embeddings: List[Optional[np.ndarray]],
+        top_k: int,
+        hybrid: Optional[bool] = None,
+        allowed_ids: Optional[np.ndarray] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """Batched _search_embedding(): one dense search for all embedded queries."""
+        embedded = [i for i, embedding in enumerate(query_embeddings) if embedding is not None]
+        results: List[List[Dict[str, Any]]] = [[] for _ in queries]
+        if not embedded:
+            return results
+
+        query_vectors = np.stack([np.asarray(query_embeddings[i], dtype=np.float32) for i in embedded])
+        faiss.normalize_L2(query_vectors)
+        dense = self._dense_search_many(query_vectors, top_k, allowed_ids)
+        for row, i in enumerate(embedded):
+            results[i] = self._rank_and_format(
+                queries[i], query_vectors[row:row + 1], dense[row], top_k, None, None, hybrid, allowed_ids
+            )
+        return results
+
+    def _search_embedding(
+        self,
+        query: str,
+        query_embedding: np.ndarray,
+        top_k: int,
+        threshold: Optional[float],
+        debug_json_path: Optional[str],
+        hybrid: Optional[bool] = None,
+        allowed_ids: Optional[np.ndarray] = None,
+        hierarchical: Optional[bool] = None
+    ) -> List[Dict[str, Any]]:
+        """Search the index with an embedded query and format the hits (shared by retrieve/aretrieve)."""
+        query_vector = self._normalized_query(query_embedding)
+        hierarchical = self.hierarchical_retrieval if hierarchical is None else hierarchical
+        if hierarchical and self.document_vectors is not None:
+            # Coarse step: only the records of the closest documents are scored
+            rows = self._top_document_rows(query_vector)
+            if rows is not None and allowed_ids is not None:
+                rows = rows[np.isin(self.chunk_ids[rows], allowed_ids)]
+            if rows is not None and len(rows):
+                dense = self._exact_search_rows(rows, query_vector, top_k)
+                return self._rank_and_format(
+                    query, query_vector, dense, top_k, threshold, debug_json_path, hybrid,
+                    np.sort(self.chunk_ids[rows])
+                )
 
-        # 3. Format results
+        # 2. Find top-k similar documents (among the rows matching the filter, if any)
+        dense = self._dense_search(query_vector, top_k, allowed_ids)
+        return self._rank_and_format(
+            query, query_vector, dense, top_k, threshold, debug_json_path, hybrid, allowed_ids
+        )
+
+    @staticmethod
+    def _normalized_query(query_embedding: np.ndarray) -> np.ndarray:
+        """Query embedding as an L2-normalized float32 row vector of shape (1, d)."""
+        query_vector = np.array(query_embedding, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(query_vector)
+        return query_vector
+
+    def _dense_search(
+        self,
+        query_vector: np.ndarray,
+        top_k: int,
+        allowed_ids: Optional[np.ndarray] = None
+    ) -> List[Tuple[int, float]]:
+        """Nearest chunks to a normalized query as (id, score) best first, optionally restricted to allowed_ids."""
+        return self._dense_search_many(query_vector, top_k, allowed_ids)[0]
+
+    def _dense_search_many(
+        self,
+        query_vectors: np.ndarray,
+        top_k: int,
+        allowed_ids: Optional[np.ndarray] = None
+    ) -> List[List[Tuple[int, float]]]:
+        """_dense_search() for a (q, d) matrix of normalized queries, in one index search."""
+        self.schedule_index_build()
+        if allowed_ids is not None and len(allowed_ids) <= self.FILTER_EXACT_MAX_ROWS:
+            return self._exact_search_many(allowed_ids, query_vectors, top_k)
+        # Snapshot under the lock, search outside it: concurrent faiss searches are thread-safe
+        with self._index_lock:
+            index, index_type, params = self.faiss_index, self.built_index_type, self.index_params
+            exact_vectors, exact_scales = self.document_embeddings, self.embedding_scales
+            row_of_id = self._row_of_id_map() if params.get("refine_factor", 1) > 1 else None
+            masked_ids, overlay_ids, overlay_vectors = self._masked_ids, self._overlay_ids, self._overlay_vectors
+            self._active_searches += 1
+        base_filter = allowed_ids
+        if masked_ids is not None and allowed_ids is not None:
+            base_filter = allowed_ids[~np.isin(allowed_ids, masked_ids)]
+        try:
+            distances, indices = search_index(
+                index, index_type, params, query_vectors, top_k,
+                exact_vectors=exact_vectors,
+                row_of_id=row_of_id,
+                id_filter=base_filter,
+                exact_scales=exact_scales,
+                excluded_ids=masked_ids
+            )
+        finally:
+            with self._index_lock:
+                self._active_searches -= 1
+                if not self._active_searches:
+                    self._searches_done.notify_all()
+        if overlay_ids is not None and len(overlay_ids):
+            distances, indices = self._merge_overlay_hits(
+                distances, indices, query_vectors, overlay_ids, overlay_vectors, top_k, allowed_ids
+            )
+        return [
+            [(int(idx), float(score)) for idx, score in zip(row_ids, row_scores) if idx != -1]
+            for row_ids, row_scores in zip(indices, distances)
+        ]
+
+    @staticmethod
+    def _merge_overlay_hits(
+        distances: np.ndarray,
+        indices: np.ndarray,
+        query_vectors: np.ndarray,
+        overlay_ids: np.ndarray,
+        overlay_vectors: np.ndarray,
+        top_k: int,
+        allowed_ids: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Merge base index hits with exact scores of the (few) delta overlay rows, per query."""
+        if allowed_ids is not None:
+            keep = np.isin(overlay_ids, allowed_ids)
+            overlay_ids, overlay_vectors = overlay_ids[keep], overlay_vectors[keep]
+        scores = np.hstack([distances, query_vectors @ overlay_vectors.T]).astype(np.float32, copy=False)
+        ids = np.hstack([indices, np.broadcast_to(overlay_ids, (len(query_vectors), len(overlay_ids)))])
+        scores[ids == -1] = -np.inf
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :top_k]
+        return np.take_along_axis(scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+    def _rank_and_format(
+        self,
+        query: str,
+        query_vector: np.ndarray,
+        dense: List[Tuple[int, float]],
+        top_k: int,
+        threshold: Optional[float],
+        debug_json_path: Optional[str],
+        hybrid: Optional[bool] = None,
+        allowed_ids: Optional[np.ndarray] = None
+    ) -> List[Dict[str, Any]]:
+        """Fuse dense hits with the BM25 ranking and turn them into result dicts."""
+        # 2b. Fuse with the BM25 keyword ranking
+        hybrid = self.hybrid_search if hybrid is None else hybrid
+        ranked, lexical, fused = dense, {}, {}
+        if hybrid and self.bm25_index is not None and len(self.bm25_index):
+            lexical_ids, lexical_scores = self.bm25_index.search(query, top_k=top_k, allowed_ids=allowed_ids)
+            lexical = dict(zip(lexical_ids.tolist(), lexical_scores.tolist()))
+            fused = dict(reciprocal_rank_fusion(
+                [[idx for idx, _ in dense], list(lexical)], k=self.RRF_K, top_k=top_k
+            ))
+            ranked = self._with_similarity_scores(list(fused), dict(dense), query_vector[0])
+
+        # 3. Format results (only the top-k records are read from the chunk store)
+        hits = self.chunks_metadata.get_many(idx for idx, _ in ranked)
         results: List[Dict[str, Any]] = []
-        for idx, score in zip(indices[0], distances[0]):
-            if idx == -1:
+        for idx, score in ranked:
+            if idx not in hits:
                 continue
 
-            chunk_meta = self.chunks_metadata[int(idx)]
+            chunk_meta = hits[idx]
 
             # start with the core fields
             result = {
@@ -460,6 +1678,10 @@ class RAGSystem:
                 "text": chunk_meta["text"],
                 "text_preview": chunk_meta["text"][:200] + "...",
             }
+            if fused:
+                result["rrf_score"] = fused[idx]
+                if idx in lexical:
+                    result["bm25_score"] = lexical[idx]
 
             # add extra metadata (like column_name, row_id, source_file, etc.)
             for k, v in chunk_meta.items():
@@ -491,6 +1713,211 @@ class RAGSystem:
 
         return results
 
+    def _exact_search(self, ids: np.ndarray, query_vector: np.ndarray, top_k: int) -> List[Tuple[int, float]]:
+        """Score only the given chunks by exact inner product; returns (id, score) best first."""
+        return self._exact_search_many(ids, query_vector.reshape(1, -1), top_k)[0]
+
+    def _exact_search_many(
+        self,
+        ids: np.ndarray,
+        query_vectors: np.ndarray,
+        top_k: int
+    ) -> List[List[Tuple[int, float]]]:
+        """_exact_search() for a (q, d) matrix of queries, as one matrix product."""
+        if len(ids) == 0 or self.document_embeddings is None:
+            return [[] for _ in range(len(query_vectors))]
+        row_of_id = self._row_of_id_map()
+        ids = [i for i in ids.tolist() if i in row_of_id]
+        if not ids:
+            return [[] for _ in range(len(query_vectors))]
+        vectors = self._embedding_rows([row_of_id[i] for i in ids])
+        scores = query_vectors @ vectors.T  # (q, n)
+        hits = []
+        for row in scores:
+            order = np.argsort(-row, kind="stable")[:top_k]
+            hits.append([(ids[i], float(row[i])) for i in order])
+        return hits
+
+    def filter_ids(self, row_filters: Any) -> Optional[np.ndarray]:
+        """
+        Resolve a row filter to the ids of the matching chunks.
+
+        Args:
+            row_filters: A dict such as {'author': 'Smith', 'year': {'$gte': 2020}}, its
+                JSON / literal string form, or text like "author = Smith, year > 2020"
+                (e.g. QueryIntent.row_filters). Field names are matched loosely
+                against the indexed metadata fields.
+
+        Returns:
+            Sorted array of matching chunk ids (possibly empty), or None when the
+            filter is empty or none of its conditions apply to this index
+        """
+        if not row_filters or self.metadata_index is None:
+            return None
+        matched = self.metadata_index.filter_ids(row_filters)
+        if self.verbose and matched is not None:
+            print(f"Row filters {row_filters!r} matched {len(matched)} chunks.")
+        return matched
+
+    def retrieve_facets(
+        self,
+        query: str,
+        facet: str,
+        values: List[str],
+        top_k: int = 10,
+        hybrid: Optional[bool] = None
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Search several facet groups of the index (e.g. the columns of a session
+        index) with one query embedding.
+
+        Args:
+            query: Search query
+            facet: Chunk metadata field the groups are keyed by (e.g. "column_name")
+            values: Facet values to search; each gets its own top_k
+            top_k: Number of results per value
+            hybrid: Fuse with BM25 keyword matches (defaults to self.hybrid_search)
+
+        Returns:
+            Dict of value -> search results (empty list for values with no chunks)
+        """
+        if self.document_embeddings is None:
+            raise ValueError("No documents indexed. Call index_documents first.")
+
+        query_embedding = self._embed_query(query)
+        if query_embedding is None:
+            return {value: [] for value in values}
+        return self._search_facets(query, query_embedding, facet, values, top_k, hybrid)
+
+    async def aretrieve_facets(
+        self,
+        query: str,
+        facet: str,
+        values: List[str],
+        top_k: int = 10,
+        hybrid: Optional[bool] = None
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """Async version of retrieve_facets(); the query embedding is awaited, the search runs in a thread."""
+        if self.document_embeddings is None:
+            raise ValueError("No documents indexed. Call index_documents first.")
+
+        query_embedding = await self._aembed_query(query)
+        if query_embedding is None:
+            return {value: [] for value in values}
+        return await asyncio.to_thread(self._search_facets, query, query_embedding, facet, values, top_k, hybrid)
+
+    def _search_facets(
+        self,
+        query: str,
+        query_embedding: np.ndarray,
+        facet: str,
+        values: List[str],
+        top_k: int,
+        hybrid: Optional[bool]
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """Score the union of the facet groups once and take the top_k of each group."""
+        query_vector = self._normalized_query(query_embedding)
+        groups = {
+            value: (self.metadata_index.facet_ids(facet, value) if self.metadata_index is not None
+                    else np.empty(0, dtype=np.int64))
+            for value in values
+        }
+        union = np.unique(np.concatenate([np.empty(0, dtype=np.int64)] + list(groups.values())))
+
+        # One matrix product over every requested group when it is small enough,
+        # otherwise one selector search per group
+        scored: Optional[Dict[int, float]] = None
+        if len(union) <= self.FILTER_EXACT_MAX_ROWS:
+            scored = dict(self._exact_search(union, query_vector[0], len(union)))
+
+        results: Dict[str, List[Dict[str, Any]]] = {}
+        for value, ids in groups.items():
+            if len(ids) == 0:
+                results[value] = []
+                continue
+            if scored is not None:
+                dense = sorted(
+                    ((i, scored[i]) for i in ids.tolist() if i in scored), key=lambda hit: -hit[1]
+                )[:top_k]
+            else:
+                dense = self._dense_search(query_vector, top_k, ids)
+            results[value] = self._rank_and_format(query, query_vector, dense, top_k, None, None, hybrid, ids)
+
+        if self.verbose:
+            print(f"Retrieved {sum(len(r) for r in results.values())} chunks across {len(values)} '{facet}' groups.")
+        return results
+
+    def _with_similarity_scores(
+        self,
+        ids: List[int],
+        dense_scores: Dict[int, float],
+        query_vector: np.ndarray
+    ) -> List[Tuple[int, float]]:
+        """Pair fused ids with their cosine similarity, computing it for keyword-only hits."""
+        scores = dict(dense_scores)
+        missing = [i for i in ids if i not in scores]
+        if missing and self.document_embeddings is not None:
+            rows = np.flatnonzero(np.isin(self.chunk_ids, missing))
+            if len(rows):
+                sims = self._embedding_rows(rows) @ query_vector
+                scores.update(zip(self.chunk_ids[rows].tolist(), sims.tolist()))
+        return [(i, scores.get(i, 0.0)) for i in ids]
+
+    def diversify(
+        self,
+        results: List[Dict[str, Any]],
+        top_k: int,
+        lambda_mult: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Pick a diverse subset of retrieved results with Maximal Marginal Relevance.
+
+        Each step takes the result maximizing
+        lambda * similarity_to_query - (1 - lambda) * max_similarity_to_selected,
+        using the stored embeddings (no API call).
+
+        Args:
+            results: Results from retrieve(), carrying 'chunk_id' and 'similarity_score'
+            top_k: Number of results to keep
+            lambda_mult: 1.0 ranks by relevance only, 0.0 by novelty only
+                (defaults to MMR_LAMBDA)
+
+        Returns:
+            Up to top_k results, in selection order
+        """
+        if len(results) <= top_k or top_k <= 0 or self.document_embeddings is None:
+            return results[:max(top_k, 0)]
+        lambda_mult = self.MMR_LAMBDA if lambda_mult is None else lambda_mult
+
+        row_of_id = self._row_of_id_map()
+        rows = [row_of_id.get(r["chunk_id"]) for r in results]
+        known = [i for i, row in enumerate(rows) if row is not None]
+        if len(known) <= 1:
+            return results[:top_k]
+
+        vectors = self._embedding_rows([rows[i] for i in known])
+        pairwise = vectors @ vectors.T  # (n, n) cosine similarities
+        relevance = np.array([results[i]["similarity_score"] for i in known], dtype=np.float32)
+
+        selected = [int(np.argmax(relevance))]
+        redundancy = pairwise[selected[0]].copy()
+        available = np.ones(len(known), dtype=bool)
+        available[selected[0]] = False
+        for _ in range(min(top_k, len(known)) - 1):
+            mmr = lambda_mult * relevance - (1.0 - lambda_mult) * redundancy
+            mmr[~available] = -np.inf
+            pick = int(np.argmax(mmr))
+            selected.append(pick)
+            available[pick] = False
+            np.maximum(redundancy, pairwise[pick], out=redundancy)
+
+        chosen = [results[known[i]] for i in selected]
+        # Results without a stored vector cannot be compared; they only fill leftover slots
+        chosen.extend(results[i] for i, row in enumerate(rows) if row is None)
+        if self.verbose:
+            print(f"MMR kept {min(len(chosen), top_k)} of {len(results)} results.")
+        return chosen[:top_k]
+
     # --------------------------------------------------------------------------
     # 4. RERANKING
     # --------------------------------------------------------------------------
@@ -520,55 +1947,47 @@ class RAGSystem:
         if self.verbose:
             print(f"Reranking {len(search_results)} results for query: '{query[:50]}...'")
 
-        # Format passages as required by the API
-        passages_for_api = [{"text": res["text"]} for res in search_results]
-
-        payload = {
-            "model": self.reranker_model,
-            "query": {"text": query},
-            "passages": passages_for_api
-        }
-
         try:
-            response = self.reranker_session.post(self.reranker_url, json=payload)
-            response.raise_for_status()  # Raise an error for bad responses
-            response_body = response.json()
-
-            rankings = response_body.get("rankings")
-            if not rankings:
-                if self.verbose:
-                    print("Warning: Reranker response did not contain 'rankings'. Returning original results.")
-                return search_results
-
-            # Create a copy to avoid modifying the original list
-            reranked_data = list(search_results)
-
-            # Map rankings back to our original results
-            for rank_data in rankings:
-                original_index = rank_data.get("index")
-                score = rank_data.get("logit")  # The reranker score
+            scores = self.reranker_client.score_sync(query, [res["text"] for res in search_results])
+        except httpx.HTTPError as e:
+            if self.verbose:
+                print(f"Error calling reranker API: {e}. Returning original (non-reranked) results.")
+            return search_results
+        except Exception as e:
+            if self.verbose:
+                print(f"Error processing reranker response: {e}. Returning original (non-reranked) results.")
+            return search_results
 
-                if original_index is None or score is None:
-                    continue
+        return self._apply_rerank_scores(search_results, scores, top_k)
 
-                if 0 <= original_index < len(reranked_data):
-                    reranked_data[original_index]["rerank_score"] = score
+    async def arerank(
+        self,
+        query: str,
+        search_results: List[Dict[str, Any]],
+        top_k: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Async version of rerank(); awaits the pooled client instead of blocking a thread.
 
-            # Sort the list by the new rerank score, highest first
-            reranked_data.sort(key=lambda x: x.get("rerank_score", float('-inf')), reverse=True)
+        Args:
+            query: The original user query
+            search_results: The list of dicts from the retrieve() method
+            top_k: If provided, truncates the reranked list to this size
 
+        Returns:
+            A new list of search results, sorted by the new 'rerank_score'
+        """
+        if not search_results:
             if self.verbose:
-                print("Reranking complete.")
-
-            # Truncate to top_k if specified
-            if top_k is not None:
-                reranked_data = reranked_data[:top_k]
-                if self.verbose:
-                    print(f"Returning reranked top {len(reranked_data)} results.")
+                print("No search results to rerank.")
+            return []
 
-            return reranked_data
+        if self.verbose:
+            print(f"Reranking {len(search_results)} results for query: '{query[:50]}...'")
 
-        except requests.RequestException as e:
+        try:
+            scores = await self.reranker_client.score(query, [res["text"] for res in search_results])
+        except httpx.HTTPError as e:
             if self.verbose:
                 print(f"Error calling reranker API: {e}. Returning original (non-reranked) results.")
             return search_results
@@ -577,9 +1996,141 @@ class RAGSystem:
                 print(f"Error processing reranker response: {e}. Returning original (non-reranked) results.")
             return search_results
 
-    # --------------------------------------------------------------------------
-    # 5. GENERATION
-    # --------------------------------------------------------------------------
+        return self._apply_rerank_scores(search_results, scores, top_k)
+
+    def rerank_groups(
+        self,
+        query: str,
+        grouped_results: Dict[str, List[Dict[str, Any]]],
+        top_k: Optional[int] = None
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Rerank several result groups (e.g. from retrieve_facets) with a single reranker call.
+
+        Args:
+            query: The original user query
+            grouped_results: Dict of group -> search results
+            top_k: If provided, truncates each reranked group to this size
+
+        Returns:
+            Dict of group -> results sorted by 'rerank_score' (original order if the reranker fails)
+        """
+        passages = [res["text"] for results in grouped_results.values() for res in results]
+        if not passages:
+            return {group: [] for group in grouped_results}
+        try:
+            scores = self.reranker_client.score_sync(query, passages)
+        except Exception as e:
+            if self.verbose:
+                print(f"Error calling reranker API: {e}. Returning original (non-reranked) results.")
+            scores = [None] * len(passages)
+        return self._split_rerank_scores(grouped_results, scores, top_k)
+
+    async def arerank_groups(
+        self,
+        query: str,
+        grouped_results: Dict[str, List[Dict[str, Any]]],
+        top_k: Optional[int] = None
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """Async version of rerank_groups(); awaits the pooled client."""
+        passages = [res["text"] for results in grouped_results.values() for res in results]
+        if not passages:
+            return {group: [] for group in grouped_results}
+        try:
+            scores = await self.reranker_client.score(query, passages)
+        except Exception as e:
+            if self.verbose:
+                print(f"Error calling reranker API: {e}. Returning original (non-reranked) results.")
+            scores = [None] * len(passages)
+        return self._split_rerank_scores(grouped_results, scores, top_k)
+
+    def _split_rerank_scores(
+        self,
+        grouped_results: Dict[str, List[Dict[str, Any]]],
+        scores: List[Optional[float]],
+        top_k: Optional[int]
+    ) -> Dict[str, List[Dict[str, Any]]]:
+        """Hand the flat list of scores back to each group and rerank the groups separately."""
+        reranked: Dict[str, List[Dict[str, Any]]] = {}
+        offset = 0
+        for group, results in grouped_results.items():
+            group_scores = scores[offset:offset + len(results)]
+            offset += len(results)
+            if any(score is not None for score in group_scores):
+                reranked[group] = self._apply_rerank_scores(results, group_scores, top_k)
+            else:
+                reranked[group] = list(results)[:top_k] if top_k is not None else list(results)
+        return reranked
+
+    def _apply_rerank_scores(
+        self,
+        search_results: List[Dict[str, Any]],
+        scores: List[Optional[float]],
+        top_k: Optional[int]
+    ) -> List[Dict[str, Any]]:
+        """Attach 'rerank_score' to each result, sort by it and truncate to top_k."""
+        # Create a copy to avoid modifying the original list
+        reranked_data = list(search_results)
+
+        for result, score in zip(reranked_data, scores):
+            if score is not None:
+                result["rerank_score"] = score
+
+        # Sort the list by the new rerank score, highest first
+        reranked_data.sort(key=lambda x: x.get("rerank_score", float('-inf')), reverse=True)
+
+        if self.verbose:
+            print("Reranking complete.")
+
+        # Truncate to top_k if specified
+        if top_k is not None:
+            reranked_data = reranked_data[:top_k]
+            if self.verbose:
+                print(f"Returning reranked top {len(reranked_data)} results.")
+
+        return reranked_data
+
+    # --------------------------------------------------------------------------
+    # 5. GENERATION
+    # --------------------------------------------------------------------------
+
+    NO_CONTEXT_ANSWER = "Sorry, no relevant context was found to answer your query."
+    NO_GENERATOR_ANSWER = "Error: Gemini client is not configured. Please check your API key."
+
+    def _build_generation_prompt(
+        self,
+        query: str,
+        retrieved_chunks: List[Dict[str, Any]],
+        top_k_context: int
+    ) -> Optional[str]:
+        """Build the Gemini prompt from the top-k chunks (None if there is no context)."""
+        # 1. Pack the top-k chunk texts, best first, into the context token budget
+        top_chunks = retrieved_chunks[:top_k_context]
+        context_list = pack_contexts(
+            (chunk['text'] for chunk in top_chunks),
+            max_tokens=self.max_context_tokens,
+            max_passage_tokens=self.max_passage_tokens
+        )
+
+        if not context_list:
+            return None
+
+        # 2. Format the context for the prompt
+        context_string = "\n\n---\n\n".join(context_list)
+
+        # 3. Create the prompt
+        return f"""
+        You are a helpful assistant. Please answer the following query based *only* on the provided context.
+        If the answer cannot be found in the context, state that you cannot answer the question with the information given.
+
+        QUERY:
+        {query}
+
+        CONTEXT:
+        {context_string}
+
+        ANSWER:
+        """
 
     def generate(
         self,
@@ -599,99 +2150,580 @@ class RAGSystem:
             A string containing the generated answer
         """
         if not self.generator_client:
-            return "Error: Gemini client is not configured. Please check your API key."
-
-        # 1. Extract text from the top-k chunks
-        top_chunks = retrieved_chunks[:top_k_context]
-        context_list = [chunk['text'] for chunk in top_chunks]
+            return self.NO_GENERATOR_ANSWER
 
-        if not context_list:
-            return "Sorry, no relevant context was found to answer your query."
-
-        # 2. Format the context for the prompt
-        context_string = "\n\n---\n\n".join(context_list)
+        prompt = self._build_generation_prompt(query, retrieved_chunks, top_k_context)
+        if prompt is None:
+            return self.NO_CONTEXT_ANSWER
 
-        # 3. Create the prompt
-        prompt = f"""
-        You are a helpful assistant. Please answer the following query based *only* on the provided context.
-        If the answer cannot be found in the context, state that you cannot answer the question with the information given.
+        # 4. Generate the response
+        if self.verbose:
+            print(f"Generating response for query: '{query[:50]}...'")
+        try:
+            response = self.generator_client.generate_content(prompt)
+            return response.text
+        except Exception as e:
+            return f"Error generating response from Gemini: {e}"
 
-        QUERY:
-        {query}
+    async def agenerate(
+        self,
+        query: str,
+        retrieved_chunks: List[Dict[str, Any]],
+        top_k_context: int = 5
+    ) -> str:
+        """
+        Async version of generate(); awaits Gemini instead of blocking a thread.
 
-        CONTEXT:
-        {context_string}
+        Args:
+            query: The original user query
+            retrieved_chunks: A list of dictionaries, assumed to be pre-sorted
+            top_k_context: The number of top chunks to use as context
 
-        ANSWER:
+        Returns:
+            A string containing the generated answer
         """
+        if not self.generator_client:
+            return self.NO_GENERATOR_ANSWER
+
+        prompt = self._build_generation_prompt(query, retrieved_chunks, top_k_context)
+        if prompt is None:
+            return self.NO_CONTEXT_ANSWER
 
-        # 4. Generate the response
         if self.verbose:
             print(f"Generating response for query: '{query[:50]}...'")
         try:
-            response = self.generator_client.generate_content(prompt)
+            response = await self.generator_client.generate_content_async(prompt)
             return response.text
         except Exception as e:
             return f"Error generating response from Gemini: {e}"
 
+    async def agenerate_stream(
+        self,
+        query: str,
+        retrieved_chunks: List[Dict[str, Any]],
+        top_k_context: int = 5
+    ) -> AsyncIterator[str]:
+        """
+        Stream the Gemini answer as text pieces, as soon as they are generated.
+
+        Args:
+            query: The original user query
+            retrieved_chunks: A list of dictionaries, assumed to be pre-sorted
+            top_k_context: The number of top chunks to use as context
+
+        Yields:
+            Pieces of the answer text; joined, they equal what generate() returns
+        """
+        if not self.generator_client:
+            yield self.NO_GENERATOR_ANSWER
+            return
+
+        prompt = self._build_generation_prompt(query, retrieved_chunks, top_k_context)
+        if prompt is None:
+            yield self.NO_CONTEXT_ANSWER
+            return
+
+        if self.verbose:
+            print(f"Streaming response for query: '{query[:50]}...'")
+        try:
+            response = await self.generator_client.generate_content_async(prompt, stream=True)
+            async for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue  # e.g. a chunk carrying only safety/finish metadata
+                if text:
+                    yield text
+        except Exception as e:
+            yield f"Error generating response from Gemini: {e}"
+
     # --------------------------------------------------------------------------
     # 6. INDEX PERSISTENCE
     # --------------------------------------------------------------------------
 
-    def save_index(self, dir_path: str) -> None:
+    def save_index(self, dir_path: str, incremental: bool = False) -> None:
         """
         Save FAISS index, metadata, and embeddings to disk.
+
+        With incremental=True, changes made since the last load/save are
+        appended as a small delta file under `deltas/` instead of rewriting the
+        whole index. A full rewrite still happens when there is no base on disk,
+        after index_documents(), or once MAX_DELTAS deltas have piled up.
         
         Args:
             dir_path: Directory path where index files will be saved
+            incremental: If True, append a delta instead of rewriting everything
         """
-        if not hasattr(self, "faiss_index") or self.faiss_index is None:
+        if self.faiss_index is None:
             raise ValueError("No FAISS index to save. Did you call index_documents()?")
 
         os.makedirs(dir_path, exist_ok=True)
+        deltas_dir = os.path.join(dir_path, self.DELTAS_DIR)
+        base_exists = os.path.exists(os.path.join(dir_path, "faiss.index"))
+
+        if incremental and base_exists and not self._needs_full_save:
+            if not self._pending_upserts and not self._pending_removals:
+                return
+            if len(self._list_delta_files(deltas_dir)) < self.MAX_DELTAS:
+                seq = self._save_delta(deltas_dir)
+                # The document index is small; rewrite it so it matches the new delta
+                self._save_document_index(dir_path, delta_seq=seq)
+                self._reset_pending_delta()
+                return
+            if self.verbose:
+                print(f"{self.MAX_DELTAS} deltas reached; compacting index at {dir_path}.")
+
+        # Every file is written to a temp path and renamed into place, so readers that
+        # memory-mapped the previous version keep a valid (old) file.
+        with self._index_lock:
+            self._wait_for_searches()
+            self._materialize_overlay()
+
+        # 1. save faiss index (in the type chosen for its size) and how it was built
+        self.ensure_index_type()
+        self._write_atomic(os.path.join(dir_path, "faiss.index"), lambda f: faiss.write_index(self.faiss_index, f))
+        index_config = {
+            "index_type": self.built_index_type,
+            "requested_index_type": self.index_type,
+            "params": self.index_params,
+            "dimension": int(self.faiss_index.d),
+            "ntotal": int(self.faiss_index.ntotal),
+            "embedding_quantization": self.embedding_quantization,
+        }
+        self._write_atomic(
+            os.path.join(dir_path, "index_config.json"),
+            lambda f: self._write_json(f, index_config, indent=2)
+        )
+
+        # 2. save chunk texts + metadata, then serve reads from the new file
+        chunks_path = os.path.join(dir_path, CHUNKS_FILE)
+        self._write_atomic(chunks_path, lambda f: ChunkStore.write(f, self.chunks_metadata.records()))
+        self.chunks_metadata = ChunkStore.open(chunks_path)
+        legacy_meta_path = os.path.join(dir_path, LEGACY_METADATA_FILE)
+        if os.path.exists(legacy_meta_path):
+            os.remove(legacy_meta_path)
+
+        # 2b. save the BM25 keyword index (built now for indexes loaded without one)
+        bm25_path = os.path.join(dir_path, BM25_FILE)
+        if self.bm25_index is None:
+            self.bm25_index = BM25Index.from_records(self.chunks_metadata.records())
+        self._write_atomic(bm25_path, self.bm25_index.write)
+        self.bm25_index = BM25Index.load(bm25_path)
+
+        # 2c. save the metadata index used by row filters
+        if self.metadata_index is None:
+            self.metadata_index = MetadataIndex.from_records(self.chunks_metadata.records())
+        self._write_atomic(os.path.join(dir_path, METADATA_INDEX_FILE), self.metadata_index.write)
+
+        # 3. save embeddings as stored (+ int8 scales, + the chunk id of each row)
+        if self.document_embeddings is not None:
+            self._write_atomic(os.path.join(dir_path, "embeddings.npy"), lambda f: np.save(f, self.document_embeddings))
+        scales_path = os.path.join(dir_path, "embedding_scales.npy")
+        if self.embedding_scales is not None:
+            self._write_atomic(scales_path, lambda f: np.save(f, self.embedding_scales))
+        elif os.path.exists(scales_path):
+            os.remove(scales_path)
+        self._write_atomic(os.path.join(dir_path, "chunk_ids.npy"), lambda f: np.save(f, self.chunk_ids))
+
+        # 3b. save the document index of hierarchical retrieval
+        self._save_document_index(dir_path)
+
+        # 4. the new base already contains every delta
+        if os.path.isdir(deltas_dir):
+            shutil.rmtree(deltas_dir)
+        self._reset_pending_delta()
+
+    def _save_document_index(self, dir_path: str, delta_seq: int = 0) -> None:
+        """
+        Write the document index of hierarchical retrieval (rebuilt first if records
+        changed), tagged with the last delta it includes so load_index can tell
+        whether it is current after replaying the deltas.
+        """
+        documents_path = os.path.join(dir_path, self.DOCUMENTS_FILE)
+        with self._index_lock:
+            if self.document_vectors is not None and self._documents_stale:
+                self.build_document_index(self.document_field)
+            field, keys, vectors = self.document_field, self.document_keys, self.document_vectors
+        if vectors is not None:
+            self._write_atomic(documents_path, lambda f: np.savez(
+                f,
+                field=np.array(field),
+                keys=np.array(keys, dtype=str),
+                vectors=vectors,
+                delta_seq=np.array(delta_seq, dtype=np.int64)
+            ))
+        elif os.path.exists(documents_path):
+            os.remove(documents_path)
 
-        # 1. save faiss index
-        faiss.write_index(self.faiss_index, os.path.join(dir_path, "faiss.index"))
+    @staticmethod
+    def _write_atomic(path: str, write) -> None:
+        """Call write(tmp_path) and atomically rename the result to path."""
+        root, ext = os.path.splitext(path)
+        # Unique per process; keep the extension since np.save appends .npy otherwise
+        tmp_path = f"{root}.{os.getpid()}.tmp{ext}"
+        write(tmp_path)
+        os.replace(tmp_path, path)
 
-        # 2. save metadata
-        with open(os.path.join(dir_path, "metadata.json"), "w", encoding="utf-8") as f:
-            json.dump(self.chunks_metadata, f, ensure_ascii=False, indent=2)
+    @staticmethod
+    def _write_json(path: str, data: Any, **kwargs) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, **kwargs)
 
-        # 3. save embeddings
-        if self.document_embeddings is not None:
-            np.save(os.path.join(dir_path, "embeddings.npy"), self.document_embeddings)
+    @staticmethod
+    def _list_delta_files(deltas_dir: str) -> List[str]:
+        """Delta files in the order they must be replayed."""
+        if not os.path.isdir(deltas_dir):
+            return []
+        return sorted(
+            os.path.join(deltas_dir, name)
+            for name in os.listdir(deltas_dir)
+            if name.startswith("delta_") and name.endswith(".npz")
+        )
+
+    @staticmethod
+    def _delta_seq(delta_path: str) -> int:
+        """Sequence number of a delta file (delta_000001.npz -> 1)."""
+        return int(os.path.basename(delta_path)[6:-4])
+
+    def _save_delta(self, deltas_dir: str) -> int:
+        """Write pending upserts/removals as the next delta file (atomic rename) and return its sequence number."""
+        os.makedirs(deltas_dir, exist_ok=True)
+        existing = self._list_delta_files(deltas_dir)
+        seq = self._delta_seq(existing[-1]) + 1 if existing else 1
+
+        upsert_ids = np.asarray(sorted(self._pending_upserts), dtype=np.int64)
+        rows = {chunk_id: row for row, chunk_id in enumerate(self.chunk_ids.tolist())}
+        upsert_embeddings = self._embedding_rows([rows[i] for i in upsert_ids.tolist()])
+        upsert_metadata = [self.chunks_metadata[i] for i in upsert_ids.tolist()]
+
+        final_path = os.path.join(deltas_dir, f"delta_{seq:06d}.npz")
+        tmp_path = final_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                upsert_ids=upsert_ids,
+                upsert_embeddings=upsert_embeddings,
+                upsert_metadata=np.array(json.dumps(upsert_metadata, ensure_ascii=False)),
+                removed_ids=np.asarray(sorted(self._pending_removals), dtype=np.int64),
+            )
+        os.replace(tmp_path, final_path)
+
+        if self.verbose:
+            print(f"Saved delta {final_path}: {len(upsert_ids)} upserts, {len(self._pending_removals)} removals.")
+        return seq
+
+    def _apply_delta(self, delta_path: str) -> None:
+        """Replay one delta file on top of the loaded index (no embedding calls)."""
+        with np.load(delta_path) as delta:
+            removed_ids = delta["removed_ids"].tolist()
+            upsert_ids = delta["upsert_ids"]
+            upsert_embeddings = delta["upsert_embeddings"]
+            upsert_metadata = json.loads(str(delta["upsert_metadata"]))
+
+        # An upsert replaces any previous version of the chunk
+        self.remove_documents(removed_ids + upsert_ids.tolist())
+        if len(upsert_ids):
+            self._add_vectors(
+                upsert_ids,
+                upsert_embeddings,
+                {int(meta["id"]): meta for meta in upsert_metadata}
+            )
+
+    def _overlay_deltas(self, delta_paths: List[str]) -> None:
+        """
+        Replay delta files over a memory-mapped base without copying it.
+
+        Upserted rows are appended behind the mapped arrays (StackedRows) and
+        scored exactly at search time; base rows that were removed or replaced
+        are hidden from base index searches by id. The first write folds the
+        overlay into owned arrays (_materialize_overlay).
+        """
+        upserts: Dict[int, Tuple[np.ndarray, Dict[str, Any]]] = {}
+        touched: Set[int] = set()
+        for delta_path in delta_paths:
+            with np.load(delta_path) as delta:
+                removed_ids = delta["removed_ids"].tolist()
+                upsert_ids = delta["upsert_ids"].tolist()
+                upsert_embeddings = delta["upsert_embeddings"]
+                upsert_metadata = json.loads(str(delta["upsert_metadata"]))
+            # An upsert replaces any previous version of the chunk
+            for chunk_id in removed_ids + upsert_ids:
+                upserts.pop(chunk_id, None)
+                touched.add(chunk_id)
+            for chunk_id, vector, meta in zip(upsert_ids, upsert_embeddings, upsert_metadata):
+                upserts[chunk_id] = (vector, meta)
+
+        overlay_ids = np.asarray(list(upserts), dtype=np.int64)
+        metadata = {chunk_id: meta for chunk_id, (_, meta) in upserts.items()}
+        vectors = np.zeros((0, self.document_embeddings.shape[1]), dtype=np.float32)
+        if upserts:
+            vectors = np.ascontiguousarray(np.stack([vector for vector, _ in upserts.values()]), dtype=np.float32)
+            faiss.normalize_L2(vectors)
+        stored, scales = quantize_vectors(vectors, self.embedding_quantization)
+
+        with self._index_lock:
+            removed = [chunk_id for chunk_id in touched if chunk_id in self.chunks_metadata]
+            if self.bm25_index is not None:
+                self.bm25_index.remove(removed)
+            if self.metadata_index is not None:
+                self.metadata_index.remove(removed)
+            for chunk_id in removed:
+                self.chunks_metadata.pop(chunk_id, None)
+            self.chunks_metadata.update(metadata)
+            if self.bm25_index is not None:
+                self.bm25_index.add(overlay_ids.tolist(), [metadata[i]["text"] for i in overlay_ids.tolist()])
+            if self.metadata_index is not None:
+                self.metadata_index.add(overlay_ids.tolist(), [metadata[i] for i in overlay_ids.tolist()])
+
+            masked_ids = np.asarray(sorted(touched), dtype=np.int64)
+            base_ids = np.asarray(self.chunk_ids)
+            self.chunk_ids = np.concatenate([np.where(np.isin(base_ids, masked_ids), -1, base_ids), overlay_ids])
+            self.document_embeddings = StackedRows(self.document_embeddings, stored)
+            if self.embedding_scales is not None:
+                self.embedding_scales = StackedRows(self.embedding_scales, scales)
+            self._masked_ids, self._overlay_ids, self._overlay_vectors = masked_ids, overlay_ids, vectors
+            self._mark_index_changed()
+
+    def _materialize_overlay(self) -> None:
+        """Fold a delta overlay into owned arrays and index before a write. Caller holds _index_lock."""
+        if self._masked_ids is None:
+            return
+        live = self.chunk_ids >= 0
+        self.document_embeddings = np.asarray(self.document_embeddings)[live]
+        if self.embedding_scales is not None:
+            self.embedding_scales = np.asarray(self.embedding_scales)[live]
+        self.chunk_ids = self.chunk_ids[live]
+        masked_ids, overlay_ids, overlay_vectors = self._masked_ids, self._overlay_ids, self._overlay_vectors
+        self._masked_ids = self._overlay_ids = self._overlay_vectors = None
+
+        if not isinstance(self.faiss_index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+            self._ensure_id_mapped()  # built from the materialized rows, overlay included
+            self._index_mapped = False
+        elif self.built_index_type in REMOVABLE_INDEX_TYPES:
+            index = copy_index(self.faiss_index)
+            index.remove_ids(faiss.IDSelectorBatch(masked_ids))
+            index.add_with_ids(overlay_vectors, overlay_ids)
+            self._set_index(index, self.built_index_type, self.index_params)
+        else:
+            # HNSW graphs cannot drop nodes: exact search until the approximate index is rebuilt
+            params = self._index_params_for("flat")
+            self._set_index(build_index("flat", self._embedding_rows(), self.chunk_ids, params), "flat", params)
+        self._mark_index_changed()
 
-    def load_index(self, dir_path: str) -> None:
+    def load_index(self, dir_path: str, mmap: Optional[bool] = None) -> None:
         """
-        Load FAISS index, metadata, and embeddings from disk.
+        Load FAISS index, metadata, and embeddings from disk, then replay deltas.
+
+        In mmap mode the faiss vectors and embeddings.npy are memory-mapped
+        rather than copied, so loading takes milliseconds and processes serving
+        the same index share the OS page cache; deltas are then replayed as an
+        overlay on top of the mapped files instead of copying them. Chunk texts
+        and metadata are read from chunks.sqlite on demand, never parsed up
+        front; an index saved with a legacy metadata.json is converted on first load.
         
         Args:
             dir_path: Directory path where index files are stored
+            mmap: Memory-map the index files (defaults to self.mmap_index)
         """
         index_path = os.path.join(dir_path, "faiss.index")
-        meta_path = os.path.join(dir_path, "metadata.json")
+        chunks_path = os.path.join(dir_path, CHUNKS_FILE)
+        legacy_meta_path = os.path.join(dir_path, LEGACY_METADATA_FILE)
         emb_path = os.path.join(dir_path, "embeddings.npy")
+        ids_path = os.path.join(dir_path, "chunk_ids.npy")
+        config_path = os.path.join(dir_path, "index_config.json")
 
         if not os.path.exists(index_path):
             raise FileNotFoundError(f"FAISS index not found at {index_path}")
+        mmap = self.mmap_index if mmap is None else mmap
+        mmap_mode = "r" if mmap else None
+
+        self.wait_for_index_build()
+        index_config = {}
+        if os.path.exists(config_path):
+            with open(config_path, "r", encoding="utf-8") as f:
+                index_config = json.load(f)
+        # An explicitly requested type travels with the index
+        if self.index_type == "auto" and index_config.get("requested_index_type", "auto") != "auto":
+            self.index_type = index_config["requested_index_type"]
+        # So does the storage precision, since new rows are appended to the stored arrays
+        self.embedding_quantization = index_config.get("embedding_quantization", "none")
+
+        built_type = index_config.get("index_type", "flat")
+        with self._index_lock:
+            self._set_index(
+                read_index(index_path, built_type, mmap=mmap),
+                built_type,
+                index_config.get("params", {}),
+                mapped=is_mapped(built_type, mmap)
+            )
+            self._masked_ids = self._overlay_ids = self._overlay_vectors = None
+            self._mark_index_changed()
 
-        self.faiss_index = faiss.read_index(index_path)
+        if not os.path.exists(chunks_path) and os.path.exists(legacy_meta_path):
+            if self.verbose:
+                print(f"Converting {legacy_meta_path} to {CHUNKS_FILE}...")
+            self._write_atomic(chunks_path, lambda f: convert_metadata_json(legacy_meta_path, f))
+        # The open store keeps reading this version even if a save replaces the file
+        self.chunks_metadata = ChunkStore.open(chunks_path) if os.path.exists(chunks_path) else ChunkStore()
+
+        bm25_path = os.path.join(dir_path, BM25_FILE)
+        if os.path.exists(bm25_path):
+            self.bm25_index = BM25Index.load(bm25_path)
+        else:
+            # Saved before hybrid search: dense-only until the next full save builds one
+            self.bm25_index = None
+            if self.verbose:
+                print(f"No {BM25_FILE} in {dir_path}; hybrid search disabled for this index.")
 
-        if os.path.exists(meta_path):
-            with open(meta_path, "r", encoding="utf-8") as f:
-                self.chunks_metadata = json.load(f)
+        metadata_index_path = os.path.join(dir_path, METADATA_INDEX_FILE)
+        if os.path.exists(metadata_index_path):
+            self.metadata_index = MetadataIndex.load(metadata_index_path)
         else:
-            self.chunks_metadata = []
+            # Saved before row filters: searches are unfiltered until the next full save
+            self.metadata_index = None
 
+        scales_path = os.path.join(dir_path, "embedding_scales.npy")
         if os.path.exists(emb_path):
-            self.document_embeddings = np.load(emb_path)
+            self.document_embeddings = np.load(emb_path, mmap_mode=mmap_mode)
         else:
             self.document_embeddings = None
+        self.embedding_scales = np.load(scales_path, mmap_mode=mmap_mode) if os.path.exists(scales_path) else None
+
+        if os.path.exists(ids_path):
+            self.chunk_ids = np.load(ids_path, mmap_mode=mmap_mode).astype(np.int64, copy=False)
+        else:
+            # Indexes saved before stable ids: row i holds the chunk with id i
+            self.chunk_ids = np.asarray(list(self.chunks_metadata.keys()), dtype=np.int64)
+
+        documents_path = os.path.join(dir_path, self.DOCUMENTS_FILE)
+        documents_seq = 0
+        if os.path.exists(documents_path):
+            with np.load(documents_path) as documents:
+                self.document_field = str(documents["field"])
+                self.document_keys = documents["keys"].tolist()
+                self.document_vectors = documents["vectors"]
+                if "delta_seq" in documents.files:
+                    documents_seq = int(documents["delta_seq"])
+        else:
+            self.document_field, self.document_keys, self.document_vectors = None, [], None
+        self._document_rows = None
+        self._documents_stale = False
+
+        self._reset_pending_delta()
+        deltas = self._list_delta_files(os.path.join(dir_path, self.DELTAS_DIR))
+        if deltas and mmap and self.document_embeddings is not None:
+            # Keep the mapped base zero-copy; the first write materializes it
+            self._overlay_deltas(deltas)
+        else:
+            for delta_path in deltas:
+                self._apply_delta(delta_path)
+        # Replayed deltas are already on disk
+        self._reset_pending_delta()
+        # Documents saved with the last delta already include every replayed change
+        if self.document_vectors is not None:
+            self._documents_stale = documents_seq != (self._delta_seq(deltas[-1]) if deltas else 0)
+
+        if self.verbose and deltas:
+            print(f"Replayed {len(deltas)} index deltas from {dir_path}.")
+
+        # e.g. a legacy flat index that has outgrown exact search
+        self.schedule_index_build()
 
     # --------------------------------------------------------------------------
     # 7. FULL PIPELINE
     # --------------------------------------------------------------------------
 
+    def _needs_deeper_search(self, results: List[Dict[str, Any]], top_k: int) -> bool:
+        """Whether the candidate list was cut off in the middle of a plateau of similar scores."""
+        if len(results) < top_k or top_k >= self.ADAPTIVE_MAX_TOP_K:
+            return False
+        scores = [r["similarity_score"] for r in results]
+        return min(scores) >= max(scores) - self.ADAPTIVE_SCORE_WINDOW
+
+    def _retrieve_adaptively(
+        self,
+        query: str,
+        top_k: int,
+        adaptive: bool,
+        debug_json_path: Optional[str] = None,
+        row_filters: Any = None,
+        allowed_ids: Optional[np.ndarray] = None
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """retrieve(), widened while the scores have not dropped off; returns (results, plan)."""
+        # The filter is resolved once, not on every widening step
+        if allowed_ids is None:
+            allowed_ids = self.filter_ids(row_filters)
+        results = self.retrieve(query, top_k=top_k, debug_json_path=debug_json_path, allowed_ids=allowed_ids)
+        plan = {"adaptive": adaptive, "retrieve_top_k": top_k, "expanded": False}
+        while adaptive and self._needs_deeper_search(results, plan["retrieve_top_k"]):
+            # The query embedding is cached, so a deeper search costs no API call
+            plan["retrieve_top_k"] = min(2 * plan["retrieve_top_k"], self.ADAPTIVE_MAX_TOP_K)
+            plan["expanded"] = True
+            results = self.retrieve(
+                query, top_k=plan["retrieve_top_k"], debug_json_path=debug_json_path, allowed_ids=allowed_ids
+            )
+        return results, plan
+
+    async def _aretrieve_adaptively(
+        self,
+        query: str,
+        top_k: int,
+        adaptive: bool,
+        debug_json_path: Optional[str] = None,
+        row_filters: Any = None,
+        allowed_ids: Optional[np.ndarray] = None
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Async version of _retrieve_adaptively()."""
+        if allowed_ids is None and row_filters is not None:
+            allowed_ids = await asyncio.to_thread(self.filter_ids, row_filters)
+        results = await self.aretrieve(query, top_k=top_k, debug_json_path=debug_json_path, allowed_ids=allowed_ids)
+        plan = {"adaptive": adaptive, "retrieve_top_k": top_k, "expanded": False}
+        while adaptive and self._needs_deeper_search(results, plan["retrieve_top_k"]):
+            plan["retrieve_top_k"] = min(2 * plan["retrieve_top_k"], self.ADAPTIVE_MAX_TOP_K)
+            plan["expanded"] = True
+            results = await self.aretrieve(
+                query, top_k=plan["retrieve_top_k"], debug_json_path=debug_json_path, allowed_ids=allowed_ids
+            )
+        return results, plan
+
+    def _plan_rerank(
+        self,
+        results: List[Dict[str, Any]],
+        rerank_top_k: int,
+        plan: Dict[str, Any],
+        diversify: bool = False
+    ) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        Pick the candidates worth reranking and decide whether reranking can change the answer.
+
+        Records the decision in plan ('candidates', 'top_margin', 'diversified', 'reranked').
+
+        Returns:
+            (candidates, skip_rerank)
+        """
+        candidates, skip, margin = results, False, None
+        if plan["adaptive"] and results:
+            scores = sorted((r["similarity_score"] for r in results), reverse=True)
+            floor = scores[0] - self.ADAPTIVE_SCORE_WINDOW
+            # Keep the first rerank_top_k in retrieval order, plus anything close to the best score
+            candidates = [r for i, r in enumerate(results) if i < rerank_top_k or r["similarity_score"] >= floor]
+            margin = scores[0] - scores[1] if len(scores) > 1 else None
+            skip = margin is None or margin >= self.RERANK_SKIP_MARGIN
+
+        diversified = diversify and len(candidates) > self.MMR_CANDIDATE_FACTOR * rerank_top_k
+        if diversified:
+            candidates = self.diversify(candidates, top_k=self.MMR_CANDIDATE_FACTOR * rerank_top_k)
+
+        plan.update(
+            candidates=len(candidates),
+            top_margin=round(margin, 4) if margin is not None else None,
+            diversified=diversified,
+            reranked=bool(candidates) and not skip
+        )
+        if self.verbose and (plan["adaptive"] or diversify):
+            print(f"Retrieval plan: {plan}")
+        return candidates, skip
+
     def run_pipeline(
         self,
         query: str,
@@ -699,7 +2731,11 @@ class RAGSystem:
         rerank_top_k: int = 5,
         generate_context_top_k: int = 5,
         skip_generation: bool = False,
-        debug_json_path: Optional[str] = None
+        debug_json_path: Optional[str] = None,
+        row_filters: Any = None,
+        adaptive: Optional[bool] = None,
+        diversify: Optional[bool] = None,
+        allowed_ids: Optional[np.ndarray] = None
     ) -> Dict[str, Any]:
         """
         Run the full RAG pipeline: Retrieve -> Rerank -> Generate.
@@ -711,10 +2747,19 @@ class RAGSystem:
             generate_context_top_k: The number of reranked documents to pass to the generator
             skip_generation: If True, skip the generation step
             debug_json_path: Path to save the raw retrieval (step 1) results
+            row_filters: Optional metadata filter restricting retrieval (see filter_ids)
+            adaptive: Size retrieval from the scores and skip decisive reranks
+                (defaults to self.adaptive_retrieval)
+            diversify: Drop near-duplicate candidates with MMR before reranking
+                (defaults to self.mmr_diversification)
+            allowed_ids: Ids already resolved from row_filters by filter_ids()
 
         Returns:
-            A dictionary containing the query, final answer, and intermediate results
+            A dictionary containing the query, final answer, intermediate results
+            and the 'retrieval_plan' that was followed
         """
+        adaptive = self.adaptive_retrieval if adaptive is None else adaptive
+        diversify = self.mmr_diversification if diversify is None else diversify
         if self.verbose:
             print(f"\n{'='*60}\nRunning RAG pipeline for query: '{query}'\n{'='*60}")
 
@@ -722,16 +2767,16 @@ class RAGSystem:
         if self.verbose:
             print(f"\n--- Step 1: Retrieving (Top {retrieve_top_k}) ---")
         try:
-            retrieved_results = self.retrieve(
-                query,
-                top_k=retrieve_top_k,
-                debug_json_path=debug_json_path
+            retrieved_results, plan = self._retrieve_adaptively(
+                query, retrieve_top_k, adaptive, debug_json_path=debug_json_path,
+                row_filters=row_filters, allowed_ids=allowed_ids
             )
         except Exception as e:
             if self.verbose:
                 print(f"Error during retrieval: {e}")
             return {"query": query, "error": str(e)}
 
+        candidates, skip_rerank = self._plan_rerank(retrieved_results, rerank_top_k, plan, diversify)
         if not retrieved_results:
             if self.verbose:
                 print("No results found during retrieval. Pipeline stopped.")
@@ -739,17 +2784,23 @@ class RAGSystem:
                 "query": query,
                 "answer": "Sorry, I could not find any relevant information to answer your query.",
                 "retrieved_results": [],
-                "reranked_results": []
+                "reranked_results": [],
+                "retrieval_plan": plan
             }
 
         # --- 2. RERANK ---
-        if self.verbose:
-            print(f"\n--- Step 2: Reranking (Top {rerank_top_k}) ---")
-        reranked_results = self.rerank(
-            query,
-            retrieved_results,
-            top_k=rerank_top_k
-        )
+        if skip_rerank:
+            if self.verbose:
+                print("\n--- Step 2: Reranking skipped (decisive top result) ---")
+            reranked_results = candidates[:rerank_top_k]
+        else:
+            if self.verbose:
+                print(f"\n--- Step 2: Reranking (Top {rerank_top_k}) ---")
+            reranked_results = self.rerank(
+                query,
+                candidates,
+                top_k=rerank_top_k
+            )
 
         # --- 3. GENERATE ---
         if skip_generation:
@@ -774,4 +2825,255 @@ class RAGSystem:
             "answer": final_answer,
             "reranked_results": reranked_results,
             "retrieved_results": retrieved_results,  # Original, pre-reranked results
+            "retrieval_plan": plan,
+        }
+
+    async def arun_pipeline(
+        self,
+        query: str,
+        retrieve_top_k: int = 20,
+        rerank_top_k: int = 5,
+        generate_context_top_k: int = 5,
+        skip_generation: bool = False,
+        debug_json_path: Optional[str] = None,
+        row_filters: Any = None,
+        adaptive: Optional[bool] = None,
+        diversify: Optional[bool] = None,
+        allowed_ids: Optional[np.ndarray] = None
+    ) -> Dict[str, Any]:
+        """
+        Async version of run_pipeline(): Retrieve -> Rerank -> Generate.
+
+        Every network call (query embedding, reranker, Gemini) is awaited on the
+        caller's event loop; only the CPU-bound index search and MMR step run in
+        worker threads.
+
+        Args:
+            query: The user's query
+            retrieve_top_k: How many documents to fetch in the initial retrieval
+            rerank_top_k: The number of documents to keep after reranking
+            generate_context_top_k: The number of reranked documents to pass to the generator
+            skip_generation: If True, skip the generation step
+            debug_json_path: Path to save the raw retrieval (step 1) results
+            row_filters: Optional metadata filter restricting retrieval (see filter_ids)
+            adaptive: Size retrieval from the scores and skip decisive reranks
+                (defaults to self.adaptive_retrieval)
+            diversify: Drop near-duplicate candidates with MMR before reranking
+                (defaults to self.mmr_diversification)
+            allowed_ids: Ids already resolved from row_filters by filter_ids()
+
+        Returns:
+            A dictionary containing the query, final answer, intermediate results
+            and the 'retrieval_plan' that was followed
+        """
+        adaptive = self.adaptive_retrieval if adaptive is None else adaptive
+        diversify = self.mmr_diversification if diversify is None else diversify
+        if self.verbose:
+            print(f"\n{'='*60}\nRunning async RAG pipeline for query: '{query}'\n{'='*60}")
+
+        # --- 1. RETRIEVE ---
+        try:
+            retrieved_results, plan = await self._aretrieve_adaptively(
+                query, retrieve_top_k, adaptive, debug_json_path=debug_json_path,
+                row_filters=row_filters, allowed_ids=allowed_ids
+            )
+        except Exception as e:
+            if self.verbose:
+                print(f"Error during retrieval: {e}")
+            return {"query": query, "error": str(e)}
+
+        # MMR reads the candidates' embeddings, so it runs in a thread too
+        candidates, skip_rerank = await asyncio.to_thread(
+            self._plan_rerank, retrieved_results, rerank_top_k, plan, diversify
+        )
+        if not retrieved_results:
+            return {
+                "query": query,
+                "answer": "Sorry, I could not find any relevant information to answer your query.",
+                "retrieved_results": [],
+                "reranked_results": [],
+                "retrieval_plan": plan
+            }
+
+        # --- 2. RERANK ---
+        if skip_rerank:
+            reranked_results = candidates[:rerank_top_k]
+        else:
+            reranked_results = await self.arerank(query, candidates, top_k=rerank_top_k)
+
+        # --- 3. GENERATE ---
+        if skip_generation:
+            final_answer = "Generation step was skipped."
+        else:
+            final_answer = await self.agenerate(
+                query,
+                reranked_results,
+                top_k_context=generate_context_top_k
+            )
+
+        # --- 4. RETURN ---
+        return {
+            "query": query,
+            "answer": final_answer,
+            "reranked_results": reranked_results,
+            "retrieved_results": retrieved_results,
+            "retrieval_plan": plan,
+        }
+
+    async def astream_pipeline(
+        self,
+        query: str,
+        retrieve_top_k: int = 20,
+        rerank_top_k: int = 5,
+        generate_context_top_k: int = 5,
+        row_filters: Any = None,
+        adaptive: Optional[bool] = None,
+        diversify: Optional[bool] = None,
+        allowed_ids: Optional[np.ndarray] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Run the RAG pipeline, streaming its output as events.
+
+        Sources are known before generation starts, so they are sent first and
+        the answer follows token by token.
+
+        Args:
+            query: The user's query
+            retrieve_top_k: How many documents to fetch in the initial retrieval
+            rerank_top_k: The number of documents to keep after reranking
+            generate_context_top_k: The number of reranked documents to pass to the generator
+            row_filters: Optional metadata filter restricting retrieval (see filter_ids)
+            adaptive: Size retrieval from the scores and skip decisive reranks
+                (defaults to self.adaptive_retrieval)
+            diversify: Drop near-duplicate candidates with MMR before reranking
+                (defaults to self.mmr_diversification)
+            allowed_ids: Ids already resolved from row_filters by filter_ids()
+
+        Yields:
+            {"event": "sources", "query", "retrieved_results", "reranked_results", "retrieval_plan"},
+            then {"event": "token", "text"} per answer piece, then
+            {"event": "done", ...} with the same keys run_pipeline() returns
+            (or {"event": "error", "query", "error"} if retrieval fails)
+        """
+        adaptive = self.adaptive_retrieval if adaptive is None else adaptive
+        diversify = self.mmr_diversification if diversify is None else diversify
+
+        # --- 1. RETRIEVE ---
+        try:
+            retrieved_results, plan = await self._aretrieve_adaptively(
+                query, retrieve_top_k, adaptive, row_filters=row_filters, allowed_ids=allowed_ids
+            )
+        except Exception as e:
+            if self.verbose:
+                print(f"Error during retrieval: {e}")
+            yield {"event": "error", "query": query, "error": str(e)}
+            return
+
+        candidates, skip_rerank = await asyncio.to_thread(
+            self._plan_rerank, retrieved_results, rerank_top_k, plan, diversify
+        )
+        if not retrieved_results:
+            answer = "Sorry, I could not find any relevant information to answer your query."
+            empty = {"query": query, "retrieved_results": [], "reranked_results": [], "retrieval_plan": plan}
+            yield {"event": "sources", **empty}
+            yield {"event": "token", "text": answer}
+            yield {"event": "done", "answer": answer, **empty}
+            return
+
+        # --- 2. RERANK ---
+        if skip_rerank:
+            reranked_results = candidates[:rerank_top_k]
+        else:
+            reranked_results = await self.arerank(query, candidates, top_k=rerank_top_k)
+        yield {
+            "event": "sources",
+            "query": query,
+            "retrieved_results": retrieved_results,
+            "reranked_results": reranked_results,
+            "retrieval_plan": plan,
+        }
+
+        # --- 3. GENERATE ---
+        answer_parts: List[str] = []
+        async for text in self.agenerate_stream(query, reranked_results, top_k_context=generate_context_top_k):
+            answer_parts.append(text)
+            yield {"event": "token", "text": text}
+
+        # --- 4. RETURN ---
+        yield {
+            "event": "done",
+            "query": query,
+            "answer": "".join(answer_parts),
+            "reranked_results": reranked_results,
+            "retrieved_results": retrieved_results,
+            "retrieval_plan": plan,
+        }
+
+    def run_facet_pipeline(
+        self,
+        query: str,
+        facet: str,
+        values: List[str],
+        retrieve_top_k: int = 20,
+        rerank_top_k: int = 5
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Retrieve -> Rerank for several facet groups at once (no generation).
+
+        The query is embedded once, the groups are searched together and all
+        candidates go to the reranker in one call; the results are split back
+        per group.
+
+        Args:
+            query: The user's query
+            facet: Chunk metadata field the groups are keyed by (e.g. "column_name")
+            values: Facet values to answer for
+            retrieve_top_k: How many documents to fetch per group
+            rerank_top_k: The number of documents to keep per group after reranking
+
+        Returns:
+            Dict of value -> {"query", "retrieved_results", "reranked_results"}
+            (or {"query", "error"} for every value if retrieval fails)
+        """
+        try:
+            retrieved = self.retrieve_facets(query, facet, values, top_k=retrieve_top_k)
+        except Exception as e:
+            if self.verbose:
+                print(f"Error during retrieval: {e}")
+            return {value: {"query": query, "error": str(e)} for value in values}
+
+        reranked = self.rerank_groups(query, retrieved, top_k=rerank_top_k)
+        return {
+            value: {
+                "query": query,
+                "retrieved_results": retrieved[value],
+                "reranked_results": reranked[value],
+            }
+            for value in values
+        }
+
+    async def arun_facet_pipeline(
+        self,
+        query: str,
+        facet: str,
+        values: List[str],
+        retrieve_top_k: int = 20,
+        rerank_top_k: int = 5
+    ) -> Dict[str, Dict[str, Any]]:
+        """Async version of run_facet_pipeline(): one embed, one search pass, one rerank call."""
+        try:
+            retrieved = await self.aretrieve_facets(query, facet, values, top_k=retrieve_top_k)
+        except Exception as e:
+            if self.verbose:
+                print(f"Error during retrieval: {e}")
+            return {value: {"query": query, "error": str(e)} for value in values}
+
+        reranked = await self.arerank_groups(query, retrieved, top_k=rerank_top_k)
+        return {
+            value: {
+                "query": query,
+                "retrieved_results": retrieved[value],
+                "reranked_results": reranked[value],
+            }
+            for value in values
         }
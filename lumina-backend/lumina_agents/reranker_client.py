@@ -0,0 +1,298 @@
+"""
+Async reranker client for the RAG system.
+
+Reranking used to go through a blocking requests.Session, so the services had to
+push every query through asyncio.to_thread just to wait on the network. This
+module talks to the NVIDIA reranking endpoint with a pooled httpx.AsyncClient
+(keep-alive connections, explicit timeouts) and caches rerank logits per
+(query, passage) pair. The reranker is a cross-encoder, so a pair always gets
+the same logit no matter which other passages it was sent with, and repeated or
+overlapping queries only send the passages that were never scored.
+
+Key Components:
+- RerankScoreCache: Bounded in-memory LRU of logits keyed by (model, query hash, passage hash)
+- AsyncRerankerClient: Pooled async client that scores passages through the cache
+- shared_rerank_score_cache: The process-wide RerankScoreCache instance
+"""
+
+import asyncio
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from .embedding_engine import run_coroutine_sync
+
+
+class RerankScoreCache:
+    """
+    Size-bounded in-memory LRU of reranker logits.
+
+    Example:
+        >>> cache = RerankScoreCache(max_entries=50_000)
+        >>> cached = cache.get_many(model, query, passages)  # None for misses
+        >>> cache.put_many(model, query, {passage: logit})
+    """
+
+    def __init__(self, max_entries: int = 50_000):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Maximum number of (query, passage) scores kept in memory
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str, str], float]" = OrderedDict()
+
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, query: str, passages: List[str]) -> List[Optional[float]]:
+        """
+        Look up cached logits for passages scored against a query.
+
+        Args:
+            model: The reranker model the scores were produced with
+            query: The query text
+            passages: Passage texts
+
+        Returns:
+            List aligned with passages: the logit on a hit, None on a miss
+        """
+        query_hash = self._hash(query)
+        keys = [(model, query_hash, self._hash(passage)) for passage in passages]
+        with self._lock:
+            results = []
+            for key in keys:
+                score = self._entries.get(key)
+                if score is not None:
+                    self._entries.move_to_end(key)
+                results.append(score)
+            hits = sum(1 for r in results if r is not None)
+            self.hits += hits
+            self.misses += len(results) - hits
+        return results
+
+    def put_many(self, model: str, query: str, scores: Dict[str, float]) -> None:
+        """
+        Store logits for passages scored against a query.
+
+        Args:
+            model: The reranker model the scores were produced with
+            query: The query text
+            scores: Mapping of passage text -> logit
+        """
+        query_hash = self._hash(query)
+        with self._lock:
+            for passage, score in scores.items():
+                key = (model, query_hash, self._hash(passage))
+                self._entries[key] = float(score)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and current size."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+            }
+
+    def clear(self) -> None:
+        """Drop all cached scores."""
+        with self._lock:
+            self._entries.clear()
+
+
+# Shared by every RAGSystem in the process (e.g. all column indexes of a session)
+shared_rerank_score_cache = RerankScoreCache()
+
+
+class AsyncRerankerClient:
+    """
+    Pooled async client for the NVIDIA reranking endpoint.
+
+    Example:
+        >>> client = AsyncRerankerClient(api_key, url, model)
+        >>> logits = await client.score(query, passages)
+        >>> logits = client.score_sync(query, passages)  # from sync code
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        url: str,
+        model: str,
+        timeout: float = 30.0,
+        connect_timeout: float = 5.0,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        score_cache: Optional[RerankScoreCache] = None,
+        verbose: bool = False
+    ):
+        """
+        Initialize the reranker client.
+
+        Args:
+            api_key: NVIDIA API key for the reranking service
+            url: The API endpoint for the reranker
+            model: The reranker model to use
+            timeout: Overall request timeout in seconds
+            connect_timeout: Connection timeout in seconds
+            max_connections: Maximum pooled connections
+            max_keepalive_connections: Idle connections kept open for reuse
+            score_cache: Logit cache; defaults to the process-wide cache
+            verbose: If True, print detailed logging information
+        """
+        self.api_key = api_key
+        self.url = url
+        self.model = model
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections
+        )
+        self.score_cache = score_cache or shared_rerank_score_cache
+        self.verbose = verbose
+
+        # One client per event loop; httpx connection pools are loop-bound
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    # --------------------------------------------------------------------------
+    # Clients
+    # --------------------------------------------------------------------------
+
+    def _new_client(self) -> httpx.AsyncClient:
+        """Create a fresh pooled client (caller owns its lifetime)."""
+        return httpx.AsyncClient(
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Accept": "application/json",
+            },
+            timeout=self.timeout,
+            limits=self.limits
+        )
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Return the client bound to the running event loop, creating it if needed."""
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            client = self._new_client()
+            self._clients[loop] = client
+        return client
+
+    async def aclose(self) -> None:
+        """Close the client bound to the running event loop."""
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    # --------------------------------------------------------------------------
+    # Scoring
+    # --------------------------------------------------------------------------
+
+    async def _request(self, client: httpx.AsyncClient, query: str, passages: List[str]) -> List[Optional[float]]:
+        """Score passages in one API call; returns logits aligned with passages."""
+        payload = {
+            "model": self.model,
+            "query": {"text": query},
+            "passages": [{"text": passage} for passage in passages]
+        }
+        response = await client.post(self.url, json=payload)
+        response.raise_for_status()
+        rankings = response.json().get("rankings")
+        if not rankings:
+            raise ValueError("Reranker response did not contain 'rankings'.")
+
+        scores: List[Optional[float]] = [None] * len(passages)
+        for rank_data in rankings:
+            index = rank_data.get("index")
+            score = rank_data.get("logit")
+            if index is not None and score is not None and 0 <= index < len(passages):
+                scores[index] = float(score)
+        return scores
+
+    async def score(
+        self,
+        query: str,
+        passages: List[str],
+        client: Optional[httpx.AsyncClient] = None
+    ) -> List[Optional[float]]:
+        """
+        Rerank logits for passages, calling the API only for uncached pairs.
+
+        Args:
+            query: The user query
+            passages: Passage texts to score
+            client: Optional client to use instead of the per-loop client
+
+        Returns:
+            List of logits aligned with passages (None where the API returned no score)
+
+        Raises:
+            httpx.HTTPError: If the API call fails
+            ValueError: If the API response has no rankings
+        """
+        if not passages:
+            return []
+
+        scores, missing = self._lookup(query, passages)
+        if missing:
+            fetched = await self._request(client or self._get_client(), query, missing)
+            scores = self._merge(query, passages, scores, missing, fetched)
+        return scores
+
+    def score_sync(self, query: str, passages: List[str]) -> List[Optional[float]]:
+        """
+        Blocking wrapper around score() for sync callers.
+
+        A dedicated client is opened only if the API has to be called, since
+        the event loop created here does not outlive the call.
+        """
+        if not passages:
+            return []
+
+        scores, missing = self._lookup(query, passages)
+        if missing:
+            async def _fetch():
+                async with self._new_client() as client:
+                    return await self._request(client, query, missing)
+
+            fetched = run_coroutine_sync(_fetch())
+            scores = self._merge(query, passages, scores, missing, fetched)
+        return scores
+
+    def _lookup(self, query: str, passages: List[str]) -> Tuple[List[Optional[float]], List[str]]:
+        """Cached scores aligned with passages, plus the distinct passages still to score."""
+        scores = self.score_cache.get_many(self.model, query, passages)
+        missing = list(dict.fromkeys(p for p, s in zip(passages, scores) if s is None))
+        if self.verbose:
+            print(f"Reranker: {len(passages) - len(missing)} cached, {len(missing)} to score via API.")
+        return scores, missing
+
+    def _merge(
+        self,
+        query: str,
+        passages: List[str],
+        scores: List[Optional[float]],
+        missing: List[str],
+        fetched: List[Optional[float]]
+    ) -> List[Optional[float]]:
+        """Cache freshly fetched scores and fill them into the aligned score list."""
+        new_scores = {p: s for p, s in zip(missing, fetched) if s is not None}
+        self.score_cache.put_many(self.model, query, new_scores)
+        return [s if s is not None else new_scores.get(p) for p, s in zip(passages, scores)]
@@ -1,14 +1,17 @@
 import logging
 import asyncio
+import json
 import os
 import time
 from pathlib import Path
-from typing import Dict, Optional, List, Any, Literal
+from typing import Dict, Optional, List, Any, Literal, Tuple
 import re
+import sqlite3
 import pydantic
+import numpy as np
 
 from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 import httpx
 import uuid
 
@@ -21,15 +24,20 @@ import shared.models as models
 from shared.database import get_async_db, settings
 from shared.job_manager import JobStatusManager
 from lumina_agents.rag_agent import RAGSystem
+from lumina_agents.embedding_cache import EmbeddingCache
+from lumina_agents.metadata_filter import filterable_fields
+from lumina_agents.context_packer import pack_contexts
+from lumina_agents.index_manifest import read_manifest, record_index, validate_index, index_signature
 from shared.api_types import (
-    IndexJobRequest, IndexResponse, QueryRequest, QueryResponse,
+    IndexJobRequest, IndexResponse, QueryRequest, QueryResponse, BatchQueryRequest, BatchQueryResponse,
     GraphGenerationRequest, GraphGenerationResponse, NodeModel, RelationshipModel
 )
-from lumina_agents.query_agents import query_router_agent, synthesis_agent
+from lumina_agents.query_agents import query_router_agent, synthesis_agent, column_summary_agent
 from lumina_agents.extraction_agents import process_file_pipeline
 from shared.utils import (
     create_text_chunks_from_data, create_column_chunks_from_data,
-    run_agent_gracefully, export_to_csv
+    run_agent_gracefully, stream_agent_text, export_to_csv,
+    summarizable_columns, build_column_summaries, load_column_summaries, save_column_summaries
 )
 
 # Graph agent imports
@@ -49,7 +57,9 @@ from shared.utils import export_to_s3
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-CONCURRENCY_LIMIT = 3
+# Bounds concurrent column pipelines per query service process. The pipeline is
+# async end to end, so this caps outbound API pressure rather than worker threads.
+CONCURRENCY_LIMIT = 16
 rag_semaphore = asyncio.Semaphore(CONCURRENCY_LIMIT)
 
 app = FastAPI(
@@ -60,7 +70,24 @@ app = FastAPI(
 
 job_manager = JobStatusManager()
 INDEXES_DIR = Path("/data/indexes")
+COLUMN_INDEX_NAME = "columns" # One index per session; chunks carry a 'column_name' facet
+EMBEDDING_CACHE_DIR = Path("/data/embedding_cache") # Shared with the extraction service
+EMBEDDING_CACHE: Optional[EmbeddingCache] = None # Opened on startup; None if the volume is unavailable
 RAG_SYSTEMS_CACHE: Dict[str, RAGSystem] = {} # In-memory cache for loaded indexes
+RAG_SYSTEM_GENERATIONS: Dict[str, int] = {} # Manifest generation of each cached index
+INDEX_LOAD_ATTEMPTS = 3 # Loads of an index that a concurrent save keeps changing, before giving up with 503
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # Don't let proxies buffer the stream
+SYNTHESIS_CONTEXT_TOKENS = 4000 # Token budget of the column contexts passed to synthesis_agent
+
+
+@app.on_event("startup")
+async def open_embedding_cache():
+    """Open the shared embedding cache; indexing works without it if the volume is missing."""
+    global EMBEDDING_CACHE
+    try:
+        EMBEDDING_CACHE = await asyncio.to_thread(EmbeddingCache, str(EMBEDDING_CACHE_DIR / "embeddings.sqlite"))
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"Embedding cache unavailable at {EMBEDDING_CACHE_DIR}, embedding without it: {e}")
 
 # Log startup information
 logger.info(f"🚀 Query Service starting up")
@@ -153,39 +180,105 @@ def rag_to_query_response(pipeline_result: dict) -> dict:
         "result_type": "rag",
     }
     
+def _session_manifest_indexes(session_id: int) -> Optional[Dict[str, Dict[str, Any]]]:
+    """Index entries of a session's manifest, or None for sessions indexed before manifests."""
+    manifest = read_manifest(str(INDEXES_DIR / str(session_id)))
+    return manifest.get("indexes", {}) if manifest else None
+
+def index_exists(session_id: int, index_name: str) -> bool:
+    """Whether a session has the given index (from the manifest; no directory listing)."""
+    indexes = _session_manifest_indexes(session_id)
+    if indexes is not None:
+        return index_name in indexes
+    return (INDEXES_DIR / str(session_id) / index_name).exists()
+
 async def get_or_load_rag_system(session_id: int, index_name: str) -> RAGSystem:
     """
     Loads a RAG system from disk into a local cache if not already present.
+
+    The session manifest says which indexes exist and at which generation; a
+    cached index is reloaded once another service has saved a newer generation,
+    and an index whose files do not match the manifest is refused, not loaded.
+    A load that overlapped a save is discarded and retried.
     """
     cache_key = f"{session_id}_{index_name}"
-    if cache_key in RAG_SYSTEMS_CACHE:
+    session_dir = INDEXES_DIR / str(session_id)
+    index_path = session_dir / index_name
+    indexes = _session_manifest_indexes(session_id)
+    entry = indexes.get(index_name) if indexes is not None else None
+
+    cached = RAG_SYSTEMS_CACHE.get(cache_key)
+    if cached is not None and (entry is None or RAG_SYSTEM_GENERATIONS.get(cache_key) == entry["generation"]):
         logger.info(f"Found RAG system '{cache_key}' in cache.")
-        return RAG_SYSTEMS_CACHE[cache_key]
+        return cached
 
-    index_path = INDEXES_DIR / str(session_id) / index_name
-    
-    # Log what files we can see for debugging
-    session_dir = INDEXES_DIR / str(session_id)
-    if session_dir.exists():
-        available_indexes = [f.name for f in session_dir.iterdir() if f.is_dir()]
-        logger.info(f"Available indexes in session {session_id}: {available_indexes}")
-    else:
-        logger.warning(f"Session directory does not exist: {session_dir}")
-        logger.info(f"INDEXES_DIR contents: {[f.name for f in INDEXES_DIR.iterdir()] if INDEXES_DIR.exists() else 'INDEXES_DIR does not exist'}")
-    
-    if not index_path.exists():
-        raise HTTPException(status_code=404, detail=f"Index '{index_name}' not found for session {session_id}. Available: {available_indexes if session_dir.exists() else 'none'}")
+    if indexes is None:
+        # Session indexed before manifests: fall back to the directory listing
+        if session_dir.exists():
+            available_indexes = [f.name for f in session_dir.iterdir() if f.is_dir()]
+            logger.info(f"Available indexes in session {session_id}: {available_indexes}")
+        else:
+            logger.warning(f"Session directory does not exist: {session_dir}")
+        
+        if not index_path.exists():
+            raise HTTPException(status_code=404, detail=f"Index '{index_name}' not found for session {session_id}. Available: {available_indexes if session_dir.exists() else 'none'}")
 
-    logger.info(f"Loading RAG system from '{index_path}' into cache...")
-    rag_system = RAGSystem(
-            embed_api_key=settings.NVIDIA_EMBED_API_KEY,
-            rerank_api_key=settings.NVIDIA_RERANK_API_KEY,
-            gemini_api_key=settings.GOOGLE_GEMINI_API_KEY
+    # save_index replaces the files one at a time, so a save running while the
+    # index loads can leave it with files of two generations; such a load is
+    # detected afterwards and retried
+    for _ in range(INDEX_LOAD_ATTEMPTS):
+        if indexes is not None:
+            if entry is None:
+                raise HTTPException(status_code=404, detail=f"Index '{index_name}' not found for session {session_id}. Available: {sorted(indexes)}")
+            problem = await asyncio.to_thread(validate_index, str(session_dir), index_name, entry)
+            if problem and cached is not None:
+                # Most likely being rewritten right now; the previous generation is still usable
+                logger.warning(f"Index '{index_name}' of session {session_id} failed validation ({problem}); serving the cached generation.")
+                return cached
+            if problem:
+                # Partially written, corrupted, or being rewritten right now
+                logger.error(f"Index '{index_name}' of session {session_id} failed validation: {problem}")
+                raise HTTPException(status_code=503, detail=f"Index '{index_name}' for session {session_id} is incomplete ({problem}). Please retry shortly.")
+
+        logger.info(f"Loading RAG system from '{index_path}' into cache...")
+        rag_system = RAGSystem(
+                embed_api_key=settings.NVIDIA_EMBED_API_KEY,
+                rerank_api_key=settings.NVIDIA_RERANK_API_KEY,
+                gemini_api_key=settings.GOOGLE_GEMINI_API_KEY,
+                embedding_cache=EMBEDDING_CACHE,
+                adaptive_retrieval=settings.ADAPTIVE_RETRIEVAL,
+                mmr_diversification=settings.MMR_DIVERSIFICATION,
+                hybrid_search=settings.HYBRID_SEARCH and index_name == "row_wise",
+                mmap_index=True  # read-only serving: share the page cache, load in milliseconds
+            )
+        if entry is not None and entry.get("embed_model") != rag_system.embed_model:
+            # Queries embedded with another model would silently match the wrong rows
+            raise HTTPException(status_code=500, detail=f"Index '{index_name}' for session {session_id} was built with '{entry.get('embed_model')}', but queries use '{rag_system.embed_model}'.")
+        signature = await asyncio.to_thread(index_signature, str(index_path))
+        await asyncio.to_thread(rag_system.load_index, str(index_path))
+
+        # The load is consistent if no file was replaced and the manifest did not move on meanwhile
+        indexes = _session_manifest_indexes(session_id)
+        entry_after = indexes.get(index_name) if indexes is not None else None
+        unchanged = await asyncio.to_thread(index_signature, str(index_path)) == signature and (
+            entry is None or (entry_after is not None
+                              and (entry_after["generation"], entry_after["checksum"]) == (entry["generation"], entry["checksum"]))
         )
-    await asyncio.to_thread(rag_system.load_index, str(index_path))
-    
+        if unchanged:
+            break
+        if cached is not None:
+            logger.warning(f"Index '{index_name}' of session {session_id} changed while loading; serving the cached generation.")
+            return cached
+        logger.warning(f"Index '{index_name}' of session {session_id} changed while loading; reloading.")
+        entry = entry_after
+    else:
+        raise HTTPException(status_code=503, detail=f"Index '{index_name}' for session {session_id} is being rewritten. Please retry shortly.")
+
     RAG_SYSTEMS_CACHE[cache_key] = rag_system
+    if entry is not None:
+        RAG_SYSTEM_GENERATIONS[cache_key] = entry["generation"]
     return rag_system
+
 # ============================================================================
 # Core Logic for Background Tasks
 # ============================================================================
@@ -201,22 +294,31 @@ async def do_indexing_work(session_id: int, job_id: str):
         
         query = select(models.ExtractedRecord).where(models.ExtractedRecord.session_id == session_id)
         result = await db.execute(query)
-        records = [r.data for r in result.scalars().all()]
+        record_rows = result.scalars().all()
+        records = [r.data for r in record_rows]
+        record_ids = [r.id for r in record_rows]
         if not records:
             raise ValueError("No extracted records found in the database for this session.")
 
         # --- 1. Row-wise Indexing ---
         await job_manager.update_status(job_id, "PROCESSING", "Creating row-wise index...")
-        row_chunks = create_text_chunks_from_data(records)
+        row_chunks = create_text_chunks_from_data(records, record_ids=record_ids)
         row_wise_rag = RAGSystem(
             embed_api_key=settings.NVIDIA_EMBED_API_KEY,
             rerank_api_key=settings.NVIDIA_RERANK_API_KEY,
-            gemini_api_key=settings.GOOGLE_GEMINI_API_KEY
+            gemini_api_key=settings.GOOGLE_GEMINI_API_KEY,
+            embedding_cache=EMBEDDING_CACHE,
+            embedding_quantization=settings.EMBEDDING_QUANTIZATION
         )
-        per_chunk_meta = [{"row_index": i} for i in range(len(row_chunks))]
+        # Short record fields (source document, categorical, numeric) back the row filters
+        per_chunk_meta = [
+            {**filterable_fields(record), "row_index": i, "record_id": record_id}
+            for i, (record, record_id) in enumerate(zip(records, record_ids))
+        ]
         await asyncio.to_thread(
             row_wise_rag.index_documents, 
             row_chunks,
+            ids=record_ids,
             base_metadata={
                 "session_id": session_id,
                 "index_type": "row_wise",
@@ -224,37 +326,75 @@ async def do_indexing_work(session_id: int, job_id: str):
             per_chunk_metadata=per_chunk_meta,
         )
         
+        # Very large sessions are searched coarse-to-fine: source documents first,
+        # then only the records of the best documents
+        if len(records) >= RAGSystem.HIERARCHY_MIN_VECTORS:
+            await job_manager.update_status(job_id, "PROCESSING", "Creating document-level index...")
+            n_documents = await asyncio.to_thread(row_wise_rag.build_document_index)
+            logger.info(f"Built document-level index over {n_documents} documents for {len(records)} records")
+        
         row_wise_path = INDEXES_DIR / str(session_id) / "row_wise"
         row_wise_path.parent.mkdir(parents=True, exist_ok=True)
         await asyncio.to_thread(row_wise_rag.save_index, str(row_wise_path))
+        await asyncio.to_thread(record_index, str(row_wise_path.parent), "row_wise", row_wise_rag.embed_model, len(row_wise_rag.chunk_ids))
         logger.info(f"Saved row-wise index to {row_wise_path}")
 
         # --- 2. Column-wise Indexing ---
-        await job_manager.update_status(job_id, "PROCESSING", "Creating column-wise indexes...")
+        # A single session index whose chunks are tagged with their column, so a
+        # multi-column query is one embed, one search pass and one rerank call
+        await job_manager.update_status(job_id, "PROCESSING", "Creating column-wise index...")
         columns_to_index = list(records[0].keys()) # Example: index all columns
-        column_chunks_map = create_column_chunks_from_data(records, columns_to_index)
+        column_chunks_map = create_column_chunks_from_data(records, columns_to_index, record_ids=record_ids)
+        column_windows = [
+            (window["text"], {"column_name": col_name, **window["metadata"]})
+            for col_name, windows in column_chunks_map.items()
+            for window in windows
+        ]
 
-        for col_name, chunk_text in column_chunks_map.items():
-            col_rag = RAGSystem(
-                embed_api_key=settings.NVIDIA_EMBED_API_KEY,
-                rerank_api_key=settings.NVIDIA_RERANK_API_KEY,
-                gemini_api_key=settings.GOOGLE_GEMINI_API_KEY
+        column_rag = RAGSystem(
+            embed_api_key=settings.NVIDIA_EMBED_API_KEY,
+            rerank_api_key=settings.NVIDIA_RERANK_API_KEY,
+            gemini_api_key=settings.GOOGLE_GEMINI_API_KEY,
+            embedding_cache=EMBEDDING_CACHE,
+            embedding_quantization=settings.EMBEDDING_QUANTIZATION
+        )
+        # Windows of all columns are embedded together, batch_size at a time
+        await asyncio.to_thread(
+            column_rag.index_documents,
+            [text for text, _ in column_windows],
+            base_metadata={
+                "session_id": session_id,
+                "index_type": "column_wise",
+            },
+            per_chunk_metadata=[meta for _, meta in column_windows],
+        )
+
+        col_path = INDEXES_DIR / str(session_id) / COLUMN_INDEX_NAME
+        await asyncio.to_thread(column_rag.save_index, str(col_path))
+        await asyncio.to_thread(record_index, str(col_path.parent), COLUMN_INDEX_NAME, column_rag.embed_model, len(column_rag.chunk_ids))
+        logger.info(f"Saved column-wise index ({len(column_windows)} chunks, {len(column_chunks_map)} columns) to {col_path}")
+
+        # --- 3. Column Summaries ---
+        # Map-reduce summaries of the free-text columns answer aggregate questions;
+        # summaries of columns whose data did not change are kept as they are
+        await job_manager.update_status(job_id, "PROCESSING", "Summarizing columns...")
+        session_dir = INDEXES_DIR / str(session_id)
+        try:
+            to_summarize = summarizable_columns(records, list(column_chunks_map))
+            summaries = await build_column_summaries(
+                column_summary_agent,
+                {col: column_chunks_map[col] for col in to_summarize},
+                existing=await asyncio.to_thread(load_column_summaries, session_dir)
             )
-            await asyncio.to_thread(col_rag.index_documents, 
-                                    [chunk_text],
-                                    base_metadata={
-                                        "session_id": session_id,
-                                        "index_type": f"column_wise",
-                                        "column_name": col_name
-                                    },
-                                    per_chunk_metadata=[{"column_name": col_name}]
-                                )
-            
-            col_path = INDEXES_DIR / str(session_id) / f"column_{col_name}"
-            await asyncio.to_thread(col_rag.save_index, str(col_path))
-            logger.info(f"Saved column-wise index for '{col_name}' to {col_path}")
+            await asyncio.to_thread(save_column_summaries, session_dir, summaries)
+            logger.info(f"Saved summaries of {len(summaries)}/{len(to_summarize)} columns to {session_dir}")
+        except Exception as e:
+            # Column questions still work without summaries, through retrieval and synthesis
+            logger.warning(f"Column summarization failed for session {session_id}: {e}")
         
-        message = f"Successfully created {1 + len(column_chunks_map)} indexes."
+        if EMBEDDING_CACHE is not None:
+            logger.info(f"Embedding cache stats after indexing: {EMBEDDING_CACHE.stats()}")
+        message = f"Successfully created row-wise and column-wise indexes ({len(column_chunks_map)} columns)."
         await job_manager.update_status(job_id, "COMPLETED", message)
 
     except Exception as e:
@@ -269,22 +409,19 @@ async def do_indexing_work(session_id: int, job_id: str):
         if db:
             await db.close()
 
-async def merge_column_query_results(
-    column_results: List[Dict[str, Any]], 
-    query: str,
-    target_columns: List[str],
-    num_results: int = 10 # --- FIX: Added num_results ---
+def _collect_column_results(
+    column_results: List[Dict[str, Any]],
+    num_results: int = 10
 ) -> Dict[str, Any]:
     """
-    Merge results from multiple column RAG queries into a single response.
-    
+    Flatten per-column RAG results into column-tagged sources, records and synthesis contexts.
+
     Args:
         column_results: List of dicts with 'column' and 'result' keys
-        query: Original user query
-        target_columns: List of column names that were queried
-    
+        num_results: Number of sources/records to keep
+
     Returns:
-        Dict suitable for QueryResponse
+        Dict with 'sources', 'relevant_records', 'contexts' and 'confidence'
     """
     # Collect all sources and contexts from each column
     all_sources = []
@@ -311,15 +448,21 @@ async def merge_column_query_results(
             
             # Collect contexts with column tags
             text = item.get("text", "")
-            all_contexts.append(f"[From column '{column_name}']: {text}")
+            score = float(item.get("rerank_score", item.get("similarity_score", 0.0)))
+            all_contexts.append((score, f"[From column '{column_name}']: {text}"))
             
             # Collect relevant records
-            all_relevant_records.append({
+            relevant_record = {
                 "chunk_id": item.get("chunk_id"),
                 "column": column_name,
                 "text": text,
                 "score": float(item.get("rerank_score", item.get("similarity_score", 0.0))),
-            })
+            }
+            # Windowed column chunks name the records they cover
+            if "record_id_start" in item:
+                relevant_record["record_id_start"] = item["record_id_start"]
+                relevant_record["record_id_end"] = item["record_id_end"]
+            all_relevant_records.append(relevant_record)
     
     # Sort sources by score (descending)
     all_sources.sort(key=lambda x: x["score"], reverse=True)
@@ -329,13 +472,31 @@ async def merge_column_query_results(
     top_sources = all_sources[:num_results]
     top_records = all_relevant_records[:num_results]
 
-    # Get top contexts for synthesis
-    top_contexts = all_contexts[:20]  # Use more contexts for synthesis
+    # Get top contexts for synthesis: best first, deduplicated and within the token budget
+    all_contexts.sort(key=lambda x: x[0], reverse=True)
+    top_contexts = pack_contexts(
+        (context for _, context in all_contexts),
+        max_tokens=SYNTHESIS_CONTEXT_TOKENS
+    )
     
-    # Synthesize answer from multiple columns   
+    # Calculate combined confidence (average of top scores)
+    if top_sources:
+        confidence = sum(s["score"] for s in top_sources[:3]) / min(3, len(top_sources))
+    else:
+        confidence = 0.0
+
+    return {
+        "sources": top_sources,
+        "relevant_records": top_records,
+        "contexts": top_contexts,
+        "confidence": confidence,
+    }
+
+def _build_synthesis_prompt(query: str, target_columns: List[str], contexts: List[str]) -> str:
+    """Prompt asking the synthesis agent to answer from several columns' contexts."""
     columns_list = ", ".join([f"'{col}'" for col in target_columns])
-    context_text = "\n\n".join(top_contexts)
-    SYNTHESIS_PROMPT = f"""You are answering a query about data from multiple columns: {columns_list}.
+    context_text = "\n\n".join(contexts)
+    return f"""You are answering a query about data from multiple columns: {columns_list}.
 
     Here is the relevant information from these columns:
 
@@ -347,60 +508,277 @@ async def merge_column_query_results(
     Make sure to integrate insights from different columns naturally.
     If information from different columns relates to each other, highlight those connections."""
 
+async def merge_column_query_results(
+    column_results: List[Dict[str, Any]], 
+    query: str,
+    target_columns: List[str],
+    num_results: int = 10 # --- FIX: Added num_results ---
+) -> Dict[str, Any]:
+    """
+    Merge results from multiple column RAG queries into a single response.
+    
+    Args:
+        column_results: List of dicts with 'column' and 'result' keys
+        query: Original user query
+        target_columns: List of column names that were queried
+    
+    Returns:
+        Dict suitable for QueryResponse
+    """
+    collected = _collect_column_results(column_results, num_results)
+
+    # Synthesize answer from multiple columns   
+    SYNTHESIS_PROMPT = _build_synthesis_prompt(query, target_columns, collected["contexts"])
     synthesized_answer = await run_agent_gracefully(synthesis_agent, SYNTHESIS_PROMPT)
     parsed_synthesis = synthesized_answer.final_output
 
-    # Calculate combined confidence (average of top scores)
-    if top_sources:
-        confidence = sum(s["score"] for s in top_sources[:3]) / min(3, len(top_sources))
-    else:
-        confidence = 0.0
-    
     return {
         "query": query,
         "answer": parsed_synthesis,
-        "confidence": confidence,
-        "sources": top_sources,
-        "relevant_records": top_records,
+        "confidence": collected["confidence"],
+        "sources": collected["sources"],
+        "relevant_records": collected["relevant_records"],
         "result_type": "rag",
     }
 
+def _build_summary_prompt(query: str, column_summaries: Dict[str, Dict[str, Any]]) -> str:
+    """Prompt asking the synthesis agent to answer an aggregate query from precomputed column summaries."""
+    columns_list = ", ".join([f"'{col}'" for col in column_summaries])
+    summary_text = "\n\n".join(
+        f"[Summary of column '{col}' over {entry['record_count']} records]: {entry['summary']}"
+        for col, entry in column_summaries.items()
+    )
+    return f"""You are answering a query about data from multiple columns: {columns_list}.
+
+    Here are summaries of these columns over all records:
+
+    {summary_text}
+
+    User Query: {query}
+
+    Answer from the summaries only, citing the Record IDs they mention for specific claims.
+    If information from different columns relates to each other, highlight those connections."""
+
+def _summary_response_fields(query: str, column_summaries: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """QueryResponse fields (all but the answer) of an answer built from column summaries."""
+    return {
+        "query": query,
+        "confidence": None,
+        "sources": [
+            {"chunk_id": None, "column": col, "score": 1.0, "text_preview": entry["summary"][:200]}
+            for col, entry in column_summaries.items()
+        ],
+        "relevant_records": [
+            {"chunk_id": None, "column": col, "text": entry["summary"], "score": 1.0,
+             "record_count": entry["record_count"]}
+            for col, entry in column_summaries.items()
+        ],
+        "result_type": "rag",
+    }
+
+async def answer_from_column_summaries(query: str, column_summaries: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Answer an aggregate column query with one synthesis call on the precomputed
+    column summaries (no retrieval or reranking).
+
+    Returns:
+        Dict suitable for QueryResponse
+    """
+    result = await run_agent_gracefully(synthesis_agent, _build_summary_prompt(query, column_summaries))
+    return {"answer": result.final_output, **_summary_response_fields(query, column_summaries)}
+
 def sanitize_field_name(field_name: str) -> str:
     """Sanitize field name to match the format used when saving indexes."""
     return field_name.strip().replace(" ", "_").replace("-", "_")
 
-async def _query_single_column(
+async def _retrieve_single_column(
     session_id: int, 
     column_name: str, 
     query: str, 
-    num_results: int
-) -> Dict[str, Any] | None:
+    retrieve_top_k: int = 20
+) -> Tuple[str, RAGSystem, List[Dict[str, Any]]] | None:
     """
-    Async helper to query one RAG index.
+    Async helper to retrieve (not rerank) candidates from one per-column RAG index.
     Returns None if a specific column query fails.
     """
     # Sanitize column name to match the format used when saving indexes
     safe_column_name = sanitize_field_name(column_name)
     index_name = f"column_{safe_column_name}"
     async with rag_semaphore:
-        logger.info(f"Starting query for column: {column_name} (Semaphore acquired)")
+        logger.info(f"Starting retrieval for column: {column_name} (Semaphore acquired)")
         try:
             rag_system = await get_or_load_rag_system(session_id, index_name)
-            
-            # The code that hits the server is now inside the semaphore block
-            pipeline_result = await asyncio.to_thread(
-                rag_system.run_pipeline,
-                query=query,
-                rerank_top_k=num_results,
-                skip_generation=True  # Skip generation for column queries since we will synthesize later
-            )
-            
-            logger.info(f"Successfully queried column: {column_name} (Semaphore released)")
-            return {"column": column_name, "result": pipeline_result}
+            retrieved = await rag_system.aretrieve(query, top_k=retrieve_top_k)
+            logger.info(f"Retrieved {len(retrieved)} chunks for column: {column_name} (Semaphore released)")
+            return column_name, rag_system, retrieved
         
         except Exception as e:
             logger.warning(f"Failed to query column {column_name}: {e}")
             return None # return None instead of crashing
+
+async def _query_legacy_columns(
+    session_id: int,
+    column_names: List[str],
+    query: str,
+    num_results: int
+) -> List[Dict[str, Any]]:
+    """
+    Query several columns of a session that has one index per column.
+
+    Candidates are retrieved from every column concurrently, then reranked in
+    a single call and split back per column, so rerank scores are comparable
+    across columns. Returns 'column'/'result' dicts; columns that fail are left out.
+    """
+    retrievals = await asyncio.gather(
+        *(_retrieve_single_column(session_id, column, query) for column in column_names)
+    )
+    retrievals = [r for r in retrievals if r is not None]
+    if not retrievals:
+        return []
+
+    grouped = {column_name: retrieved for column_name, _, retrieved in retrievals}
+    # Every column index uses the same reranker, so any of them can score the combined list
+    reranker = retrievals[0][1]
+    async with rag_semaphore:
+        reranked = await reranker.arerank_groups(query, grouped, top_k=num_results)
+
+    return [
+        {
+            "column": column_name,
+            "result": {
+                "query": query,
+                "retrieved_results": retrieved,
+                "reranked_results": reranked[column_name],
+            },
+        }
+        for column_name, retrieved in grouped.items()
+    ]
+
+async def _summaries_for_columns(session_id: int, column_names: List[str]) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    Stored summary entries ({"summary", "record_count", ...}) of the given
+    columns, or None unless every one of them has a summary.
+    """
+    stored = await asyncio.to_thread(load_column_summaries, INDEXES_DIR / str(session_id))
+    # The router may not spell column names exactly as they were indexed
+    by_key = {sanitize_field_name(col).lower(): entry for col, entry in stored.items()}
+    summaries = {}
+    for column_name in column_names:
+        summary = by_key.get(sanitize_field_name(column_name).lower())
+        if summary is None:
+            return None
+        summaries[column_name] = summary
+    return summaries
+
+async def _query_columns(
+    session_id: int,
+    column_names: List[str],
+    query: str,
+    num_results: int
+) -> List[Dict[str, Any]]:
+    """
+    Query several columns through the session's faceted column index.
+
+    The query is embedded once, every column is searched in the same pass and
+    all candidates are reranked in one call. Returns 'column'/'result' dicts in
+    the same shape as _query_legacy_columns; columns that fail are left out.
+    """
+    # Facet values are the indexed column keys; the router may spell them with
+    # spaces or hyphens, so they are sanitized like the legacy index names
+    facet_values = {column_name: sanitize_field_name(column_name) for column_name in column_names}
+    async with rag_semaphore:
+        rag_system = await get_or_load_rag_system(session_id, COLUMN_INDEX_NAME)
+        facet_results = await rag_system.arun_facet_pipeline(
+            query,
+            facet="column_name",
+            values=list(dict.fromkeys(facet_values.values())),
+            rerank_top_k=num_results
+        )
+
+    column_results = []
+    for column_name, facet_value in facet_values.items():
+        result = facet_results[facet_value]
+        if "error" in result:
+            logger.warning(f"Failed to query column {column_name}: {result['error']}")
+            continue
+        if not result["retrieved_results"]:
+            logger.warning(f"No chunks indexed for column {column_name}")
+        column_results.append({"column": column_name, "result": result})
+    return column_results
+
+def _sse_event(event: str, data: Any) -> str:
+    """Formats one Server-Sent Event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def _single_event_stream(response: QueryResponse):
+    """SSE stream for answers that are not generated token by token (functions, jobs)."""
+    yield _sse_event("done", response.model_dump(mode="json"))
+
+async def _stream_rag_answer(rag_system: RAGSystem, query: str, num_results: int, allowed_ids: Any = None):
+    """Streams a row-wise RAG answer as SSE: sources, answer tokens, then the full response."""
+    try:
+        async for event in rag_system.astream_pipeline(query=query, rerank_top_k=num_results, allowed_ids=allowed_ids):
+            if event["event"] == "sources":
+                response_fields = rag_to_query_response(event)
+                response_fields.pop("answer")
+                yield _sse_event("sources", response_fields)
+            elif event["event"] == "token":
+                yield _sse_event("token", {"text": event["text"]})
+            elif event["event"] == "done":
+                response = QueryResponse(success=True, **rag_to_query_response(event))
+                yield _sse_event("done", response.model_dump(mode="json"))
+            else:
+                yield _sse_event("error", {"detail": event.get("error", "Unknown error")})
+    except Exception as e:
+        logger.error(f"Error while streaming RAG answer for query '{query}'", exc_info=True)
+        yield _sse_event("error", {"detail": str(e)})
+
+async def _stream_column_answer(
+    column_results: List[Dict[str, Any]],
+    query: str,
+    target_columns: List[str],
+    num_results: int
+):
+    """Streams a multi-column answer as SSE: merged sources, synthesis tokens, then the full response."""
+    try:
+        collected = _collect_column_results(column_results, num_results)
+        response_fields = {
+            "query": query,
+            "confidence": collected["confidence"],
+            "sources": collected["sources"],
+            "relevant_records": collected["relevant_records"],
+            "result_type": "rag",
+        }
+        yield _sse_event("sources", response_fields)
+
+        answer_parts = []
+        synthesis_prompt = _build_synthesis_prompt(query, target_columns, collected["contexts"])
+        async for text in stream_agent_text(synthesis_agent, synthesis_prompt):
+            answer_parts.append(text)
+            yield _sse_event("token", {"text": text})
+
+        response = QueryResponse(success=True, answer="".join(answer_parts), **response_fields)
+        yield _sse_event("done", response.model_dump(mode="json"))
+    except Exception as e:
+        logger.error(f"Error while streaming column answer for query '{query}'", exc_info=True)
+        yield _sse_event("error", {"detail": str(e)})
+
+async def _stream_summary_answer(query: str, column_summaries: Dict[str, Dict[str, Any]]):
+    """Streams an answer built from column summaries as SSE: the summaries as sources, tokens, then the full response."""
+    try:
+        response_fields = _summary_response_fields(query, column_summaries)
+        yield _sse_event("sources", response_fields)
+
+        answer_parts = []
+        async for text in stream_agent_text(synthesis_agent, _build_summary_prompt(query, column_summaries)):
+            answer_parts.append(text)
+            yield _sse_event("token", {"text": text})
+
+        response = QueryResponse(success=True, answer="".join(answer_parts), **response_fields)
+        yield _sse_event("done", response.model_dump(mode="json"))
+    except Exception as e:
+        logger.error(f"Error while streaming summary answer for query '{query}'", exc_info=True)
+        yield _sse_event("error", {"detail": str(e)})
     
     
 # ============================================================================
@@ -418,9 +796,30 @@ async def start_indexing_endpoint(req: IndexJobRequest, background_tasks: Backgr
     background_tasks.add_task(do_indexing_work, req.session_id, req.job_id)
     return {"job_id": req.job_id, "message": "Indexing job has been started."}
 
-@app.post("/query", response_model=QueryResponse)
-async def query_data_endpoint(req: QueryRequest, db: AsyncSession = Depends(get_async_db)):
-    """Routes a user query to the appropriate handler (RAG or function call)."""
+async def _resolve_row_filters(rag_system: RAGSystem, row_filters: Any) -> Optional[np.ndarray]:
+    """
+    Ids of the rows matching row_filters, resolved off the event loop, or None
+    to search every row (no filter, or a filter that applies to nothing).
+    """
+    if not row_filters:
+        return None
+    matched_ids = await asyncio.to_thread(rag_system.filter_ids, row_filters)
+    if matched_ids is None:
+        logger.info(f"Row filters {row_filters!r} do not apply to this index; searching all rows.")
+        return None
+    if len(matched_ids) == 0:
+        # The router's filter may be wrong; an unfiltered search beats an empty answer
+        logger.info(f"Row filters {row_filters!r} matched no rows; searching all rows.")
+        return None
+    logger.info(f"Row filters {row_filters!r} matched {len(matched_ids)} rows.")
+    return matched_ids
+
+async def _handle_query(req: QueryRequest, db: AsyncSession, stream: bool = False):
+    """
+    Routes a user query to the appropriate handler (RAG or function call).
+    With stream=True, RAG answers are returned as an async iterator of SSE events
+    instead of a QueryResponse.
+    """
     try:
         session_query = select(models.Session).where(models.Session.id == req.session_id)
         session = (await db.execute(session_query)).scalar_one()
@@ -579,24 +978,34 @@ Data Preview (from first record) -- use this to understand data types and conten
             )
         
         if intent.intent_type == "rag_column_wise" and intent.target_columns:
-            # multi-column analysis
-            # either, query each column index separately and merge results
-            # create a combined index for multiple columns
-            # use a single index with column metadata
-            
-            tasks = []
-            for column in intent.target_columns:
-                tasks.append(
-                    _query_single_column(
-                        session_id=req.session_id,
-                        column_name=column,
-                        query=req.query,
-                        num_results=req.num_results
-                    )
+            # Aggregate questions over summarized columns are answered from the
+            # index-time summaries in one call, without retrieval or reranking
+            if intent.aggregate:
+                column_summaries = await _summaries_for_columns(req.session_id, intent.target_columns)
+                if column_summaries:
+                    logger.info(f"Answering aggregate query from precomputed summaries of {list(column_summaries)}")
+                    if stream:
+                        return _stream_summary_answer(req.query, column_summaries)
+                    summary_response = await answer_from_column_summaries(req.query, column_summaries)
+                    return QueryResponse(success=True, **summary_response)
+
+            # multi-column analysis: sessions indexed with a single faceted column
+            # index are served in one pass; older sessions still have one index
+            # per column directory, searched concurrently and reranked together
+            if index_exists(req.session_id, COLUMN_INDEX_NAME):
+                all_column_results = await _query_columns(
+                    session_id=req.session_id,
+                    column_names=intent.target_columns,
+                    query=req.query,
+                    num_results=req.num_results
+                )
+            else:
+                all_column_results = await _query_legacy_columns(
+                    session_id=req.session_id,
+                    column_names=intent.target_columns,
+                    query=req.query,
+                    num_results=req.num_results
                 )
-            
-            # Gather all results concurrently
-            all_column_results = await asyncio.gather(*tasks)
             
             # Filter out any that failed (returned None)
             successful_column_results = [res for res in all_column_results if res is not None]
@@ -606,6 +1015,11 @@ Data Preview (from first record) -- use this to understand data types and conten
                     status_code=500, 
                     detail="No columns could be queried successfully"
                 )
+
+            if stream:
+                return _stream_column_answer(
+                    successful_column_results, req.query, intent.target_columns, req.num_results
+                )
             
             merged_response = await merge_column_query_results(
                 column_results=successful_column_results, 
@@ -618,19 +1032,20 @@ Data Preview (from first record) -- use this to understand data types and conten
         else:
             index_name = "row_wise"
             
-            # check if there's a row_filters in the intent.row_filters
-            if intent.row_filters:
-                logger.info(f"Applying row filters to query: {intent.row_filters}")
-                # Note: Actual filtering logic would depend on how RAGSystem supports it
-                # For now, we just log it.
-            
             try:
                 rag_system = await get_or_load_rag_system(req.session_id, index_name)
-                pipeline_result = await asyncio.to_thread(
-                    rag_system.run_pipeline,
+
+                # Restrict the search to the rows matching intent.row_filters (resolved once)
+                allowed_ids = await _resolve_row_filters(rag_system, intent.row_filters)
+
+                if stream:
+                    return _stream_rag_answer(rag_system, req.query, req.num_results, allowed_ids)
+                pipeline_result = await rag_system.arun_pipeline(
                     query=req.query,
-                    rerank_top_k=req.num_results
+                    rerank_top_k=req.num_results,
+                    allowed_ids=allowed_ids
                 )
+                logger.info(f"Retrieval plan: {pipeline_result.get('retrieval_plan')}")
                 return QueryResponse(success=True, **rag_to_query_response(pipeline_result))
             except HTTPException as e:
                 if e.status_code == 404:
@@ -651,6 +1066,57 @@ Data Preview (from first record) -- use this to understand data types and conten
         logger.error(f"Error during /query for session {req.session_id}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/query", response_model=QueryResponse)
+async def query_data_endpoint(req: QueryRequest, db: AsyncSession = Depends(get_async_db)):
+    """Routes a user query to the appropriate handler (RAG or function call)."""
+    return await _handle_query(req, db)
+
+@app.post("/query/stream")
+async def query_stream_endpoint(req: QueryRequest, db: AsyncSession = Depends(get_async_db)):
+    """
+    Server-Sent-Events variant of /query.
+
+    RAG answers are streamed: a 'sources' event first, then 'token' events as
+    the answer is generated, then a 'done' event with the full QueryResponse.
+    Other intents (functions, extraction jobs) send only the 'done' event.
+    Failures after the stream has started are sent as an 'error' event.
+    """
+    result = await _handle_query(req, db, stream=True)
+    events = _single_event_stream(result) if isinstance(result, QueryResponse) else result
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.post("/query/batch", response_model=BatchQueryResponse)
+async def query_batch_endpoint(req: BatchQueryRequest):
+    """
+    Retrieval-only answers for many queries against the row-wise index.
+
+    All queries are embedded in one batched call and searched together; no
+    routing, reranking or generation is done (for evaluation, prefetching
+    suggested questions and other batch clients). At most MAX_BATCH_QUERIES
+    queries are accepted per request.
+    """
+    if not req.queries:
+        return BatchQueryResponse(success=True, results=[])
+
+    try:
+        rag_system = await get_or_load_rag_system(req.session_id, "row_wise")
+        allowed_ids = await _resolve_row_filters(rag_system, req.row_filters)
+        async with rag_semaphore:
+            hits_per_query = await rag_system.aretrieve_many(
+                req.queries, top_k=req.num_results, allowed_ids=allowed_ids
+            )
+        results = []
+        for query, hits in zip(req.queries, hits_per_query):
+            response = rag_to_query_response({"query": query, "answer": "", "retrieved_results": hits})
+            response["result_type"] = "retrieval"
+            results.append(QueryResponse(success=True, **response))
+        return BatchQueryResponse(success=True, results=results)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error during /query/batch for session {req.session_id}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/generate-graph", response_model=GraphGenerationResponse)
 async def generate_graph_endpoint(req: GraphGenerationRequest):
     """Generates a knowledge graph from RAG results and stores it in Neo4j."""
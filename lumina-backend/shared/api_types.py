@@ -32,6 +32,14 @@ class QueryRequest(BaseModel):
     query: str
     num_results: int = 5
 
+MAX_BATCH_QUERIES = 64  # Queries per /query/batch request; larger requests are rejected (422)
+
+class BatchQueryRequest(BaseModel):
+    session_id: int
+    queries: List[str] = Field(max_length=MAX_BATCH_QUERIES)
+    num_results: int = 5
+    row_filters: Optional[Any] = None  # Same forms as QueryIntent.row_filters, applied to every query
+
 class QueryResponse(BaseModel):
     success: bool
     query: str
@@ -43,6 +51,10 @@ class QueryResponse(BaseModel):
     # function_result: Optional[Dict[str, Any]] = None  # For function execution results
     function_result: Optional[FunctionResult] = None  # For function execution results
 
+class BatchQueryResponse(BaseModel):
+    success: bool
+    results: List[QueryResponse]  # Aligned with the request's queries; retrieval only, answer is empty
+
 class ExtractionRequest(BaseModel):
     intention: str  # What the user wants to extract
 
@@ -19,6 +19,21 @@ class Settings(BaseSettings):
     
     # graph LLM model
     GRAPH_LLM_MODEL: str
+
+    # Storage precision of new RAG indexes: "none" (float32), "fp16" or "int8"
+    EMBEDDING_QUANTIZATION: str = "none"
+
+    # Let served RAG queries size retrieval from the scores and skip decisive reranks
+    # (changes rankings; opt in). RAGSystem.RERANK_SKIP_MARGIN (0.1 on cosine
+    # similarity) and ADAPTIVE_SCORE_WINDOW are untuned: evaluate before enabling.
+    ADAPTIVE_RETRIEVAL: bool = False
+
+    # Drop near-duplicate candidates (MMR) before they reach the reranker and generator
+    # (reorders and drops candidates; opt in)
+    MMR_DIVERSIFICATION: bool = False
+
+    # Fuse BM25 keyword hits into served row-wise retrieval (changes rankings; opt in)
+    HYBRID_SEARCH: bool = False
     
     model_config = SettingsConfigDict(env_file=".env")
 
@@ -2,10 +2,13 @@ import os
 import csv
 from datetime import datetime
 import asyncio
-from typing import List, Dict, Any
+from typing import AsyncIterator, List, Dict, Any, Optional
 from agents import Runner
+from openai.types.responses import ResponseTextDeltaEvent
 from random import random
 import functools
+import hashlib
+import json
 from shared.api_types import MaxRetriesExceededError
 
 # storage handling
@@ -19,32 +22,94 @@ logger = logging.getLogger(__name__)
 # ============================================================================
 # Helper Functions
 # ============================================================================
+# Column chunks are windows of consecutive records, kept well under the embedding
+# model's input limit (requests are sent with truncate=NONE, so oversize input fails)
+COLUMN_CHUNK_MAX_TOKENS = 512
+CHARS_PER_TOKEN = 4  # rough estimate for English text and numbers
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token count estimate (no tokenizer needed)."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
 def create_column_chunks_from_data(
     extracted_data: List[Dict[str, Any]],
-    columns_to_index: List[str]
-) -> Dict[str, str]:
-    """Creates a dictionary of {column_name: chunk_text} for specified columns."""
-    column_chunks = {}
+    columns_to_index: List[str],
+    record_ids: Optional[List[int]] = None,
+    max_tokens: int = COLUMN_CHUNK_MAX_TOKENS
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Splits each column's values into windows of consecutive records.
+
+    Each window holds as many "- Record ID n: value" lines as fit in max_tokens
+    (estimated); a single value longer than that is cut to fit. Pass the
+    ExtractedRecord ids as record_ids so chunks link back to stable records;
+    otherwise positions are used.
+
+    Returns:
+        {column_name: [{"text": chunk_text, "metadata": {"record_id_start",
+        "record_id_end", "record_count"}}, ...]} for columns that have any values
+    """
+    column_chunks: Dict[str, List[Dict[str, Any]]] = {}
     for col in columns_to_index:
-        chunk_text = f"All data for the column '{col.replace('_', ' ').title()}':\n\n"
-        entries = []
+        title = col.replace('_', ' ').title()
+        # Header is written once the window's ID range is known; reserve room for it
+        budget = max_tokens - estimate_tokens(f"Data for the column '{title}' (Record IDs 0000000000-0000000000):\n\n")
+        windows: List[Dict[str, Any]] = []
+        entries: List[str] = []
+        ids: List[int] = []
+        used = 0
+
+        def flush():
+            header = f"Data for the column '{title}' (Record IDs {ids[0]}-{ids[-1]}):\n\n"
+            windows.append({
+                "text": header + "\n".join(entries),
+                "metadata": {
+                    "record_id_start": ids[0],
+                    "record_id_end": ids[-1],
+                    "record_count": len(ids),
+                },
+            })
+
         for i, record in enumerate(extracted_data):
-            if col in record and record[col]:
-                # Including the record ID helps link back to the full record
-                entries.append(f"- Record ID {i}: {record[col]}")
-        
+            if col not in record or not record[col]:
+                continue
+            record_id = record_ids[i] if record_ids is not None else i
+            # Including the record ID helps link back to the full record
+            entry = f"- Record ID {record_id}: {record[col]}"
+            cost = estimate_tokens(entry)
+            if cost > budget:
+                entry = entry[:max(budget - 1, 1) * CHARS_PER_TOKEN - 3] + "..."
+                cost = estimate_tokens(entry)
+            if entries and used + cost > budget:
+                flush()
+                entries, ids, used = [], [], 0
+            entries.append(entry)
+            ids.append(record_id)
+            used += cost
+
         if entries:
-            chunk_text += "\n".join(entries)
-            column_chunks[col] = chunk_text
-            
+            flush()
+            column_chunks[col] = windows
+
     return column_chunks
 
 
-def create_text_chunks_from_data(extracted_data: List[Dict[str, Any]]) -> List[str]:
-    """Converts extracted data into formatted string chunks for RAG"""
+def create_text_chunks_from_data(
+    extracted_data: List[Dict[str, Any]],
+    record_ids: Optional[List[int]] = None
+) -> List[str]:
+    """
+    Converts extracted data into formatted string chunks for RAG.
+
+    Pass the ExtractedRecord ids as record_ids so a record's chunk text stays
+    the same when other records are added or removed; otherwise positions are used.
+    """
     chunks = []
     for i, record in enumerate(extracted_data):
-        chunk_text = f"Record ID: {i}\n"
+        record_id = record_ids[i] if record_ids is not None else i
+        chunk_text = f"Record ID: {record_id}\n"
         chunk_text += "\n".join(
             f"- {key.replace('_', ' ').title()}: {value}"
             for key, value in record.items()
@@ -90,6 +155,211 @@ async def run_agent_gracefully(agent, input_text):
     return await Runner.run(agent, input=input_text)
 
 
+async def stream_agent_text(agent, input_text) -> AsyncIterator[str]:
+    """
+    Runs a text-output agent and yields its answer as the model streams it.
+    Unlike run_agent_gracefully there is no retry: tokens already sent cannot be taken back.
+    """
+    print(f"Streaming agent: {agent.name}...")
+    result = Runner.run_streamed(agent, input=input_text)
+    async for event in result.stream_events():
+        if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
+            if event.data.delta:
+                yield event.data.delta
+
+
+# ============================================================================
+# Column Summaries
+# ============================================================================
+# Map-reduce summaries of the free-text columns, built at index time and stored
+# next to the session's indexes, so aggregate column questions are answered
+# from a few paragraphs instead of every column chunk
+COLUMN_SUMMARIES_FILE = "column_summaries.json"
+SUMMARY_MIN_AVG_CHARS = 40  # columns with shorter values (names, years, labels) are not summarized
+SUMMARY_MAP_MAX_TOKENS = 6000  # column text (or partial summaries) per LLM call
+SUMMARY_CONCURRENCY = 4
+
+
+def summarizable_columns(extracted_data: List[Dict[str, Any]], columns: List[str]) -> List[str]:
+    """Columns holding free text (long enough on average to be worth summarizing)."""
+    summarizable = []
+    for col in columns:
+        values = [str(record[col]) for record in extracted_data if record.get(col)]
+        if values and sum(len(v) for v in values) / len(values) >= SUMMARY_MIN_AVG_CHARS:
+            summarizable.append(col)
+    return summarizable
+
+
+def _batch_by_tokens(texts: List[str], max_tokens: int) -> List[List[str]]:
+    """Group consecutive texts into batches of at most max_tokens (estimated)."""
+    batches: List[List[str]] = []
+    used = 0
+    for text in texts:
+        cost = estimate_tokens(text)
+        if not batches or used + cost > max_tokens:
+            batches.append([])
+            used = 0
+        batches[-1].append(text)
+        used += cost
+    return batches
+
+
+def _reduce_batches(parts: List[str], max_tokens: int) -> List[List[str]]:
+    """
+    Group partial summaries for the reduce calls so every round makes progress.
+
+    Parts are packed like _batch_by_tokens, but when no two fit together (each
+    is over half the budget) they are paired anyway and cut to fit, so a
+    round always returns fewer parts than it was given.
+    """
+    batches = _batch_by_tokens(parts, max_tokens)
+    if len(batches) < len(parts):
+        return batches
+    batches = [parts[i:i + 2] for i in range(0, len(parts) - 1, 2)]
+    if len(parts) % 2:
+        batches[-1].append(parts[-1])  # no call for a lone part
+    trimmed = []
+    for batch in batches:
+        budget = max_tokens // len(batch)
+        trimmed.append([
+            part if estimate_tokens(part) <= budget else part[:max(budget - 1, 1) * CHARS_PER_TOKEN - 3] + "..."
+            for part in batch
+        ])
+    return trimmed
+
+
+async def summarize_column(
+    agent,
+    column_name: str,
+    windows: List[Dict[str, Any]],
+    max_tokens: int = SUMMARY_MAP_MAX_TOKENS
+) -> str:
+    """
+    Map-reduce summary of one column's chunk windows.
+
+    Windows are summarized in batches of max_tokens (map), then the partial
+    summaries are merged at least two per call until one remains (reduce). A
+    column that fits in one batch takes a single LLM call.
+
+    Args:
+        agent: Text-output agent used for every summarization call
+        column_name: The column being summarized
+        windows: The column's windows from create_column_chunks_from_data
+        max_tokens: Estimated input tokens per call
+
+    Returns:
+        The column summary
+    """
+    title = column_name.replace('_', ' ').title()
+    semaphore = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+
+    async def run(prompt: str) -> str:
+        async with semaphore:
+            result = await run_agent_gracefully(agent, prompt)
+        return str(result.final_output).strip()
+
+    def map_prompt(texts: List[str]) -> str:
+        return f"""Summarize the values of the column '{title}' below.
+    Describe the recurring themes, the range of values and any notable outliers,
+    and cite Record IDs for specific claims. Do not add information that is not in the data.
+
+    {chr(10).join(texts)}"""
+
+    def reduce_prompt(texts: List[str]) -> str:
+        return f"""Merge these partial summaries of the column '{title}' into one summary.
+    Keep the recurring themes, the range of values, notable outliers and the cited Record IDs.
+
+    {(chr(10) * 2).join(texts)}"""
+
+    parts = await asyncio.gather(
+        *(run(map_prompt(batch)) for batch in _batch_by_tokens([w["text"] for w in windows], max_tokens))
+    )
+    while len(parts) > 1:
+        parts = await asyncio.gather(
+            *(run(reduce_prompt(batch)) for batch in _reduce_batches(list(parts), max_tokens))
+        )
+    return parts[0] if parts else ""
+
+
+def _column_source_hash(windows: List[Dict[str, Any]]) -> str:
+    """Content hash of a column's windows; a summary is stale when it changes."""
+    digest = hashlib.sha256()
+    for window in windows:
+        digest.update(window["text"].encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+async def build_column_summaries(
+    agent,
+    column_chunks_map: Dict[str, List[Dict[str, Any]]],
+    existing: Optional[Dict[str, Dict[str, Any]]] = None
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Summarize each column, reusing existing summaries whose column data is unchanged.
+
+    Args:
+        agent: Text-output agent used for the summarization calls
+        column_chunks_map: {column: windows} as returned by create_column_chunks_from_data
+        existing: Previously stored summaries (see load_column_summaries)
+
+    Returns:
+        {column: {"summary", "record_count", "source_hash", "updated_at"}} for
+        every column in column_chunks_map; a column whose summarization fails is left out
+    """
+    existing = existing or {}
+    summaries: Dict[str, Dict[str, Any]] = {}
+    stale = []
+    for col, windows in column_chunks_map.items():
+        source_hash = _column_source_hash(windows)
+        if existing.get(col, {}).get("source_hash") == source_hash:
+            summaries[col] = existing[col]
+        else:
+            stale.append((col, windows, source_hash))
+
+    results = await asyncio.gather(
+        *(summarize_column(agent, col, windows) for col, windows, _ in stale),
+        return_exceptions=True
+    )
+    for (col, windows, source_hash), summary in zip(stale, results):
+        if isinstance(summary, Exception) or not summary:
+            logger.warning(f"Could not summarize column '{col}': {summary!r}")
+            continue
+        summaries[col] = {
+            "summary": summary,
+            "record_count": sum(w["metadata"]["record_count"] for w in windows),
+            "source_hash": source_hash,
+            "updated_at": datetime.now().isoformat(),
+        }
+    logger.info(f"Column summaries: {len(column_chunks_map) - len(stale)} reused, {len(stale)} rebuilt.")
+    return summaries
+
+
+def load_column_summaries(session_dir) -> Dict[str, Dict[str, Any]]:
+    """Read a session's stored column summaries ({} if there are none)."""
+    path = os.path.join(session_dir, COLUMN_SUMMARIES_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable column summaries at {path}: {e}")
+        return {}
+
+
+def save_column_summaries(session_dir, summaries: Dict[str, Dict[str, Any]]) -> None:
+    """Write a session's column summaries atomically (readers never see a partial file)."""
+    os.makedirs(session_dir, exist_ok=True)
+    path = os.path.join(session_dir, COLUMN_SUMMARIES_FILE)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(summaries, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
 async def export_to_csv(records: List[Dict[str, any]], filename: str = "lumina_export") -> Dict[str, any]:
     """
     Exports extracted records to CSV format.
@@ -0,0 +1,82 @@
+"""
+Recall@k / latency benchmark of the RAG index types (flat, HNSW, IVF-PQ), or with
+--quantization, of the embedding storage precisions (float32, fp16, int8):
+recall@k, latency and bytes per vector for each flat / HNSW index type.
+
+Run against a saved index (uses its embeddings.npy; queries are sampled from the
+corpus and perturbed) or against synthetic clustered vectors:
+
+python tests/benchmark_ann_index.py --index-dir /data/indexes/<session_id>/row_wise
+python tests/benchmark_ann_index.py --synthetic 200000 --dim 1024 --queries 200 --k 10
+python tests/benchmark_ann_index.py --synthetic 200000 --dim 1024 --quantization --types flat hnsw
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lumina_agents.ann_index import (  # noqa: E402
+    INDEX_TYPES, QUANTIZATION_TYPES, dequantize_rows, evaluate_index_types, evaluate_quantization,
+)
+
+# Index types with a scalar-quantized variant
+QUANTIZABLE_INDEX_TYPES = ("flat", "hnsw")
+
+
+def normalize(x: np.ndarray) -> np.ndarray:
+    x = np.ascontiguousarray(x, dtype=np.float32)
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+def synthetic_vectors(n: int, d: int, rng: np.random.Generator) -> np.ndarray:
+    """Clustered vectors, closer to real embeddings than isotropic noise."""
+    centers = rng.standard_normal((max(n // 500, 8), d)).astype(np.float32)
+    assignment = rng.integers(0, len(centers), size=n)
+    return normalize(centers[assignment] + 0.35 * rng.standard_normal((n, d)).astype(np.float32))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--index-dir", type=str, help="Saved index directory containing embeddings.npy")
+    parser.add_argument("--synthetic", type=int, default=100_000, help="Number of synthetic vectors")
+    parser.add_argument("--dim", type=int, default=256, help="Dimension of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--types", nargs="+", default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    parser.add_argument("--quantization", action="store_true",
+                        help="Compare storage precisions instead of index types")
+    parser.add_argument("--quantizations", nargs="+", default=list(QUANTIZATION_TYPES), choices=QUANTIZATION_TYPES)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.index_dir:
+        # An int8 index stores codes plus per-row scales
+        scales_path = os.path.join(args.index_dir, "embedding_scales.npy")
+        scales = np.load(scales_path) if os.path.exists(scales_path) else None
+        vectors = normalize(dequantize_rows(np.load(os.path.join(args.index_dir, "embeddings.npy")), scales))
+    else:
+        vectors = synthetic_vectors(args.synthetic, args.dim, rng)
+
+    picks = rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)
+    queries = normalize(vectors[picks] + 0.05 * rng.standard_normal((len(picks), vectors.shape[1])).astype(np.float32))
+
+    print(f"Corpus: {vectors.shape[0]} x {vectors.shape[1]}, {len(queries)} queries, k={args.k}")
+    if args.quantization:
+        report = {
+            index_type: evaluate_quantization(
+                vectors, queries, k=args.k, index_type=index_type, quantizations=args.quantizations
+            )
+            for index_type in args.types if index_type in QUANTIZABLE_INDEX_TYPES
+        }
+    else:
+        report = evaluate_index_types(vectors, queries, k=args.k, index_types=args.types)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
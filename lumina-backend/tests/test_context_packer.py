@@ -0,0 +1,42 @@
+"""
+Tests of the generation context packer (lumina_agents/context_packer.py).
+
+python -m pytest tests/test_context_packer.py
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lumina_agents.context_packer import pack_contexts  # noqa: E402
+
+
+def test_records_sharing_field_values_keep_all_their_fields():
+    # Chunks in the create_text_chunks_from_data format
+    first = "Record ID: 1\n- Material: TiO2\n- Year: 2020\n- Band Gap: 3.2"
+    second = "Record ID: 2\n- Material: ZnO\n- Year: 2020\n- Band Gap: 3.2"
+
+    assert pack_contexts([first, second]) == [first, second]
+
+
+def test_identical_passages_are_packed_once():
+    passage = "Record ID: 1\n- Material: TiO2"
+
+    assert pack_contexts([passage, passage, " record id: 1\n- material:  TiO2 "]) == [passage]
+
+
+def test_repeated_table_header_is_dropped_from_later_rows():
+    header = "| Material | Band Gap |"
+    rows = [f"{header}\n| TiO2 | 3.2 |", f"{header}\n| ZnO | 3.2 |"]
+
+    assert pack_contexts(rows) == [rows[0], "| ZnO | 3.2 |"]
+
+
+def test_packing_stops_at_the_token_budget():
+    passages = [f"Record ID: {i}\n- Notes: " + "word " * 100 for i in range(10)]
+
+    packed = pack_contexts(passages, max_tokens=300, max_passage_tokens=600)
+
+    assert 1 <= len(packed) < len(passages)
+    assert sum(len(p) for p in packed) <= 300 * 4